@@ -1 +1,12 @@
-from . import presentation, pdutils, nbutils, skutils, oututils, logutils, pltutils
+import importlib
+
+__all__ = ["presentation", "pdutils", "nbutils", "skutils", "oututils", "logutils", "pltutils"]
+
+
+def __getattr__(name):
+    # the subpackages are imported on first use, so "import brutils.logutils" does not pay for pandas and sklearn
+    if name in __all__:
+        module = importlib.import_module("." + name, __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -1,4 +1,7 @@
-from .br_logging import setup_logging
+from .br_logging import setup_logging, stop_listener
+from .mp_logging import LogAggregator, logged_task, set_task_id, task_context, connect_worker
+from .spans import span, configure_spans, close_spans, read_spans, summarize_spans
+from .resources import ResourceSampler, sample_resources
+from .rotating import BufferedRotatingFileHandler
+from .analyze import parse_log, read_header, analyze_log, compare_runs
 import logging
-
-
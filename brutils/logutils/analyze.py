@@ -0,0 +1,237 @@
+"""
+Read the log files written by setup_logging back in and report where the time went
+
+The time between a message and the next one is charged to the source file of the first message,
+which is the code that ran in between. analyze_log reads a log one line at a time and keeps only
+per file totals and the slowest stretches, so logs of any size can be analyzed.
+compare_runs groups logs by script (from the header block) and shows how the run time changes
+between runs and commits.
+
+    python -m brutils.logutils.analyze logs/*.log --top 5
+    >>> analyze_log("logs/p_01_script_20160714_184218.log")["slowest"][0]
+"""
+
+import argparse
+import datetime
+import gzip
+import heapq
+import re
+import sys
+from collections import OrderedDict
+
+_LINE = re.compile(r"^(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d),(\d{3}) - (.*?) - (DEBUG|INFO|WARNING|ERROR|CRITICAL) - (.*)$")
+_HEADER_FIELDS = {
+    "Script full path": "script",
+    "Script Git Commit hash": "commit",
+    "Script start time": "start",
+    "Script called by user": "user",
+}
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt")
+    return open(path)
+
+
+def read_header(path):
+    """dict of script, commit, start (datetime), user from the header block of a log, missing fields are None"""
+    header = dict((key, None) for key in _HEADER_FIELDS.values())
+    with _open(path) as f:
+        for line in f:
+            if line.startswith("SCRIPT LOG:") or _LINE.match(line):
+                break
+            key, _, value = line.partition(":")
+            if key in _HEADER_FIELDS:
+                header[_HEADER_FIELDS[key]] = value.strip()
+    if header["start"]:
+        # str(datetime) leaves the microseconds out when they are 0
+        header["start"] = datetime.datetime.fromisoformat(header["start"])
+    return header
+
+
+def parse_log(path):
+    """
+    yields (timestamp, source file, level, message) for each record of a log
+
+    lines that are not records (the header, tracebacks, multi-line messages) are skipped
+    """
+    with _open(path) as f:
+        for line in f:
+            m = _LINE.match(line)
+            if m is None:
+                continue
+            g = m.groups()
+            timestamp = datetime.datetime(int(g[0]), int(g[1]), int(g[2]), int(g[3]), int(g[4]), int(g[5]),
+                                          int(g[6]) * 1000)
+            yield timestamp, g[7], g[8], g[9]
+
+
+def analyze_log(path, top=10):
+    """
+    Profile one log file
+
+    Outputs
+    -------
+    dict with
+        path, script, commit, user: from the header
+        start, end: datetimes of the start time in the header (or the first record) and the last record
+        seconds: run time from start to the last record
+        records: number of records, levels: dict of level -> count
+        by_file: OrderedDict of source file -> {"records", "seconds"}, the time after the file's messages,
+            largest first
+        slowest: list of the <top> longest stretches between two messages, largest first, as dicts of
+            seconds, file, message, at (datetime of the message) and next_file, next_message
+    """
+    header = read_header(path)
+    by_file = {}
+    levels = {}
+    slowest = []
+    records = 0
+    previous = None
+    first = None
+    for record in parse_log(path):
+        timestamp, source, level, message = record
+        records += 1
+        levels[level] = levels.get(level, 0) + 1
+        stats = by_file.setdefault(source, {"records": 0, "seconds": 0.})
+        stats["records"] += 1
+        if first is None:
+            first = timestamp
+        if previous is not None:
+            gap = (timestamp - previous[0]).total_seconds()
+            by_file[previous[1]]["seconds"] += gap
+            item = (gap, records, previous, record)
+            # a bounded heap keeps memory flat however long the log is
+            if len(slowest) < top:
+                heapq.heappush(slowest, item)
+            elif slowest and gap > slowest[0][0]:
+                heapq.heapreplace(slowest, item)
+        previous = record
+    start = header["start"] or first
+    end = previous[0] if previous else None
+    return {
+        "path": path,
+        "script": header["script"],
+        "commit": header["commit"],
+        "user": header["user"],
+        "start": start,
+        "end": end,
+        "seconds": (end - start).total_seconds() if start and end else None,
+        "records": records,
+        "levels": levels,
+        "by_file": OrderedDict(sorted(by_file.items(), key=lambda kv: -kv[1]["seconds"])),
+        "slowest": [{"seconds": gap, "file": prev[1], "message": prev[3], "at": prev[0],
+                     "next_file": rec[1], "next_message": rec[3]}
+                    for gap, _, prev, rec in sorted(slowest, key=lambda x: (-x[0], x[1]))],
+    }
+
+
+def _merge_segments(profiles, top):
+    """one analyze_log result for the segments of a rotated log, the gaps across segment boundaries are not counted"""
+    profiles = sorted(profiles, key=lambda p: p["end"] or datetime.datetime.min)
+    merged = dict(profiles[-1])
+    merged["segments"] = len(profiles)
+    if len(profiles) == 1:
+        return merged
+    merged["records"] = sum(p["records"] for p in profiles)
+    merged["levels"] = {}
+    by_file = {}
+    for p in profiles:
+        for level, n in p["levels"].items():
+            merged["levels"][level] = merged["levels"].get(level, 0) + n
+        for source, stats in p["by_file"].items():
+            total = by_file.setdefault(source, {"records": 0, "seconds": 0.})
+            total["records"] += stats["records"]
+            total["seconds"] += stats["seconds"]
+    merged["by_file"] = OrderedDict(sorted(by_file.items(), key=lambda kv: -kv[1]["seconds"]))
+    merged["slowest"] = sorted((s for p in profiles for s in p["slowest"]), key=lambda s: -s["seconds"])[:top]
+    return merged
+
+
+def compare_runs(paths, top=0):
+    """
+    Profile several logs and group them by script
+
+    Outputs
+    -------
+    OrderedDict of script path -> list of analyze_log results sorted by start time,
+    each with "change": the difference in seconds from the previous run of the script (None for the first)
+
+    the rotated segments of one run (same script and start time in their headers) are combined into one result,
+    with "segments": the number of files and "path": the last of them
+    """
+    segments = OrderedDict()
+    for path in paths:
+        profile = analyze_log(path, top=top)
+        segments.setdefault((profile["script"], profile["start"]), []).append(profile)
+    runs = {}
+    for (script, _), profiles in segments.items():
+        runs.setdefault(script, []).append(_merge_segments(profiles, top))
+    result = OrderedDict()
+    for script in sorted(runs, key=lambda s: s or ""):
+        ordered = sorted(runs[script], key=lambda p: p["start"] or datetime.datetime.min)
+        previous = None
+        for profile in ordered:
+            if previous is None or profile["seconds"] is None or previous["seconds"] is None:
+                profile["change"] = None
+            else:
+                profile["change"] = profile["seconds"] - previous["seconds"]
+            previous = profile
+        result[script] = ordered
+    return result
+
+
+def _short(message, width=60):
+    return message if len(message) <= width else message[:width - 3] + "..."
+
+
+def format_profile(profile, top=10):
+    """a text report of one analyze_log result"""
+    lines = ["%s" % profile["path"],
+             "  script %s, commit %s, started %s, ran %s, %s records %s" % (
+                 profile["script"], (profile["commit"] or "n/a")[:10], profile["start"],
+                 "%.3fs" % profile["seconds"] if profile["seconds"] is not None else "n/a",
+                 profile["records"], profile["levels"]),
+             "  time after the messages of each file:"]
+    for source, stats in profile["by_file"].items():
+        lines.append("    %-30s %10.3fs  %6d records" % (source, stats["seconds"], stats["records"]))
+    if profile["slowest"]:
+        lines.append("  slowest stretches:")
+        for s in profile["slowest"][:top]:
+            lines.append("    %10.3fs  %s  %s: %s  ->  %s: %s" % (
+                s["seconds"], s["at"], s["file"], _short(s["message"]), s["next_file"], _short(s["next_message"])))
+    return "\n".join(lines)
+
+
+def format_runs(runs):
+    """a text table of a compare_runs result"""
+    lines = []
+    for script, profiles in runs.items():
+        lines.append("%s" % script)
+        for p in profiles:
+            change = "" if p["change"] is None else "%+.3fs" % p["change"]
+            lines.append("  %-26s %-10s %10s %10s  %s" % (
+                p["start"], (p["commit"] or "n/a")[:10],
+                "%.3fs" % p["seconds"] if p["seconds"] is not None else "n/a", change, p["path"]))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report where the time went in setup_logging log files")
+    parser.add_argument("logs", nargs="+", help="log files (.log or .log.gz)")
+    parser.add_argument("--top", type=int, default=5, help="number of slowest stretches shown per log")
+    parser.add_argument("--runs-only", action="store_true", help="only show the run times per script")
+    args = parser.parse_args(argv)
+    runs = compare_runs(args.logs, top=args.top)
+    if not args.runs_only:
+        for profiles in runs.values():
+            for p in profiles:
+                print(format_profile(p, top=args.top))
+                print("")
+    print(format_runs(runs))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,16 @@
 import os
 import sys
+import atexit
+import copy
+import io
 import logging
+import logging.handlers
+import queue
 import time, datetime
 import pwd
-from git import Repo, InvalidGitRepositoryError
+from .spans import configure_spans
+from .resources import ResourceSampler
+from .rotating import BufferedRotatingFileHandler
 
 def ensure_dir(f):
     """ensure the directory where file f is found exists
@@ -36,6 +43,9 @@ def up_one_level(from_dir):
     next_dir = os.path.abspath(os.path.join(from_dir, '..'))
     return next_dir
 
+# directory -> repo root (or None), so every lookup in a process walks the parents at most once
+_repo_roots = {}
+
 def find_repo_root(d):
     """finds the git repository root of directory <d>
 
@@ -49,17 +59,175 @@ def find_repo_root(d):
     string: directory path of the git repository root
 
     This function searches upward from <d>  for a file called '.git'
+    The result is cached for the life of the process
     """
-    f = '.git'
-    if file_in_dir(f, d):
-        return d
-    elif d == "/":
+    d = os.path.abspath(d)
+    if d in _repo_roots:
+        return _repo_roots[d]
+    visited = []
+    root = None
+    while True:
+        if d in _repo_roots:
+            root = _repo_roots[d]
+            break
+        visited.append(d)
+        if os.path.exists(os.path.join(d, '.git')):
+            root = d
+            break
+        if d == "/":
+            break
+        d = up_one_level(d)
+    for v in visited:
+        _repo_roots[v] = root
+    return root
+
+def _git_dir(repo_dir):
+    """the git directory of a repo root, following the "gitdir: <path>" file of worktrees and submodules"""
+    git_path = os.path.join(repo_dir, '.git')
+    if os.path.isdir(git_path):
+        return git_path
+    with open(git_path) as f:
+        line = f.readline().strip()
+    if not line.startswith("gitdir:"):
+        raise ValueError("Unexpected content in %s" % git_path)
+    return os.path.normpath(os.path.join(repo_dir, line[len("gitdir:"):].strip()))
+
+def _resolve_ref(git_dir, ref):
+    """the commit hash of <ref> (e.g. refs/heads/master) from the loose ref files or packed-refs, or None"""
+    common = git_dir
+    if os.path.exists(os.path.join(git_dir, 'commondir')):
+        # linked worktrees keep their branches in the main repository's git directory
+        with open(os.path.join(git_dir, 'commondir')) as f:
+            common = os.path.normpath(os.path.join(git_dir, f.read().strip()))
+    for d in (git_dir, common):
+        path = os.path.join(d, ref)
+        if os.path.isfile(path):
+            with open(path) as f:
+                return f.read().strip()
+    packed = os.path.join(common, 'packed-refs')
+    if os.path.isfile(packed):
+        with open(packed) as f:
+            for line in f:
+                if line.startswith('#') or line.startswith('^'):
+                    continue
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    return None
+
+def git_head_hash(repo_dir):
+    """returns the commit hash of HEAD of the git repository at <repo_dir>, or None
+
+    HEAD and the refs are read straight from the .git directory, GitPython is only
+    imported if that fails (for example for a symbolic ref to another symbolic ref)
+    """
+    try:
+        git_dir = _git_dir(repo_dir)
+        with open(os.path.join(git_dir, 'HEAD')) as f:
+            head = f.read().strip()
+        if head.startswith('ref:'):
+            sha = _resolve_ref(git_dir, head[len('ref:'):].strip())
+        else:
+            sha = head
+        if sha and len(sha) in (40, 64):
+            return sha
+    except (IOError, OSError, ValueError):
+        pass
+    try:
+        from git import Repo
+        return Repo(repo_dir).head.commit.hexsha
+    except Exception:
+        # GitPython is missing, or the branch has no commits yet
         return None
-    else:
-        return find_repo_root(up_one_level(d))
 
 
-def setup_logging(filename=None, level=logging.INFO, logging_directory = "./logs", make_file=True):
+class _BoundedQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler for a bounded queue, when_full is "block" (wait for space) or "drop" (count and discard)"""
+
+    def __init__(self, q, when_full="block"):
+        logging.handlers.QueueHandler.__init__(self, q)
+        if when_full not in ("block", "drop"):
+            raise ValueError("when_full must be 'block' or 'drop', got %s" % when_full)
+        self.when_full = when_full
+        self.dropped = 0
+
+    def prepare(self, record):
+        # merge the arguments into the message now, in case they change before the listener formats it,
+        # but leave the rest of the formatting to the listener's handlers
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.when_full == "block":
+            self.queue.put(record)
+        else:
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # the stock listener uses put_nowait, which fails when the bounded queue is full
+        self.queue.put(self._sentinel)
+
+
+# the QueueListener of the non_blocking mode, None when logging is synchronous
+_listener = None
+_queue_handler = None
+
+def stop_listener():
+    """write out the queued records and stop the non_blocking listener thread, safe to call more than once"""
+    global _listener, _queue_handler
+    listener, handler = _listener, _queue_handler
+    _listener = _queue_handler = None
+    if listener is None:
+        return
+    logging.getLogger('').removeHandler(handler)
+    listener.stop()
+    if handler.dropped:
+        # the listener is stopped, so write straight to its handlers
+        record = logging.makeLogRecord({"msg": "%s log records were dropped because the logging queue was full" % handler.dropped,
+                                        "levelno": logging.WARNING, "levelname": "WARNING",
+                                        "filename": os.path.basename(__file__)})
+        for h in listener.handlers:
+            h.handle(record)
+    for h in listener.handlers:
+        h.flush()
+        logging.getLogger('').addHandler(h)
+
+def _make_non_blocking(queue_size, when_full):
+    """move the root logger's handlers behind a queue that a listener thread drains"""
+    global _listener, _queue_handler
+    stop_listener()
+    root = logging.getLogger('')
+    handlers = root.handlers[:]
+    for h in handlers:
+        root.removeHandler(h)
+    q = queue.Queue(maxsize=queue_size)
+    _queue_handler = _BoundedQueueHandler(q, when_full=when_full)
+    _listener = _QueueListener(q, *handlers, respect_handler_level=True)
+    _listener.start()
+    root.addHandler(_queue_handler)
+
+# the ResourceSampler started by setup_logging(resource_interval=...)
+_resource_sampler = None
+
+# logging's own atexit flush runs after this one (atexit is last in, first out)
+atexit.register(stop_listener)
+
+
+def setup_logging(filename=None, level=logging.INFO, logging_directory = "./logs", make_file=True,
+                  non_blocking=False, queue_size=10000, when_full="block", spans=False, span_sample_rate=1.0,
+                  resource_interval=None, buffer_records=None, flush_interval=5.0, max_bytes=None,
+                  backup_count=None, compress_rotated=True):
     """setup default logging for dslib
 
     INPUTS
@@ -79,6 +247,45 @@ def setup_logging(filename=None, level=logging.INFO, logging_directory = "./logs
         True will make a persistent log file and write to it in addition to writing to stdout
         False will write the logging to stdout
 
+    non_blocking: boolean (default: False)
+        True puts the file and console handlers behind a queue that a background thread writes out,
+        so logging calls do not wait on disk or terminal I/O.
+        The queue is written out by the uncaught exception hook, at interpreter exit and by stop_listener()
+
+    queue_size: int (default: 10000)
+        The most records waiting in the queue in non_blocking mode
+
+    when_full: string (default: "block")
+        What a logging call does when the queue is full, "block" waits for space and "drop" discards
+        the record (the number of dropped records is logged when the listener stops)
+
+    spans: boolean (default: False)
+        True writes the timing spans of logutils.span to <log file name>.spans.jsonl next to the log file
+
+    span_sample_rate: float (default: 1.0)
+        The fraction of top level spans that are written
+
+    resource_interval: float (default: None)
+        Seconds between samples of the process's memory, CPU time, open files and garbage collections,
+        which are written to the log by a background thread along with the peaks at exit. None does not sample
+
+    buffer_records: int (default: None)
+        Keep up to this many records in memory and write them to the log file in one go, also every
+        flush_interval seconds and right away for ERROR and above. None writes and flushes every record
+
+    flush_interval: float (default: 5.0)
+        The most seconds a record waits in the buffer
+
+    max_bytes: int (default: None)
+        Rotate the log file to <log file>.00001, .00002, ... before it grows past this size,
+        the rotated segments are gzipped in a background thread. None never rotates
+
+    backup_count: int (default: None)
+        The number of rotated segments kept, None keeps them all
+
+    compress_rotated: boolean (default: True)
+        Gzip the rotated segments
+
     OUTPUTS
     -------
     logging.Logger object
@@ -101,28 +308,43 @@ def setup_logging(filename=None, level=logging.INFO, logging_directory = "./logs
     repo_dir = find_repo_root(os.path.dirname(os.path.abspath(sys.argv[0])))
     if print_to_log and make_file:
         ensure_dir(log_file)
-        with open(log_file, 'w') as f:
-            f.write("***AU LOGGING***\n")
-            f.write("SCRIPT INFO:\n")
-            f.write("Script full path: %s\n" % os.path.abspath(sys.argv[0]))
-            if repo_dir is not None:
-                f.write("Script Git Commit hash: %s\n" % Repo(repo_dir).head.commit.hexsha)
-            else:
-                f.write("Script was not in a git repository, no version info available.\n")
-            f.write("Script start time: %s\n" % datetime.datetime.now())
-            f.write("Script called by user: %s\n" % pwd.getpwuid(os.getuid()).pw_name)
-            # TODO: add in AU command line functionality here
-            if len(sys.argv) > 1:
-                f.write("Command line arguments from sys.argv:")
-                for cmdarg in sys.argv[1:]:
-                    f.write("\t%s" % cmdarg)
-            else:
-                f.write("Script called with no command line arguments.")
-            f.write("\n\nSCRIPT LOG:\n")
+        # the header is also written at the top of each rotated segment (max_bytes)
+        f = io.StringIO()
+        f.write("***AU LOGGING***\n")
+        f.write("SCRIPT INFO:\n")
+        f.write("Script full path: %s\n" % os.path.abspath(sys.argv[0]))
+        head_hash = git_head_hash(repo_dir) if repo_dir is not None else None
+        if head_hash is not None:
+            f.write("Script Git Commit hash: %s\n" % head_hash)
+        else:
+            f.write("Script was not in a git repository, no version info available.\n")
+        f.write("Script start time: %s\n" % datetime.datetime.now())
+        f.write("Script called by user: %s\n" % pwd.getpwuid(os.getuid()).pw_name)
+        # TODO: add in AU command line functionality here
+        if len(sys.argv) > 1:
+            f.write("Command line arguments from sys.argv:")
+            for cmdarg in sys.argv[1:]:
+                f.write("\t%s" % cmdarg)
+        else:
+            f.write("Script called with no command line arguments.")
+        f.write("\n\nSCRIPT LOG:\n")
+        header = f.getvalue()
+        with open(log_file, 'w') as out:
+            out.write(header)
         # with open(sys.argv[0], 'rb') as orig_fil:
         #     for line in orig_fil:
         #         print line
-        logging.basicConfig(filename=log_file, level=level, format=fmt_string)
+        if (buffer_records or max_bytes) and logging.getLogger('').handlers:
+            # basicConfig leaves a configured root logger alone, so the file would never be written
+            logging.warning("The root logger already has handlers, buffer_records and max_bytes are ignored "
+                            "and %s is not written" % log_file)
+        elif buffer_records or max_bytes:
+            file_handler = BufferedRotatingFileHandler(log_file, max_bytes=max_bytes or 0, backup_count=backup_count or 0,
+                                                       compress=compress_rotated, buffer_records=buffer_records or 1,
+                                                       flush_interval=flush_interval, header=header)
+            logging.basicConfig(handlers=[file_handler], level=level, format=fmt_string)
+        else:
+            logging.basicConfig(filename=log_file, level=level, format=fmt_string)
         # set up logging to console
         console = logging.StreamHandler()
         console.setLevel(level)
@@ -134,9 +356,24 @@ def setup_logging(filename=None, level=logging.INFO, logging_directory = "./logs
     else:
         logging.basicConfig(level=level, format=fmt_string)
 
+    if non_blocking:
+        _make_non_blocking(queue_size, when_full)
+
+    if spans and print_to_log and make_file:
+        configure_spans(os.path.splitext(log_file)[0] + ".spans.jsonl", sample_rate=span_sample_rate)
+
+    global _resource_sampler
+    if _resource_sampler is not None:
+        _resource_sampler.stop()
+        _resource_sampler = None
+    if resource_interval is not None:
+        _resource_sampler = ResourceSampler(resource_interval).start()
+
     # set up sys.excepthook to catch an unhandled exception to the log
     def _exception_hook(exc_type, exc_value, exc_traceback):
         logging.error("Uncaught Exception!", exc_info=(exc_type, exc_value, exc_traceback))
+        # the process is about to end, make sure the queued records (and this one) are written
+        stop_listener()
 
     sys.excepthook = _exception_hook
     return logging.getLogger('')
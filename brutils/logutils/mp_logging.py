@@ -0,0 +1,209 @@
+"""
+Send the log records of worker processes to one writer in the parent process
+
+Workers that inherit the handlers made by setup_logging all write to the same file at once, which
+interleaves and corrupts lines, and spawned workers log nowhere. A LogAggregator runs a listener
+thread in the parent and each worker gets a handler that forwards its records to it, over a
+multiprocessing queue (for pools started by this process) or a Unix socket (for any local process).
+The parent passes every record to its own loggers, so the records go wherever setup_logging sends them,
+with "[pid <pid> task <task id>]" in front of the message.
+
+    logger = setup_logging()
+    with LogAggregator() as aggregator:
+        with ProcessPoolExecutor(4, **aggregator.pool_kwargs()) as executor:
+            executor.map(work, chunks)
+
+    @logged_task
+    def work(chunk):
+        logging.info("working")    # -> "... - INFO - [pid 4242 task 4242-1] working"
+
+Use set_task_id or task_context in a worker to set your own task ids.
+"""
+
+import contextlib
+import functools
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import pickle
+import socketserver
+import struct
+import tempfile
+import threading
+
+_task = threading.local()
+_task_counter = [0]
+
+
+def set_task_id(task_id):
+    """set the task id that is added to this thread's log records"""
+    _task.id = task_id
+
+
+def get_task_id():
+    return getattr(_task, "id", None)
+
+
+@contextlib.contextmanager
+def task_context(task_id):
+    """log the records of the block with <task_id>"""
+    previous = get_task_id()
+    set_task_id(task_id)
+    try:
+        yield
+    finally:
+        set_task_id(previous)
+
+
+def logged_task(func):
+    """decorator: every call of func gets a new task id "<pid>-<n>" for its log records"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _task_counter[0] += 1
+        with task_context("%s-%s" % (os.getpid(), _task_counter[0])):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class _TaskFilter(logging.Filter):
+    def filter(self, record):
+        record.pid = os.getpid()
+        record.task_id = get_task_id()
+        return True
+
+
+def _init_worker(target, level):
+    """initializer of the worker processes: replace the inherited handlers with one that forwards to <target>"""
+    root = logging.getLogger('')
+    for h in root.handlers[:]:
+        # the handlers inherited through fork belong to the parent, do not write to its files from here
+        root.removeHandler(h)
+    if isinstance(target, str):
+        handler = logging.handlers.SocketHandler(target, None)
+    else:
+        handler = logging.handlers.QueueHandler(target)
+    handler.addFilter(_TaskFilter())
+    root.addHandler(handler)
+    root.setLevel(level)
+
+
+class _Dispatch(logging.Handler):
+    """handles the forwarded records with the parent's loggers"""
+
+    def __init__(self, prefix):
+        logging.Handler.__init__(self)
+        self.prefix = prefix
+
+    def emit(self, record):
+        if self.prefix:
+            pid = getattr(record, "pid", record.process)
+            task_id = getattr(record, "task_id", None)
+            if task_id is None:
+                record.msg = "[pid %s] %s" % (pid, record.getMessage())
+            else:
+                record.msg = "[pid %s task %s] %s" % (pid, task_id, record.getMessage())
+            record.args = None
+        logger = logging.getLogger('') if record.name == "root" else logging.getLogger(record.name)
+        logger.handle(record)
+
+
+class _RecordStreamHandler(socketserver.StreamRequestHandler):
+    """reads the length prefixed pickled records that logging.handlers.SocketHandler sends"""
+
+    def handle(self):
+        while True:
+            header = self.rfile.read(4)
+            if len(header) < 4:
+                return
+            size = struct.unpack(">L", header)[0]
+            data = self.rfile.read(size)
+            if len(data) < size:
+                return
+            self.server.dispatch.handle(logging.makeLogRecord(pickle.loads(data)))
+
+
+class _RecordServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class LogAggregator(object):
+    """
+    Collects the log records of worker processes and writes them through the parent's loggers
+
+    Parameters
+    ----------
+    transport: "queue" (default) for Pool / ProcessPoolExecutor workers started by this process,
+        or "socket" to listen on a Unix socket that any local process can connect to
+    address: path of the Unix socket, defaults to a new temporary file
+    level: the level of the workers' root loggers
+    prefix: bool, put "[pid <pid> task <task id>]" in front of each forwarded message
+
+    The socket transport unpickles what it receives, the socket file is only accessible to this user.
+    """
+
+    def __init__(self, transport="queue", address=None, level=logging.INFO, prefix=True):
+        if transport not in ("queue", "socket"):
+            raise ValueError("transport must be 'queue' or 'socket', got %s" % transport)
+        self.transport = transport
+        self.level = level
+        self.dispatch = _Dispatch(prefix)
+        self._listener = None
+        self._server = None
+        self._tmpdir = None
+        if transport == "queue":
+            self.queue = multiprocessing.Queue(-1)
+            self.target = self.queue
+        else:
+            if address is None:
+                self._tmpdir = tempfile.mkdtemp(prefix="brutils-logs-")
+                address = os.path.join(self._tmpdir, "log.sock")
+            self.address = address
+            self.target = address
+
+    def start(self):
+        if self.transport == "queue":
+            self._listener = logging.handlers.QueueListener(self.queue, self.dispatch)
+            self._listener.start()
+        else:
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            self._server = _RecordServer(self.address, _RecordStreamHandler)
+            os.chmod(self.address, 0o600)
+            self._server.dispatch = self.dispatch
+            self._thread = threading.Thread(target=self._server.serve_forever, name="brutils-log-aggregator")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def pool_kwargs(self):
+        """keyword arguments for multiprocessing.Pool or ProcessPoolExecutor that set up worker logging"""
+        return {"initializer": _init_worker, "initargs": (self.target, self.level)}
+
+    def stop(self):
+        """write out the records received so far and stop listening"""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            if self._tmpdir is not None:
+                os.rmdir(self._tmpdir)
+                self._tmpdir = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+def connect_worker(address, level=logging.INFO):
+    """set up logging in any local process to forward to the LogAggregator listening on the socket <address>"""
+    _init_worker(address, level)
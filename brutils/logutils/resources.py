@@ -0,0 +1,133 @@
+"""
+Log the process's memory, CPU time, open files and garbage collections at a fixed interval
+
+    setup_logging(resource_interval=60)     # or ResourceSampler(60).start()
+
+A daemon thread reads /proc/self (no extra dependencies) every interval seconds and logs one line:
+
+    ... - INFO - resources rss=1534.2MB cpu=812.4s fds=14 threads=3 gc=102/9/2
+
+and at exit (or on stop()) it logs the peak usage. Where /proc is not available the sampler
+falls back to the resource module and logs only what it provides.
+"""
+
+import atexit
+import gc
+import logging
+import os
+import resource
+import threading
+import time
+
+
+def _read_status():
+    """dict of the fields of /proc/self/status that are used, sizes in MB"""
+    fields = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                fields[key] = int(value.split()[0]) / 1024.
+            elif key == "Threads":
+                fields[key] = int(value)
+    return fields
+
+
+def sample_resources():
+    """
+    one sample of this process's resource usage, a dict of
+        rss_mb, peak_rss_mb (the high water mark since start), cpu_seconds (user + system),
+        fds (open file descriptors), threads, gc_collections (per generation)
+    values that can not be read are None
+    """
+    times = os.times()
+    sample = {
+        "rss_mb": None,
+        "peak_rss_mb": None,
+        "cpu_seconds": times.user + times.system,
+        "fds": None,
+        "threads": threading.active_count(),
+        "gc_collections": [s["collections"] for s in gc.get_stats()],
+    }
+    try:
+        status = _read_status()
+        sample["rss_mb"] = status.get("VmRSS")
+        sample["peak_rss_mb"] = status.get("VmHWM")
+        sample["threads"] = status.get("Threads", sample["threads"])
+        sample["fds"] = len(os.listdir("/proc/self/fd"))
+    except (IOError, OSError):
+        # no /proc, ru_maxrss is in KB on linux and bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        sample["peak_rss_mb"] = maxrss / 2.**20 if os.uname()[0] == "Darwin" else maxrss / 1024.
+    return sample
+
+
+def _fmt(value, fmt):
+    return "n/a" if value is None else fmt % value
+
+
+class ResourceSampler(object):
+    """
+    Parameters
+    ----------
+    interval: float, seconds between samples
+    logger: the logger the samples are written to, defaults to the "brutils.resources" logger
+    level: the level of the sample lines
+
+    Attributes
+    ----------
+    peaks: dict of the highest rss_mb, fds and threads seen so far
+    """
+
+    def __init__(self, interval=60, logger=None, level=logging.INFO):
+        self.interval = interval
+        self.logger = logger or logging.getLogger("brutils.resources")
+        self.level = level
+        self.peaks = {"rss_mb": None, "fds": None, "threads": None}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._start = None
+
+    def sample(self):
+        """take and log one sample"""
+        s = sample_resources()
+        self.samples += 1
+        for key in self.peaks:
+            if s[key] is not None and (self.peaks[key] is None or s[key] > self.peaks[key]):
+                self.peaks[key] = s[key]
+        self.logger.log(self.level, "resources rss=%s cpu=%.1fs fds=%s threads=%s gc=%s" % (
+            _fmt(s["rss_mb"], "%.1fMB"), s["cpu_seconds"], _fmt(s["fds"], "%d"), s["threads"],
+            "/".join(str(c) for c in s["gc_collections"])))
+        return s
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception:
+                self.logger.exception("The resource sampler failed")
+                return
+
+    def start(self):
+        self._start = time.time()
+        self._stop = threading.Event()
+        self.sample()
+        self._thread = threading.Thread(target=self._run, name="brutils-resource-sampler")
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        """stop sampling and log the peak usage, safe to call more than once"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        last = self.sample()
+        self.logger.log(self.level, "resource peaks over %.0fs: rss=%s (high water mark %s) fds=%s threads=%s cpu=%.1fs" % (
+            time.time() - self._start, _fmt(self.peaks["rss_mb"], "%.1fMB"), _fmt(last["peak_rss_mb"], "%.1fMB"),
+            _fmt(self.peaks["fds"], "%d"), _fmt(self.peaks["threads"], "%d"), last["cpu_seconds"]))
+        atexit.unregister(self.stop)
@@ -0,0 +1,175 @@
+"""
+A log file handler for long running jobs: buffered writes, rotation by size and gzipped segments
+
+    setup_logging(buffer_records=1000, max_bytes=2**28, backup_count=20)
+    # or logging.getLogger('').addHandler(BufferedRotatingFileHandler("run.log", max_bytes=2**28))
+
+Records are kept in memory and written in one call when buffer_records or buffer_bytes is reached,
+every flush_interval seconds, and right away for records at flush_level (ERROR) or above, so the
+lines before an error are on disk when it is logged. Each write is one system call instead of a
+write and flush per record, which matters on network filesystems.
+
+When the file would grow past max_bytes it is closed and renamed to <name>.00001, <name>.00002, ...
+(numbers only go up, so a segment is never renamed again while it is compressed) and a background
+thread gzips it to <name>.00001.gz and deletes the oldest segments beyond backup_count. Each new
+file starts with the header (setup_logging passes its run header), so every segment that is kept
+can still be told apart by script, commit and start time.
+"""
+
+import glob
+import gzip
+import logging
+import os
+import re
+import shutil
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _gzip_segment(path):
+    """gzip <path> to <path>.gz through a temporary file, then remove <path>"""
+    tmp = path + ".gz.tmp"
+    with open(path, "rb") as src, gzip.open(tmp, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 2**20)
+    os.replace(tmp, path + ".gz")
+    os.remove(path)
+
+
+class BufferedRotatingFileHandler(logging.Handler):
+    """
+    Parameters
+    ----------
+    filename: string, the log file, appended to if it exists
+    max_bytes: int, rotate before the file grows past this size, 0 never rotates
+    backup_count: int, the number of rotated segments kept, 0 keeps them all
+    compress: bool, gzip the rotated segments in a background thread
+    buffer_records: int, write once this many records are buffered, 1 writes every record
+    buffer_bytes: int, write once the buffered records are this large
+    flush_interval: float, seconds between writes of the buffer by a background thread, None only writes
+        when the buffer is full, on flush_level records and on close
+    flush_level: records at this level or above are written right away with everything buffered before them
+    encoding: the encoding of the file
+    header: string written at the top of each file started after a rotation
+    """
+
+    def __init__(self, filename, max_bytes=0, backup_count=0, compress=True, buffer_records=1000,
+                 buffer_bytes=2**20, flush_interval=5.0, flush_level=logging.ERROR, encoding="utf-8",
+                 header=None):
+        logging.Handler.__init__(self)
+        self.baseFilename = os.path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+        self.buffer_records = buffer_records
+        self.buffer_bytes = buffer_bytes
+        self.flush_interval = flush_interval
+        self.flush_level = flush_level
+        self.encoding = encoding
+        self.header = header.encode(encoding) if header else b""
+        self._buffer = []
+        self._buffered = 0
+        self._stream = open(self.baseFilename, "ab")
+        self._size = self._stream.tell()
+        self._segment = self._last_segment()
+        self._compressor = ThreadPoolExecutor(1)
+        self._stopping = threading.Event()
+        self._flusher = None
+        if flush_interval is not None and buffer_records > 1:
+            self._flusher = threading.Thread(target=self._flush_periodically, name="brutils-log-flusher")
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def _segments(self):
+        """dict of segment number -> path of the rotated segments on disk, compressed or not"""
+        pattern = re.compile(re.escape(self.baseFilename) + r"\.(\d+)(\.gz)?$")
+        segments = {}
+        for path in glob.glob(glob.escape(self.baseFilename) + ".*"):
+            m = pattern.match(path)
+            if m is not None:
+                segments[int(m.group(1))] = path
+        return segments
+
+    def _last_segment(self):
+        return max(self._segments() or [0])
+
+    def emit(self, record):
+        try:
+            data = (self.format(record) + "\n").encode(self.encoding)
+            with self.lock:
+                self._buffer.append(data)
+                self._buffered += len(data)
+                full = len(self._buffer) >= self.buffer_records or self._buffered >= self.buffer_bytes
+            if full or record.levelno >= self.flush_level:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        """write the buffered records, rotating the file where it would grow past max_bytes"""
+        with self.lock:
+            if not self._buffer or self._stream is None:
+                return
+            records, self._buffer, self._buffered = self._buffer, [], 0
+            chunk = []
+            chunk_size = 0
+            for data in records:
+                # a record larger than max_bytes goes into a file of its own rather than an endless rotation
+                if (self.max_bytes and self._size + chunk_size + len(data) > self.max_bytes
+                        and self._size + chunk_size > len(self.header)):
+                    self._stream.write(b"".join(chunk))
+                    self._rollover()
+                    chunk, chunk_size = [], 0
+                chunk.append(data)
+                chunk_size += len(data)
+            self._stream.write(b"".join(chunk))
+            self._stream.flush()
+            self._size += chunk_size
+
+    def _rollover(self):
+        """close the file, rename it to the next segment and hand it to the compression thread"""
+        self._stream.close()
+        self._segment += 1
+        segment = "%s.%05d" % (self.baseFilename, self._segment)
+        os.replace(self.baseFilename, segment)
+        self._stream = open(self.baseFilename, "ab")
+        self._stream.write(self.header)
+        self._size = len(self.header)
+        self._compressor.submit(self._finish_segment, segment)
+
+    def _finish_segment(self, segment):
+        """runs on the compression thread: gzip the new segment and delete the segments beyond backup_count"""
+        try:
+            # a later rotation may already have deleted the segment as one beyond backup_count
+            if self.compress and os.path.exists(segment):
+                _gzip_segment(segment)
+            if self.backup_count:
+                segments = self._segments()
+                for number in sorted(segments)[:-self.backup_count]:
+                    os.remove(segments[number])
+        except Exception:
+            if logging.raiseExceptions:
+                traceback.print_exc()
+
+    def _flush_periodically(self):
+        while not self._stopping.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                if logging.raiseExceptions:
+                    traceback.print_exc()
+
+    def close(self):
+        """write the buffer, close the file and wait for the segments being compressed"""
+        self._stopping.set()
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join()
+        with self.lock:
+            try:
+                self.flush()
+            finally:
+                if self._stream is not None:
+                    self._stream.close()
+                    self._stream = None
+        self._compressor.shutdown(wait=True)
+        logging.Handler.close(self)
@@ -0,0 +1,192 @@
+"""
+Nested timing spans written as JSON lines next to the log
+
+    setup_logging(spans=True)           # or configure_spans("run.spans.jsonl")
+
+    with span("load", source="sales") as s:
+        df = load()
+        s.add_rows(len(df))
+
+    @span("score")
+    def score(chunk):
+        ...
+
+Each finished span is one JSON line with its name, id, parent id, tags, start time, wall and
+CPU seconds, row count and status ("ok", or "error" if the block raised). Spans nest per thread.
+
+While spans are not configured, span() does nothing beyond one check, and with sample_rate < 1
+only that fraction of the top level spans (and everything inside them) is recorded, which keeps the
+cost down in tight loops.
+"""
+
+import atexit
+import functools
+import itertools
+import json
+import os
+import random
+import threading
+import time
+
+_config = None
+_local = threading.local()
+_ids = itertools.count(1)
+
+
+class _SpanWriter(object):
+    """appends span records to a buffered file, the buffer is written out at exit or by close_spans()"""
+
+    def __init__(self, path, sample_rate):
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.sample_rate = sample_rate
+        self.lock = threading.Lock()
+        self.file = open(path, "a", buffering=2**16)
+
+    def write(self, record):
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def configure_spans(path, sample_rate=1.0):
+    """
+    start writing spans to the JSON lines file at <path>
+
+    sample_rate: float, the fraction of top level spans that are recorded
+    """
+    global _config
+    close_spans()
+    _config = _SpanWriter(path, sample_rate)
+    return _config
+
+
+def close_spans():
+    """write out the buffered spans and stop recording"""
+    global _config
+    writer, _config = _config, None
+    if writer is not None:
+        writer.close()
+
+atexit.register(close_spans)
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+class span(object):
+    """
+    context manager and decorator that records a timing span
+
+    name: string, the span's name
+    **tags: json serializable values stored with the span
+
+    inside the block, add_rows(n) counts rows and set(**tags) adds tags
+    """
+
+    def __init__(self, name, **tags):
+        self.name = name
+        self.tags = tags
+        self.rows = None
+        self._writer = None
+
+    def __enter__(self):
+        writer = _config
+        if writer is None:
+            return self
+        stack = _stack()
+        if stack:
+            parent = stack[-1]
+            sampled = parent._writer is not None
+            self.parent_id = parent.id if sampled else None
+        else:
+            sampled = writer.sample_rate >= 1 or random.random() < writer.sample_rate
+            self.parent_id = None
+        stack.append(self)
+        if not sampled:
+            return self
+        self._writer = writer
+        self.id = next(_ids)
+        self.start = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        stack = getattr(_local, "stack", None)
+        if stack and stack[-1] is self:
+            stack.pop()
+        if self._writer is None:
+            return False
+        record = {
+            "name": self.name,
+            "id": self.id,
+            "parent": self.parent_id,
+            "pid": os.getpid(),
+            "thread": threading.current_thread().name,
+            "start": self.start,
+            "wall": time.perf_counter() - self._wall,
+            "cpu": time.thread_time() - self._cpu,
+            "status": "ok" if exc_type is None else "error",
+        }
+        if self.rows is not None:
+            record["rows"] = self.rows
+        if self.tags:
+            record["tags"] = self.tags
+        try:
+            self._writer.write(record)
+        except ValueError:
+            # the file was closed by close_spans while this span was open
+            pass
+        self._writer = None
+        return False
+
+    def add_rows(self, n):
+        """count <n> more rows processed in this span"""
+        self.rows = (self.rows or 0) + n
+
+    def set(self, **tags):
+        """add tags to the span"""
+        self.tags.update(tags)
+
+    def __call__(self, func):
+        name, tags = self.name, self.tags
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _config is None:
+                return func(*args, **kwargs)
+            with span(name, **dict(tags)):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def read_spans(path):
+    """iterate over the span records of a spans file"""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def summarize_spans(path):
+    """dict of span name -> {"count", "wall", "cpu", "max_wall", "rows"} totals over a spans file"""
+    summary = {}
+    for record in read_spans(path):
+        s = summary.setdefault(record["name"], {"count": 0, "wall": 0., "cpu": 0., "max_wall": 0., "rows": 0})
+        s["count"] += 1
+        s["wall"] += record["wall"]
+        s["cpu"] += record["cpu"]
+        s["max_wall"] = max(s["max_wall"], record["wall"])
+        s["rows"] += record.get("rows", 0)
+    return summary
@@ -1 +1,4 @@
-from .oututils import *
\ No newline at end of file
+from .oututils import *
+from .manifest import OutputManager, file_sha256
+from .runner import ScriptRunner, build_graph, find_scripts
+from .async_writer import AsyncWriter
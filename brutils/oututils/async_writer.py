@@ -0,0 +1,202 @@
+"""
+Write large artifacts in the background so a script can keep computing
+
+    with AsyncWriter(max_pending=2) as writer:
+        for name, df in results:
+            writer.write(df, out(name))        # out = au_output_path_factory(output_extension=".p.gz")
+    # leaving the block waits for every write and raises the first error
+
+The format follows the file extension: .p/.pkl (pickle), .json, each optionally followed by
+.gz or .zst. Gzip output is compressed in blocks on several threads and written as a multi-member
+gzip file, which gzip.open, pandas and the gzip command all read as one stream. Zstandard output
+needs the optional zstandard package and uses its own worker threads.
+
+Every file is written to a temporary name and renamed into place, so readers never see half a file.
+The object is serialized in the background: do not modify it until flush() returns.
+"""
+
+import gzip
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_GZIP_BLOCK = 2**22
+
+
+def _split_format(path):
+    """(serializer, compression) from the file extension"""
+    stem, ext = os.path.splitext(path)
+    compression = None
+    if ext in (".gz", ".zst"):
+        compression = ext[1:]
+        stem, ext = os.path.splitext(stem)
+    if ext in (".p", ".pkl", ".pickle"):
+        return "pickle", compression
+    if ext == ".json":
+        return "json", compression
+    raise ValueError("Can not tell the format of %s, use .p, .pkl or .json (optionally with .gz or .zst)" % path)
+
+
+def _serialize(obj, serializer):
+    if serializer == "pickle":
+        return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    if hasattr(obj, "to_json"):
+        return obj.to_json().encode("utf-8")
+    return json.dumps(obj).encode("utf-8")
+
+
+def _gzip_blocks(data, threads, level):
+    """
+    gzip <data> in independent blocks on <threads> threads (zlib releases the GIL), concatenated as gzip members
+
+    the members carry no timestamp, so the same content always gives the same file
+    """
+    blocks = [data[i:i + _GZIP_BLOCK] for i in range(0, len(data), _GZIP_BLOCK)] or [b""]
+    if threads <= 1 or len(blocks) == 1:
+        return b"".join(gzip.compress(b, compresslevel=level, mtime=0) for b in blocks)
+    with ThreadPoolExecutor(threads) as pool:
+        return b"".join(pool.map(lambda b: gzip.compress(b, compresslevel=level, mtime=0), blocks))
+
+
+def _compress(data, compression, threads, level):
+    if compression == "gz":
+        return _gzip_blocks(data, threads, level)
+    if compression == "zst":
+        if zstandard is None:
+            raise ImportError("Writing .zst files needs the zstandard package")
+        return zstandard.ZstdCompressor(level=level, threads=threads).compress(data)
+    return data
+
+
+def _write_artifact(obj, path, threads, level):
+    """serialize, compress and atomically write one artifact, returns (path, bytes written, seconds)"""
+    start = time.time()
+    serializer, compression = _split_format(path)
+    data = _compress(_serialize(obj, serializer), compression, threads, level)
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0o666 & ~umask)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path, len(data), time.time() - start
+
+
+class AsyncWriter(object):
+    """
+    Parameters
+    ----------
+    max_pending: int, write() blocks while this many writes are queued or running
+    n_jobs: int, number of artifacts written at once
+    backend: "thread" (default) or "process", processes avoid the GIL while pickling but the object
+        is pickled once more to reach the worker
+    compress_threads: int, threads per artifact for gzip/zstd compression, defaults to the number of cpus
+    level: compression level, defaults to 6 for gzip and 3 for zstd
+
+    Attributes
+    ----------
+    written: list of (path, bytes written, seconds) of the finished writes
+    """
+
+    def __init__(self, max_pending=2, n_jobs=1, backend="thread", compress_threads=None, level=None):
+        if backend == "thread":
+            self._executor = ThreadPoolExecutor(n_jobs)
+        elif backend == "process":
+            self._executor = ProcessPoolExecutor(n_jobs)
+        else:
+            raise ValueError("backend must be 'thread' or 'process', got %s" % backend)
+        self.compress_threads = compress_threads or os.cpu_count() or 1
+        self.level = level
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+        self._lock = threading.Lock()
+        self.written = []
+
+    def write(self, obj, path):
+        """queue <obj> to be written to <path>, returns a Future of (path, bytes written, seconds)"""
+        _split_format(path)
+        # fail here rather than in the background if zstandard is missing
+        if path.endswith(".zst") and zstandard is None:
+            raise ImportError("Writing .zst files needs the zstandard package")
+        level = self.level if self.level is not None else (3 if path.endswith(".zst") else 6)
+        waited = time.time()
+        self._slots.acquire()
+        waited = time.time() - waited
+        if waited > 1:
+            logging.debug("Waited %.1fs for a free write slot" % waited)
+        try:
+            future = self._executor.submit(_write_artifact, obj, path, self.compress_threads, level)
+        except BaseException:
+            self._slots.release()
+            raise
+        # a future is done before its callbacks run, flush waits for this event so written is complete
+        recorded = threading.Event()
+        future.add_done_callback(lambda f: self._done(f, recorded))
+        with self._lock:
+            self._futures.append((future, recorded))
+        return future
+
+    def _done(self, future, recorded):
+        try:
+            self._slots.release()
+            if future.exception() is None:
+                path, nbytes, seconds = future.result()
+                with self._lock:
+                    self.written.append((path, nbytes, seconds))
+                logging.info("Wrote %s (%s bytes) in %.1fs" % (path, nbytes, seconds))
+            else:
+                logging.error("Writing an artifact failed: %s" % future.exception())
+        finally:
+            recorded.set()
+
+    def flush(self):
+        """wait for every queued write to finish and be recorded in written, raises the first error"""
+        with self._lock:
+            pending, self._futures = self._futures, []
+        for _, recorded in pending:
+            recorded.wait()
+        futures = [f for f, _ in pending]
+        errors = [f.exception() for f in futures]
+        errors = [e for e in errors if e is not None]
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        """flush and shut the worker pool down"""
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # keep the original error, but still wait for the writes already queued
+            try:
+                self.close()
+            except Exception as e:
+                logging.error("Writing an artifact failed: %s" % e)
+        return False
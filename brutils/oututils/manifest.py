@@ -0,0 +1,191 @@
+"""
+Atomic writes and a manifest of outputs, so scripts can skip work whose inputs have not changed
+
+    out = OutputManager(output_stem="outputs", output_extension=".csv")
+    if not out.is_current("store_sales", inputs=[raw_path]):
+        df = expensive_groupby(raw_path)
+        with out.atomic_path("store_sales", inputs=[raw_path]) as tmp:
+            df.to_csv(tmp)
+
+Outputs are written to a temporary file in the same directory and renamed into place, so a crash
+never leaves a truncated output behind. If the new content is identical to the existing file the
+old file is kept untouched. The manifest (manifest.json in output_stem) records the sha256, size,
+producing script and input hashes of every output, keyed by the path relative to output_stem.
+"""
+
+import contextlib
+import datetime
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from .oututils import au_output_path_factory, ensure_filepath, get_scriptname
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def file_sha256(path, blocksize=2**20):
+    """hex sha256 of the file's content"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _default_mode(path):
+    if os.path.exists(path):
+        return os.stat(path).st_mode & 0o777
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def _stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+class OutputManager(object):
+    """
+    Output paths (as in au_output_path_factory) with atomic writes and a manifest
+
+    Parameters
+    ----------
+    output_stem, output_extension, subdir: as in au_output_path_factory
+    manifest_name: file name of the manifest, in output_stem
+    """
+
+    def __init__(self, output_stem=".", output_extension=".json", subdir="", manifest_name="manifest.json"):
+        self.output_stem = os.path.abspath(output_stem)
+        self.path_for = au_output_path_factory(output_stem=output_stem, output_extension=output_extension, subdir=subdir)
+        self.manifest_path = os.path.join(self.output_stem, manifest_name)
+        self.producer = get_scriptname()
+
+    def path(self, filename, **kwargs):
+        """the full output path of <filename>, the keyword arguments are passed to au_output_path_factory's function"""
+        return self.path_for(filename, **kwargs)
+
+    def _key(self, path):
+        return os.path.relpath(os.path.abspath(path), self.output_stem)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """hold an exclusive lock on the manifest while it is read and rewritten (several scripts may run at once)"""
+        ensure_filepath(self.manifest_path)
+        with open(self.manifest_path + ".lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def read_manifest(self):
+        """the manifest as a dict of relative output path -> entry"""
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def entry(self, filename, **kwargs):
+        """the manifest entry of an output, or None"""
+        return self.read_manifest().get(self._key(self.path(filename, **kwargs)))
+
+    def _file_record(self, path, previous=None):
+        """sha256, size and mtime of a file, the hash is reused if size and mtime match <previous>"""
+        size, mtime_ns = _stat(path)
+        if previous and previous.get("size") == size and previous.get("mtime_ns") == mtime_ns:
+            sha = previous["sha256"]
+        else:
+            sha = file_sha256(path)
+        return {"sha256": sha, "size": size, "mtime_ns": mtime_ns}
+
+    def _input_records(self, inputs, previous=None):
+        previous = previous or {}
+        return dict((os.path.abspath(p), self._file_record(p, previous.get(os.path.abspath(p)))) for p in inputs or [])
+
+    def record(self, path, inputs=None):
+        """hash the output at <path> and its inputs and store them in the manifest"""
+        key = self._key(path)
+        with self._locked():
+            manifest = self.read_manifest()
+            previous = manifest.get(key, {})
+            entry = self._file_record(path, previous)
+            entry["inputs"] = self._input_records(inputs, previous.get("inputs"))
+            entry["producer"] = self.producer
+            entry["recorded"] = datetime.datetime.now().isoformat()
+            manifest[key] = entry
+            fd, tmp = tempfile.mkstemp(dir=self.output_stem, prefix=".manifest.", suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(manifest, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.manifest_path)
+        return entry
+
+    def is_current(self, filename, inputs=None, **kwargs):
+        """
+        True if the output exists unchanged since it was recorded and was made from the same inputs
+
+        Files whose size and modification time match the manifest are not hashed again.
+        """
+        path = self.path(filename, **kwargs)
+        entry = self.read_manifest().get(self._key(path))
+        if entry is None or not os.path.exists(path):
+            return False
+        if self._file_record(path, entry)["sha256"] != entry["sha256"]:
+            logging.info("%s changed since it was recorded" % path)
+            return False
+        recorded = entry.get("inputs", {})
+        wanted = [os.path.abspath(p) for p in inputs or []]
+        if sorted(wanted) != sorted(recorded):
+            return False
+        for p in wanted:
+            if not os.path.exists(p) or self._file_record(p, recorded[p])["sha256"] != recorded[p]["sha256"]:
+                logging.info("The input %s of %s changed" % (p, path))
+                return False
+        return True
+
+    @contextlib.contextmanager
+    def atomic_path(self, filename, inputs=None, **kwargs):
+        """
+        context manager that yields a temporary path to write the output to
+
+        When the block exits cleanly the temporary file is renamed over the output (or dropped
+        if its content is identical) and the output is recorded in the manifest.
+        If the block raises, the temporary file is removed and the old output is left as it was.
+        """
+        path = self.path(filename, **kwargs)
+        directory, base = os.path.split(path)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix="." + base + ".", suffix=".tmp")
+        os.close(fd)
+        # mkstemp creates the file readable by its owner only, give it the permissions a plain open would
+        os.chmod(tmp, _default_mode(path))
+        try:
+            yield tmp
+            if os.path.exists(path) and file_sha256(tmp) == file_sha256(path):
+                logging.info("%s is unchanged, keeping the existing file" % path)
+                os.remove(tmp)
+            else:
+                with open(tmp, "rb") as f:
+                    os.fsync(f.fileno())
+                os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.record(path, inputs)
+
+    @contextlib.contextmanager
+    def atomic_write(self, filename, mode="w", inputs=None, **kwargs):
+        """like atomic_path but yields the temporary file opened with <mode>"""
+        with self.atomic_path(filename, inputs=inputs, **kwargs) as tmp:
+            with open(tmp, mode) as f:
+                yield f
+                f.flush()
+                os.fsync(f.fileno())
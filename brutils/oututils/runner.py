@@ -0,0 +1,246 @@
+"""
+Run the p_NN_ scripts of a directory in dependency order, in parallel, skipping the ones that are up to date
+
+A script's outputs are the files named out_NN_* (the names au_output_path_factory gives them) and
+a script depends on every script whose out_MM_ prefix appears in its source. Scripts whose
+dependencies have finished are started right away, up to n_jobs at a time.
+
+A script is skipped when its source, the content of the outputs it reads and its own outputs are
+all the same as after its last successful run; the hashes are kept in .runner_state.json.
+The output of each script goes to runner_logs/<script>.log.
+
+    python -m brutils.oututils.runner analysis_dir -j 4
+    python -m brutils.oututils.runner analysis_dir --dry-run
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from .oututils import valid_scriptname, get_prog_numbers
+from .manifest import file_sha256
+
+# \b so that names like layout_3_ or checkout_12_ are not read as references
+_OUT_REFERENCE = re.compile(r"\bout_([0-9]+)_")
+
+
+def find_scripts(directory):
+    """OrderedDict of program number -> script file name, for the p_NN_*.py scripts of <directory>"""
+    scripts = {}
+    for name in os.listdir(directory):
+        if name.endswith(".py") and valid_scriptname(name):
+            num = get_prog_numbers(name)
+            # p_3_ and p_03_ are the same program number
+            same = [n for n in scripts if int(n) == int(num)]
+            if same:
+                raise ValueError("Scripts %s and %s have the same number" % (scripts[same[0]], name))
+            scripts[num] = name
+    return OrderedDict((num, scripts[num]) for num in sorted(scripts, key=int))
+
+
+def script_dependencies(path, own_num, known_nums):
+    """the program numbers whose out_NN_ outputs are referenced in the script at <path>, out_3_ and out_03_ match p_03_"""
+    with open(path) as f:
+        referenced = set(int(n) for n in _OUT_REFERENCE.findall(f.read()))
+    known = dict((int(n), n) for n in known_nums)
+    referenced.discard(int(own_num))
+    unknown = referenced - set(known)
+    if unknown:
+        logging.warning("%s reads outputs of scripts that do not exist: %s"
+                        % (path, ", ".join(str(n) for n in sorted(unknown))))
+    return [known[n] for n in sorted(referenced & set(known))]
+
+
+def build_graph(directory):
+    """OrderedDict of script name -> list of the script names it depends on, raises ValueError on cycles"""
+    scripts = find_scripts(directory)
+    graph = OrderedDict()
+    for num, name in scripts.items():
+        graph[name] = [scripts[d] for d in script_dependencies(os.path.join(directory, name), num, scripts)]
+    _check_acyclic(graph)
+    return graph
+
+
+def _check_acyclic(graph):
+    done, visiting = set(), []
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError("Dependency cycle: %s" % " -> ".join(visiting[visiting.index(name):] + [name]))
+        visiting.append(name)
+        for dep in graph[name]:
+            visit(dep)
+        visiting.pop()
+        done.add(name)
+
+    for name in graph:
+        visit(name)
+
+
+class ScriptRunner(object):
+    """
+    Parameters
+    ----------
+    directory: directory holding the p_NN_ scripts, they are run with it as working directory
+    output_dir: directory searched (recursively) for out_NN_ files, defaults to <directory>
+    n_jobs: int, number of scripts run at once
+    python: the interpreter the scripts are run with
+    """
+
+    def __init__(self, directory, output_dir=None, n_jobs=1, python=sys.executable,
+                 state_file=".runner_state.json", log_dir="runner_logs"):
+        self.directory = os.path.abspath(directory)
+        self.output_dir = os.path.abspath(output_dir or directory)
+        self.n_jobs = n_jobs
+        self.python = python
+        self.state_path = os.path.join(self.directory, state_file)
+        self.log_dir = os.path.join(self.directory, log_dir)
+        self.graph = build_graph(self.directory)
+        self.state = self._read_state()
+
+    def _read_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {"scripts": {}, "files": {}}
+
+    def _write_state(self):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.state_path)
+
+    def _hash(self, path):
+        """sha256 of a file, reusing the stored hash while its size and mtime are unchanged"""
+        st = os.stat(path)
+        cached = self.state["files"].get(path)
+        if cached and cached["size"] == st.st_size and cached["mtime_ns"] == st.st_mtime_ns:
+            return cached["sha256"]
+        sha = file_sha256(path)
+        self.state["files"][path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha}
+        return sha
+
+    def outputs_of(self, script):
+        """dict of relative path -> sha256 of the out_NN_ files of <script>"""
+        pattern = re.compile("^out_%s_" % get_prog_numbers(script))
+        found = {}
+        for root, dirs, files in os.walk(self.output_dir):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in files:
+                if pattern.match(name):
+                    path = os.path.join(root, name)
+                    found[os.path.relpath(path, self.output_dir)] = self._hash(path)
+        return found
+
+    def _fingerprint(self, script):
+        inputs = {}
+        for dep in self.graph[script]:
+            inputs.update(self.outputs_of(dep))
+        return {"script": self._hash(os.path.join(self.directory, script)), "inputs": inputs}
+
+    def why_run(self, script):
+        """the reason <script> has to run, or None if it is up to date"""
+        last = self.state["scripts"].get(script)
+        if last is None:
+            return "never ran"
+        if last.get("status") != "ok":
+            return "last run failed"
+        fingerprint = self._fingerprint(script)
+        if fingerprint["script"] != last["script"]:
+            return "script changed"
+        if fingerprint["inputs"] != last["inputs"]:
+            return "inputs changed"
+        if self.outputs_of(script) != last["outputs"]:
+            return "outputs changed or missing"
+        return None
+
+    def _run_script(self, script):
+        if not os.path.isdir(self.log_dir):
+            os.makedirs(self.log_dir)
+        start = time.time()
+        with open(os.path.join(self.log_dir, script[:-3] + ".log"), "w") as log:
+            returncode = subprocess.call([self.python, script], cwd=self.directory, stdout=log, stderr=subprocess.STDOUT)
+        return returncode, time.time() - start
+
+    def run(self, force=False, dry_run=False):
+        """
+        run the scripts that are not up to date (all of them with force=True)
+
+        Outputs
+        -------
+        OrderedDict of script -> status, one of "ran", "skipped", "failed", "blocked" (a dependency failed)
+        with dry_run=True nothing is run and the status is "would run: <reason>" or "skipped"
+        """
+        status = OrderedDict((script, None) for script in self.graph)
+        # in a dry run nothing is written, so scripts below one that would run are assumed to run too
+        would_run = set()
+        running = {}
+        with ThreadPoolExecutor(max(self.n_jobs, 1)) as executor:
+            while any(s is None for s in status.values()) or running:
+                for script, deps in self.graph.items():
+                    if status[script] is not None or script in running.values():
+                        continue
+                    dep_status = [status[d] for d in deps]
+                    if any(s in ("failed", "blocked") for s in dep_status):
+                        status[script] = "blocked"
+                        continue
+                    if not all(s in ("ran", "skipped") or (s or "").startswith("would run") for s in dep_status):
+                        continue
+                    reason = "forced" if force else self.why_run(script)
+                    if reason is None and dry_run and any(d in would_run for d in deps):
+                        reason = "a dependency would run"
+                    if reason is None:
+                        status[script] = "skipped"
+                    elif dry_run:
+                        status[script] = "would run: %s" % reason
+                        would_run.add(script)
+                    else:
+                        logging.info("Running %s (%s)" % (script, reason))
+                        running[executor.submit(self._run_script, script)] = script
+                if not running:
+                    continue
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    script = running.pop(fut)
+                    returncode, seconds = fut.result()
+                    ok = returncode == 0
+                    status[script] = "ran" if ok else "failed"
+                    record = self._fingerprint(script)
+                    record.update({"status": "ok" if ok else "failed", "outputs": self.outputs_of(script),
+                                   "seconds": seconds})
+                    self.state["scripts"][script] = record
+                    self._write_state()
+                    logging.log(logging.INFO if ok else logging.ERROR,
+                                "%s %s in %.1fs" % (script, "finished" if ok else "failed (exit %s)" % returncode, seconds))
+        if not dry_run:
+            self._write_state()
+        return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the p_NN_ scripts of a directory in dependency order")
+    parser.add_argument("directory", nargs="?", default=".")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of scripts run at once")
+    parser.add_argument("--output-dir", default=None, help="where the out_NN_ files are written, defaults to directory")
+    parser.add_argument("--force", action="store_true", help="run every script")
+    parser.add_argument("--dry-run", action="store_true", help="only print what would run")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    runner = ScriptRunner(args.directory, output_dir=args.output_dir, n_jobs=args.jobs)
+    status = runner.run(force=args.force, dry_run=args.dry_run)
+    for script, s in status.items():
+        print("%-40s %s" % (script, s))
+    return 1 if any(s in ("failed", "blocked") for s in status.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
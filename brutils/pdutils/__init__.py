@@ -1 +1,5 @@
-from .pdutils import *
\ No newline at end of file
+from .pdutils import *
+from .pipeline import Pipeline
+from .streaming import *
+from .parallel import parallel_groupby_apply
+from .cache import ContentCache, memoize, content_hash
@@ -0,0 +1,252 @@
+"""
+Memoize expensive pdutils calls on the content of their dataframe arguments
+
+Dataframes and series are hashed with pd.util.hash_pandas_object, which is much cheaper than
+recomputing a groupby, so repeated notebook calls on unchanged inputs return the stored result.
+Results are kept in an in-memory LRU and, optionally, in a size-bounded directory on disk.
+
+    >>> cache = ContentCache(maxsize=64, directory="./.pdutils_cache", max_disk_bytes=2**30)
+    >>> cached_multi_groupby = memoize(cache)(multi_groupby)
+    >>> cached_multi_groupby(df, level=["store", "brand"])
+    >>> cache.stats()
+"""
+
+import functools
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+import time
+import types
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+
+def _update_hash(h, obj):
+    """feed the content of obj into the hashlib object h"""
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        h.update(type(obj).__name__.encode())
+        h.update(pd.util.hash_pandas_object(obj, index=True).values.tobytes())
+        if isinstance(obj, pd.DataFrame):
+            h.update(repr(list(obj.columns)).encode())
+            h.update(repr(list(obj.dtypes.astype(str))).encode())
+        else:
+            h.update(repr((obj.name, str(obj.dtype))).encode())
+        h.update(repr(list(obj.index.names)).encode())
+    elif isinstance(obj, pd.Index):
+        h.update(pd.util.hash_pandas_object(obj).values.tobytes())
+        h.update(repr(list(obj.names)).encode())
+    elif isinstance(obj, np.ndarray):
+        h.update(repr((obj.dtype.str, obj.shape)).encode())
+        h.update(np.ascontiguousarray(obj).tobytes() if obj.dtype != object else pickle.dumps(obj))
+    elif isinstance(obj, (list, tuple)):
+        h.update(("%s%d" % (type(obj).__name__, len(obj))).encode())
+        for x in obj:
+            _update_hash(h, x)
+    elif isinstance(obj, dict):
+        h.update(("dict%d" % len(obj)).encode())
+        for k in sorted(obj, key=repr):
+            _update_hash(h, k)
+            _update_hash(h, obj[k])
+    elif isinstance(obj, types.CodeType):
+        h.update(obj.co_code)
+        h.update(repr(obj.co_names).encode())
+        for const in obj.co_consts:
+            _update_hash(h, const)
+    elif isinstance(obj, functools.partial):
+        h.update(b"partial")
+        _update_hash(h, obj.func)
+        _update_hash(h, obj.args)
+        _update_hash(h, obj.keywords)
+    elif isinstance(obj, types.MethodType):
+        _update_hash(h, obj.__func__)
+        _update_hash(h, obj.__self__)
+    elif isinstance(obj, types.FunctionType):
+        # the name alone does not tell lambdas or closures apart, hash what the function does
+        h.update(("%s.%s" % (obj.__module__, obj.__qualname__)).encode())
+        _update_hash(h, obj.__code__)
+        _update_hash(h, obj.__defaults__)
+        _update_hash(h, obj.__kwdefaults__)
+        for cell in obj.__closure__ or ():
+            try:
+                contents = cell.cell_contents
+            except ValueError:
+                # an empty cell, e.g. a closure over a name assigned later
+                contents = None
+            if contents is obj:
+                h.update(b"self")
+            else:
+                _update_hash(h, contents)
+    elif callable(obj) and hasattr(obj, "__qualname__"):
+        h.update(("%s.%s" % (getattr(obj, "__module__", ""), obj.__qualname__)).encode())
+    else:
+        h.update(repr(obj).encode())
+
+
+def content_hash(*args, **kwargs):
+    """return a hex digest of the content of the arguments"""
+    h = hashlib.sha1()
+    _update_hash(h, args)
+    _update_hash(h, kwargs)
+    return h.hexdigest()
+
+
+def _copy_result(result):
+    # hand out copies so that callers modifying a result cannot change the cached value
+    if isinstance(result, (pd.DataFrame, pd.Series, np.ndarray)):
+        return result.copy()
+    return result
+
+
+class ContentCache(object):
+    """
+    Two tier cache of function results
+
+    Parameters
+    ----------
+    maxsize: int, number of results kept in memory (least recently used are dropped first)
+    directory: string (optional), directory for the on-disk tier, None keeps results in memory only
+    max_disk_bytes: int, the on-disk tier is trimmed to this size, least recently used files first
+    """
+
+    def __init__(self, maxsize=128, directory=None, max_disk_bytes=2**30):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.hash_seconds = 0.
+        self.compute_seconds = 0.
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".p")
+
+    def get(self, key):
+        """return (True, value) if key is cached, otherwise (False, None)"""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return True, self._memory[key]
+        if self.directory is not None:
+            path = self._path(key)
+            try:
+                with open(path, "rb") as f:
+                    value = pickle.load(f)
+            except (IOError, OSError, EOFError, pickle.UnpicklingError):
+                pass
+            else:
+                # touch the file so eviction sees it as recently used
+                os.utime(path, None)
+                self.disk_hits += 1
+                self._set_memory(key, value)
+                return True, value
+        self.misses += 1
+        return False, None
+
+    def _set_memory(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def set(self, key, value):
+        self._set_memory(key, value)
+        if self.directory is not None:
+            path = self._path(key)
+            tmp = path + ".tmp%d" % os.getpid()
+            with open(tmp, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+            self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".p"):
+                st = os.stat(os.path.join(self.directory, name))
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(e[1] for e in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            logging.debug("Evicting %s from the pdutils cache" % name)
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def clear(self):
+        """empty both tiers and reset the statistics"""
+        self._memory.clear()
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith(".p"):
+                    os.remove(os.path.join(self.directory, name))
+        self.hits = self.disk_hits = self.misses = 0
+        self.hash_seconds = self.compute_seconds = 0.
+
+    def stats(self):
+        """dict of hit/miss counts and the time spent hashing vs computing"""
+        calls = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / float(calls) if calls else 0.,
+            "hash_seconds": self.hash_seconds,
+            "compute_seconds": self.compute_seconds,
+            "memory_entries": len(self._memory),
+        }
+
+
+default_cache = ContentCache()
+
+
+def memoize(cache=None):
+    """
+    decorator that caches the results of a function on the content of its arguments
+
+    cache: ContentCache, defaults to the module level default_cache
+
+    the key is the content of the arguments, bound to the function's parameters with their defaults, and
+    the function's code, constants and closure, so different lambdas or closures with the same name do not
+    share results (globals the function reads are not part of the key)
+
+    the wrapped function has .cache and .uncached attributes
+    """
+    cache = default_cache if cache is None else cache
+
+    def decorator(func):
+        try:
+            signature = inspect.signature(func)
+        except (TypeError, ValueError):
+            signature = None
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            if signature is not None:
+                # f(1, b=2), f(1, 2) and f(1) with a default b=2 are the same call
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                key = content_hash(func, bound.arguments)
+            else:
+                key = content_hash(func, args, kwargs)
+            cache.hash_seconds += time.time() - start
+            found, value = cache.get(key)
+            if found:
+                return _copy_result(value)
+            start = time.time()
+            value = func(*args, **kwargs)
+            cache.compute_seconds += time.time() - start
+            cache.set(key, value)
+            return _copy_result(value)
+
+        wrapper.cache = cache
+        wrapper.uncached = func
+        return wrapper
+    return decorator
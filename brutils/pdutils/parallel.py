@@ -0,0 +1,137 @@
+"""
+Run a function on each group of a dataframe in a pool of processes
+
+The numeric columns are copied into multiprocessing.shared_memory once, sorted so that every
+group is a contiguous block of rows. Each task only sends the group's row bounds, its index
+and any non-numeric columns, and the worker wraps read-only views of the shared blocks into
+a dataframe, so the pickling cost of a task does not grow with the size of the frame.
+"""
+
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+
+# shared blocks attached in each worker process: list of (column position, shm, array)
+_worker_blocks = None
+_worker_func = None
+_worker_columns = None
+
+
+def _is_shareable(dtype):
+    return isinstance(dtype, np.dtype) and dtype.kind in "biufcmM"
+
+
+def _attach_blocks(specs, func, columns):
+    """pool initializer: attach to the shared blocks once per worker"""
+    global _worker_blocks, _worker_func, _worker_columns
+    _worker_blocks = []
+    for pos, name, dtype, nrows in specs:
+        shm = shared_memory.SharedMemory(name=name)
+        arr = np.ndarray((nrows,), dtype=np.dtype(dtype), buffer=shm.buf)
+        arr.flags.writeable = False
+        _worker_blocks.append((pos, shm, arr))
+    _worker_func = func
+    _worker_columns = columns
+
+
+def _build_group(start, stop, index, other):
+    """build the group's dataframe from views of the shared blocks plus the pickled columns"""
+    data = {pos: arr[start:stop] for pos, shm, arr in _worker_blocks}
+    if other is not None:
+        for pos, values in other.items():
+            data[pos] = values
+    group = pd.DataFrame({pos: data[pos] for pos in sorted(data)}, index=index, copy=False)
+    group.columns = _worker_columns
+    return group
+
+
+def _run_group(task):
+    start, stop, index, other = task
+    return _worker_func(_build_group(start, stop, index, other))
+
+
+def _combine_results(results, keys, names):
+    """concatenate the per group results in group order, like DataFrame.groupby().apply"""
+    index = pd.MultiIndex.from_tuples(keys, names=names) if len(names) > 1 else pd.Index(keys, name=names[0])
+    if results and all(isinstance(r, pd.Series) for r in results) and all(r.index.equals(results[0].index) for r in results):
+        # one row per group, like apply does when every group returns a series with the same labels
+        return pd.DataFrame([r.values for r in results], index=index, columns=results[0].index)
+    if results and all(isinstance(r, (pd.DataFrame, pd.Series)) for r in results):
+        return pd.concat(results, keys=keys, names=names)
+    return pd.Series(results, index=index)
+
+
+def parallel_groupby_apply(df, by, func, n_jobs=None, chunksize=1):
+    """
+    Apply <func> to each group of df.groupby(by) in a process pool
+
+    Parameters
+    ----------
+    df: pandas DataFrame
+    by: column name(s) or index level name(s) to group by, anything DataFrame.groupby accepts
+    func: function that takes a group's dataframe, must be picklable (defined at module level)
+        the group's numeric columns are read-only views of shared memory, copy them before modifying
+    n_jobs: int, number of worker processes, defaults to the number of cpus
+        1 runs in this process without shared memory
+    chunksize: number of groups sent to a worker at a time
+
+    Output
+    ------
+    The results concatenated in sorted group order:
+        a DataFrame with one row per group if func returns series that all share the same index
+        a DataFrame or Series with the group keys prepended to the index if func returns other pandas objects
+        otherwise a Series of the results indexed by the group keys
+    """
+    grouped = df.groupby(by, sort=True)
+    sizes = grouped.size()
+    keys = list(sizes.index)
+    names = list(sizes.index.names)
+
+    if n_jobs == 1:
+        return _combine_results([func(grouped.get_group(k)) for k in keys], keys, names)
+
+    # sort the rows so every group is a contiguous block, rows with missing keys are dropped like groupby does
+    group_number = grouped.ngroup().values
+    order = np.argsort(group_number, kind="stable")
+    order = order[group_number[order] >= 0]
+    bounds = np.concatenate([[0], np.cumsum(sizes.values)])
+    sorted_index = df.index.take(order)
+
+    shareable = [i for i, dtype in enumerate(df.dtypes) if _is_shareable(dtype)]
+    others = [i for i in range(df.shape[1]) if i not in set(shareable)]
+    other_frame = df.iloc[order, others] if others else None
+
+    blocks = []
+    try:
+        specs = []
+        for pos in shareable:
+            values = df.iloc[:, pos].values
+            shm = shared_memory.SharedMemory(create=True, size=max(values.dtype.itemsize * len(order), 1))
+            blocks.append(shm)
+            arr = np.ndarray((len(order),), dtype=values.dtype, buffer=shm.buf)
+            np.take(values, order, out=arr)
+            specs.append((pos, shm.name, values.dtype.str, len(order)))
+        logging.debug("Shared %s numeric columns with %s workers" % (len(specs), n_jobs))
+
+        def tasks():
+            for g in range(len(keys)):
+                start, stop = bounds[g], bounds[g + 1]
+                other = None
+                if other_frame is not None:
+                    other = {pos: other_frame.iloc[start:stop, j].values for j, pos in enumerate(others)}
+                yield start, stop, sorted_index[start:stop], other
+
+        pool = multiprocessing.Pool(n_jobs, initializer=_attach_blocks, initargs=(specs, func, df.columns))
+        try:
+            results = list(pool.imap(_run_group, tasks(), chunksize=chunksize))
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    return _combine_results(results, keys, names)
@@ -7,20 +7,53 @@ import pandas as pd
 import numpy as np
 import itertools, copy
 import json
+import csv
 from collections import OrderedDict
 
-def df_from_ldjson(filename):
+def df_from_ldjson(filename, chunksize=None):
+    """reads a line delimited json file into a dataframe, blank lines are skipped
+
+    chunksize: int (optional), returns an iterator of dataframes of up to chunksize rows instead,
+        only one chunk of the file is held in memory at a time
+    """
+    if chunksize is not None:
+        return _iter_ldjson(filename, chunksize)
     all_lines = []
     with open(filename, "r") as fil:
         for line in fil:
+            if not line.strip():
+                continue
             all_lines.append(json.loads(line))
     return pd.DataFrame(all_lines)
+
+def _iter_ldjson(filename, chunksize):
+    lines = []
+    start = 0
+    with open(filename, "r") as fil:
+        for line in fil:
+            if not line.strip():
+                continue
+            lines.append(json.loads(line))
+            if len(lines) >= chunksize:
+                yield pd.DataFrame(lines, index=pd.RangeIndex(start, start + len(lines)))
+                start += len(lines)
+                lines = []
+    if lines:
+        yield pd.DataFrame(lines, index=pd.RangeIndex(start, start + len(lines)))
         
 
 def printall(df, max_rows = 999, max_colwidth=200):
-    """prints the entire dataframe (up to max_rows) and returns to original context"""
+    """prints the entire dataframe (up to max_rows) and returns to original context
+
+    deferred formats (see defer_fmt_retail) are only applied to the printed rows
+    """
     with pd.option_context('display.max_rows', max_rows, 'display.max_colwidth', max_colwidth):
-        print (df)
+        if has_deferred_fmt(df):
+            print (render_fmt(df, max_rows=max_rows))
+            if len(df) > max_rows:
+                print ("[%s rows total, %s shown]" % (len(df), max_rows))
+        else:
+            print (df)
 
 def english_join(seq):
     """ join a list of strings separated by commas with an 'and' contraction before the last value
@@ -69,7 +102,7 @@ def html_float_left(htmls, titles=None, padding_left=10):
     Show dataframes side by side using the float:left style of divs
     
     Args:
-    dfs: list of dataframes to show
+    dfs: list of dataframes to show, html strings or dataframes (deferred formats are applied to the rendered frame)
     titles: (optional) list of strings that represent the titles of the dataframes,
                 if supplied, must be same length as dfs
     padding_left: the padding between the dataframes (px)
@@ -84,6 +117,7 @@ def html_float_left(htmls, titles=None, padding_left=10):
     else:
         titles = ["Figure %s" % i for i, x in enumerate(htmls)]
     
+    htmls = [render_fmt(h).to_html() if isinstance(h, pd.DataFrame) else h for h in htmls]
     html = ''
     for i, (k, v) in enumerate(zip(titles, htmls)):
         if i > 0:
@@ -196,7 +230,41 @@ def get_fmt_from_keyword(keyword):
     else:
         return "{}"
 
-def fmt_series_retail(series, keyword=None, force=True):
+def _retail_fmt(series, keyword=None, force=True):
+    """the format string fmt_series_retail would use for the series, None if it would be returned unformatted"""
+    colname = keyword or series.name
+
+    if series.dtype == 'O':
+        logging.debug("The series was dtype 'O', returning original series")
+        return None
+    elif colname is None or type(colname) is not str:
+        logging.warn("The column name or keyword supplied was not a string, or was not supplied at all, returning original series")
+        return None
+    else:
+        # in cases like units/customer, or units per customer, select the first word
+        # if 'per' in colname:
+        #     checkstr = colname.split('per')[0]
+        # elif '/' in colname:
+        #     checkstr = colname.split('/')[0]
+        # else:
+        #     checkstr = colname
+
+        # if (series<=1).all():
+        #     return series.map(PCT.format)
+        # else:
+        fmt = get_fmt_from_keyword(colname)
+        if fmt != "{}":
+            return fmt
+        else:
+            if force:
+                if np.issubdtype(series.dtype, np.integer):
+                    return WHOLE
+                if np.issubdtype(series.dtype, np.floating):
+                    return DECIMAL
+            logging.warn("The series name or keyword was not found in the lookup, returning original series")
+            return None
+
+def fmt_series_retail(series, keyword=None, force=True, deferred=False):
     """
     Parameters
     ----------
@@ -221,38 +289,85 @@ def fmt_series_retail(series, keyword=None, force=True):
             percent
         Case insensitive
         If None (default), the keyword defaults to the name of the series
+    deferred = False: bool, optional
+        If True, the numeric series is returned unchanged with the format string stored in series.attrs['fmt']
+        the strings are only made by render_fmt (and printall) for the rows that are shown
     """
-    colname = keyword or series.name
-
-    if series.dtype == 'O':
-        logging.debug("The series was dtype 'O', returning original series")
+    fmt = _retail_fmt(series, keyword=keyword, force=force)
+    if fmt is None:
         return series
-    elif colname is None or type(colname) is not str:
-        logging.warn("The column name or keyword supplied was not a string, or was not supplied at all, returning original series")
-        return series
-    else:
-        # in cases like units/customer, or units per customer, select the first word
-        # if 'per' in colname:
-        #     checkstr = colname.split('per')[0]
-        # elif '/' in colname:
-        #     checkstr = colname.split('/')[0]
-        # else:
-        #     checkstr = colname
+    if deferred:
+        out = series.copy(deep=False)
+        out.attrs['fmt'] = fmt
+        return out
+    return series.map(fmt.format)
 
-        # if (series<=1).all():
-        #     return series.map(PCT.format)
-        # else:
-        fmt = get_fmt_from_keyword(colname)
-        if fmt != "{}":
-            return series.map(fmt.format)
-        else:
-            if force:
-                if np.issubdtype(series.dtype, np.integer):
-                    return series.map(WHOLE.format)
-                if np.issubdtype(series.dtype, np.float):
-                    return series.map(DECIMAL.format)
-            logging.warn("The series name or keyword was not found in the lookup, returning original series")
-            return series
+def defer_fmt_retail(df, keywords=None, force=True):
+    """
+    Attach the fmt_series_retail formats of each column to the dataframe without formatting it
+
+    The numeric data is kept (so the frame can still be sorted and aggregated) and the formats are
+    stored in df.attrs['fmt'] as a dict of column -> format string.
+    Use render_fmt, printall, html_float_left or presentation.Content to show it formatted.
+
+    Parameters
+    ----------
+    df: pandas DataFrame
+    keywords: dict (optional), column name -> keyword for columns whose name is not a keyword
+    force: bool, same as fmt_series_retail
+    """
+    keywords = keywords or {}
+    out = df.copy(deep=False)
+    out.attrs['fmt'] = {}
+    for c in df.columns:
+        fmt = _retail_fmt(df[c], keyword=keywords.get(c), force=force)
+        if fmt is not None:
+            out.attrs['fmt'][c] = fmt
+    return out
+
+def _deferred_fmt(obj):
+    """
+    the deferred format of obj: a format string for a series, a dict of column -> format string for a dataframe
+
+    a column taken from a defer_fmt_retail dataframe keeps the dataframe's dict, its own format is looked up by name
+    """
+    fmt = getattr(obj, 'attrs', {}).get('fmt')
+    if isinstance(obj, pd.Series) and isinstance(fmt, dict):
+        fmt = fmt.get(obj.name)
+    return fmt or None
+
+def has_deferred_fmt(obj):
+    """True if the series or dataframe carries formats from fmt_series_retail(deferred=True) or defer_fmt_retail"""
+    return _deferred_fmt(obj) is not None
+
+def render_fmt(obj, max_rows=None):
+    """
+    Apply the deferred formats of a series or dataframe
+
+    Parameters
+    ----------
+    obj: pandas Series or DataFrame with formats in .attrs['fmt']
+    max_rows: int (optional), only the first and last max_rows/2 rows are formatted and returned
+
+    Output
+    ------
+    A formatted copy of (the shown rows of) obj, obj itself if it has no deferred formats
+    """
+    if not has_deferred_fmt(obj):
+        return obj
+    if max_rows is not None and len(obj) > max_rows:
+        half = max_rows // 2
+        obj = pd.concat([obj.iloc[:half], obj.iloc[len(obj) - (max_rows - half):]])
+    fmt = _deferred_fmt(obj)
+    if isinstance(obj, pd.Series):
+        out = obj.map(fmt.format)
+    else:
+        out = obj.copy()
+        for c, f in fmt.items():
+            if c in out.columns:
+                out[c] = out[c].map(f.format)
+    out.attrs = {}
+    return out
 
 def chunk_col_values(filename, column, delimiter=",", sorted=True, maxkeys=1):
     """
@@ -271,12 +386,12 @@ def chunk_col_values(filename, column, delimiter=",", sorted=True, maxkeys=1):
         reader = csv.reader(f, delimiter=delimiter) 
         rownum = 0
         # index_dict = collections.defaultdict(lambda: [None,None])
-        colnames = reader.next()
+        colnames = next(reader)
         colnums = [colnames.index(c) for c in colnames if c in column]
 
         if sorted:
             first = rownum
-            prev_row = reader.next()
+            prev_row = next(reader)
             prev_key = tuple([prev_row[c] for c in colnums])
             i = 0
             for row in reader:
@@ -290,6 +405,8 @@ def chunk_col_values(filename, column, delimiter=",", sorted=True, maxkeys=1):
                         yield pd.read_csv(filename, delimiter=delimiter, names=colnames, skiprows=first, nrows=last-first+1, header=0)
                         first = rownum
                 prev_key = key
+            # the rows after the last key change
+            yield pd.read_csv(filename, delimiter=delimiter, names=colnames, skiprows=first, header=0)
         else:
             raise NotImplementedError
 
@@ -460,9 +577,10 @@ def multi_groupby(df, by=None, level=None, func='sum', nafill="-", max_combos=No
     i = 0
 
     cols_for_func = set(df.columns).difference(set(groupby))
-    for r in xrange(1,len(groupby)+1):
+    for r in range(1,len(groupby)+1):
         if r <= max_combos:
             for combo in itertools.combinations(groupby, r):
+                combo = list(combo)
                 group_args = {kind: combo}
                 if func=='sum':
                     grouped = df.groupby(**group_args)[list(cols_for_func)].sum()
@@ -0,0 +1,311 @@
+"""
+A lazy pipeline over the pdutils dataframe operations
+
+Steps are recorded as they are chained and nothing is computed until .collect() is called.
+Before running, the plan is optimized:
+    column selections and row filters are pushed toward the start of the plan
+        whenever the steps they move past cannot change their result
+    consecutive elementwise map steps are fused so they share a single copy of the frame
+
+    >>> (Pipeline(df)
+    ...     .normalize(axis=0)
+    ...     .index_to("store", "all")
+    ...     .select(["sales", "units"])
+    ...     .fmt_retail()
+    ...     .collect())
+"""
+
+import logging
+import pandas as pd
+
+from .pdutils import normalize, index_to, group_to_other, fmt_series_retail
+
+
+class _Step(object):
+    """
+    base class for a recorded step
+
+    row_local: each output row depends only on the same input row (row filters commute)
+    col_local: each output column depends only on the same input column (column selections commute)
+    writes: list of columns the step changes, None if the step may change any column
+    elementwise: the step can be fused with neighboring elementwise steps
+    """
+    name = "step"
+    row_local = False
+    col_local = False
+    writes = None
+    elementwise = False
+
+    def run(self, df):
+        raise NotImplementedError
+
+    def needs_columns(self):
+        """columns (other than its own) that the step reads, they must survive a column selection"""
+        return []
+
+    def __repr__(self):
+        return self.name
+
+
+class _Select(_Step):
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.name = "select(%s)" % ", ".join(str(c) for c in self.columns)
+
+    def run(self, df):
+        return df[self.columns]
+
+
+class _Filter(_Step):
+
+    def __init__(self, predicate, reads=None):
+        self.predicate = predicate
+        self.reads = None if reads is None else list(reads)
+        self.name = "filter(%s)" % getattr(predicate, "__name__", "predicate")
+
+    def run(self, df):
+        return df[self.predicate(df)]
+
+
+class _Map(_Step):
+    row_local = True
+    col_local = True
+    elementwise = True
+
+    def __init__(self, func, columns=None):
+        self.func = func
+        self.writes = None if columns is None else list(columns)
+        self.name = "map(%s)" % getattr(func, "__name__", "func")
+
+    def apply_inplace(self, out):
+        cols = out.columns if self.writes is None else [c for c in self.writes if c in out.columns]
+        for c in cols:
+            out[c] = self.func(out[c].values)
+
+    def run(self, df):
+        out = df.copy()
+        self.apply_inplace(out)
+        return out
+
+
+class _FusedMap(_Step):
+    row_local = True
+    col_local = True
+    elementwise = True
+
+    def __init__(self, steps):
+        self.steps = steps
+        writes = [s.writes for s in steps]
+        self.writes = None if any(w is None for w in writes) else sorted(set(c for w in writes for c in w), key=str)
+        self.name = "fused(%s)" % " -> ".join(s.name for s in steps)
+
+    def run(self, df):
+        out = df.copy()
+        for s in self.steps:
+            s.apply_inplace(out)
+        return out
+
+
+class _Normalize(_Step):
+
+    def __init__(self, axis=None, strict=True):
+        self.axis = axis
+        self.strict = strict
+        # columns are normalized independently on axis 0, rows independently on axis 1
+        self.col_local = axis == 0
+        self.row_local = axis == 1
+        self.name = "normalize(axis=%s)" % axis
+
+    def run(self, df):
+        return normalize(df, axis=self.axis, strict=self.strict)
+
+
+class _IndexTo(_Step):
+    col_local = True
+
+    def __init__(self, index_on, index_to, inverse=False):
+        self.index_on = index_on
+        self.index_to = index_to
+        self.inverse = inverse
+        self.name = "index_to(%s=%s)" % (index_on, index_to)
+
+    def run(self, df):
+        return index_to(df, self.index_on, self.index_to, inverse=self.inverse)
+
+
+class _GroupToOther(_Step):
+    col_local = True
+
+    def __init__(self, column, weights=None, pct=.02, other_label="other"):
+        self.column = column
+        self.weights = weights
+        self.pct = pct
+        self.other_label = other_label
+        self.writes = [column]
+        self.name = "group_to_other(%s)" % column
+
+    def needs_columns(self):
+        return [self.column] + ([self.weights] if self.weights is not None else [])
+
+    def run(self, df):
+        weights = df[self.weights] if self.weights is not None else None
+        out = df.copy()
+        out[self.column] = group_to_other(df[self.column], weights=weights, pct=self.pct,
+                                          other_label=self.other_label).values
+        return out
+
+
+class _FmtRetail(_Step):
+    row_local = True
+    col_local = True
+
+    def __init__(self, keywords=None, force=True):
+        self.keywords = keywords or {}
+        self.force = force
+        self.name = "fmt_retail"
+
+    def run(self, df):
+        formatted = [fmt_series_retail(df[c], keyword=self.keywords.get(c), force=self.force) for c in df.columns]
+        return pd.concat(formatted, axis=1, keys=df.columns)
+
+
+class _Pipe(_Step):
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.name = "pipe(%s)" % getattr(func, "__name__", "func")
+
+    def run(self, df):
+        return self.func(df, *self.args, **self.kwargs)
+
+
+def _can_push_select(select, step):
+    """can the column selection move in front of <step> without changing the result"""
+    if not step.col_local:
+        return False
+    return all(c in select.columns for c in step.needs_columns())
+
+
+def _can_push_filter(filt, step):
+    """can the row filter move in front of <step> without changing the result"""
+    if not step.row_local:
+        return False
+    if filt.reads is None:
+        # the predicate may read any column, so it can only pass steps that change nothing
+        return step.writes is not None and len(step.writes) == 0
+    if step.writes is None:
+        return len(filt.reads) == 0
+    return not set(filt.reads).intersection(step.writes)
+
+
+def optimize(steps):
+    """
+    return a new list of steps with selections and filters pushed toward the start
+    and consecutive elementwise steps fused
+    """
+    steps = list(steps)
+    moved = True
+    while moved:
+        moved = False
+        for i in range(1, len(steps)):
+            prev, cur = steps[i - 1], steps[i]
+            if isinstance(cur, _Select):
+                if isinstance(prev, _Filter):
+                    # the filter still needs every column it reads
+                    ok = prev.reads is not None and set(prev.reads).issubset(cur.columns)
+                else:
+                    ok = _can_push_select(cur, prev)
+            elif isinstance(cur, _Filter):
+                ok = _can_push_filter(cur, prev)
+            else:
+                ok = False
+            if ok:
+                steps[i - 1], steps[i] = cur, prev
+                moved = True
+
+    fused = []
+    for s in steps:
+        if s.elementwise and fused and fused[-1].elementwise:
+            prev = fused.pop()
+            inner = prev.steps if isinstance(prev, _FusedMap) else [prev]
+            fused.append(_FusedMap(inner + [s]))
+        else:
+            fused.append(s)
+    return fused
+
+
+class Pipeline(object):
+    """
+    A lazy chain of pdutils operations on a dataframe
+
+    Every method returns a new Pipeline with the step appended, the source dataframe
+    is not touched until .collect() is called
+    """
+
+    def __init__(self, df, steps=None):
+        self.df = df
+        self.steps = list(steps or [])
+
+    def _append(self, step):
+        return Pipeline(self.df, self.steps + [step])
+
+    def select(self, columns):
+        """keep only <columns>"""
+        return self._append(_Select(columns))
+
+    def filter(self, predicate, reads=None):
+        """
+        keep the rows where predicate(df) is True
+
+        reads: list of columns the predicate looks at, [] if it only uses the index
+               if None (default) the predicate is assumed to read every column, which limits how far it can be pushed
+        """
+        return self._append(_Filter(predicate, reads=reads))
+
+    def map(self, func, columns=None):
+        """apply a vectorized elementwise function (numpy array -> numpy array) to <columns> (default all)"""
+        return self._append(_Map(func, columns=columns))
+
+    def normalize(self, axis=None, strict=True):
+        return self._append(_Normalize(axis=axis, strict=strict))
+
+    def index_to(self, index_on, index_to, inverse=False):
+        return self._append(_IndexTo(index_on, index_to, inverse=inverse))
+
+    def group_to_other(self, column, weights=None, pct=.02, other_label="other"):
+        """replace the values of <column> with small groups collapsed to <other_label>"""
+        return self._append(_GroupToOther(column, weights=weights, pct=pct, other_label=other_label))
+
+    def fmt_retail(self, keywords=None, force=True):
+        """
+        format every column with fmt_series_retail
+
+        keywords: optional dict of column name -> keyword
+        """
+        return self._append(_FmtRetail(keywords=keywords, force=force))
+
+    def pipe(self, func, *args, **kwargs):
+        """an opaque step, func(df, *args, **kwargs) must return a dataframe"""
+        return self._append(_Pipe(func, args, kwargs))
+
+    def plan(self):
+        """the optimized list of steps that .collect() will run"""
+        return optimize(self.steps)
+
+    def explain(self):
+        """return a string of the optimized plan"""
+        return " -> ".join(repr(s) for s in self.plan()) or "source"
+
+    def collect(self):
+        """run the optimized plan and return the result"""
+        out = self.df
+        for step in self.plan():
+            logging.debug("Pipeline running step %s" % step.name)
+            out = step.run(out)
+        return out
+
+    def __repr__(self):
+        return "Pipeline(%s)" % (" -> ".join(repr(s) for s in self.steps) or "source")
@@ -0,0 +1,169 @@
+"""
+Out-of-core versions of multi_groupby and analyze_distributions
+
+Each chunk of a larger-than-memory file is reduced to partial aggregates (sums and counts)
+on the finest grouping. The partial states can be merged in any order, pickled and sent
+between processes, and the final result is computed from the merged state with the
+in-memory functions, so the output has the same shape as calling them on the whole frame.
+
+    >>> state = MultiGroupbyState(by=["store", "brand"])
+    >>> for chunk in chunk_col_values("transactions.csv", "store"):
+    ...     state.update(chunk)
+    >>> state.result()
+"""
+
+import pandas as pd
+
+from .pdutils import multi_groupby, analyze_distributions
+
+
+def _reduce_partials(frames, nlevels):
+    """sum partial aggregates that share the same group keys"""
+    frames = [f for f in frames if f is not None]
+    if not frames:
+        return None
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames).groupby(level=list(range(nlevels)), sort=True, dropna=False).sum()
+
+
+class MultiGroupbyState(object):
+    """
+    Partial state for a streaming multi_groupby
+
+    Parameters are the same as multi_groupby
+    the sums and non-null counts of each column are kept for every combination of <by>/<level>
+    """
+
+    def __init__(self, by=None, level=None, func='sum', nafill="-", max_combos=None):
+        if by and level:
+            raise AssertionError("Only Specify one of the paramters by= or level=")
+        if func not in ('sum', 'mean'):
+            raise NotImplementedError("Only functions 'sum' and 'mean' are currently supported")
+        self.by = list(by) if by else None
+        self.level = list(level) if level else None
+        self.func = func
+        self.nafill = nafill
+        self.max_combos = max_combos
+        self.columns = None
+        self.sums = None
+        self.counts = None
+
+    @property
+    def groupby(self):
+        return self.by or self.level
+
+    def _group_args(self, chunk):
+        if self.by:
+            return {"by": self.by}
+        if self.level is None:
+            # same default as multi_groupby, all index levels
+            self.level = list(chunk.index.names)
+        return {"level": self.level}
+
+    def update(self, chunk):
+        """add the aggregates of one chunk (dataframe) to the state, returns self"""
+        group_args = self._group_args(chunk)
+        if self.columns is None:
+            self.columns = [c for c in chunk.columns if c not in set(self.groupby)]
+        # missing keys are kept at the finest grouping, the coarser groupings in multi_groupby
+        # still need the rows that are only missing a key they do not group on
+        grouped = chunk.groupby(dropna=False, **group_args)[self.columns]
+        self.sums = _reduce_partials([self.sums, grouped.sum()], len(self.groupby))
+        if self.func == 'mean':
+            self.counts = _reduce_partials([self.counts, grouped.count()], len(self.groupby))
+        return self
+
+    def merge(self, other):
+        """merge another state (e.g. computed in a different process) into this one, returns self"""
+        if other.sums is None:
+            return self
+        if self.sums is None:
+            self.columns, self.level = other.columns, self.level or other.level
+        self.sums = _reduce_partials([self.sums, other.sums], len(self.groupby))
+        if self.func == 'mean':
+            self.counts = _reduce_partials([self.counts, other.counts], len(self.groupby))
+        return self
+
+    def _combine(self, partial):
+        if self.by:
+            return multi_groupby(partial.reset_index(), by=self.by, func='sum', nafill=self.nafill, max_combos=self.max_combos)
+        return multi_groupby(partial, level=self.level, func='sum', nafill=self.nafill, max_combos=self.max_combos)
+
+    def result(self):
+        """the multi_groupby output for all of the chunks seen so far"""
+        if self.sums is None:
+            raise ValueError("No chunks have been added to the state")
+        sums = self._combine(self.sums)
+        if self.func == 'sum':
+            return sums
+        counts = self._combine(self.counts)
+        return sums / counts
+
+
+class DistributionState(object):
+    """
+    Partial state for a streaming analyze_distributions
+
+    Parameters are the same as analyze_distributions,
+    the sums over <compare_level> x <dist_level> are kept
+    """
+
+    def __init__(self, compare_level, dist_level, output_global_dist=False):
+        self.compare_level = compare_level
+        self.dist_level = dist_level
+        self.output_global_dist = output_global_dist
+        self.sums = None
+
+    def update(self, chunk):
+        """add the sums of one chunk (series, or a single column dataframe) to the state, returns self"""
+        if isinstance(chunk, pd.DataFrame):
+            chunk = chunk.iloc[:, 0]
+        partial = chunk.groupby(level=[self.compare_level, self.dist_level], sort=True).sum()
+        self.sums = _reduce_partials([self.sums, partial], 2)
+        return self
+
+    def merge(self, other):
+        """merge another state (e.g. computed in a different process) into this one, returns self"""
+        self.sums = _reduce_partials([self.sums, other.sums], 2)
+        return self
+
+    def result(self):
+        """the analyze_distributions output for all of the chunks seen so far"""
+        if self.sums is None:
+            raise ValueError("No chunks have been added to the state")
+        return analyze_distributions(self.sums, self.compare_level, self.dist_level,
+                                     output_global_dist=self.output_global_dist)
+
+
+def combine_states(states):
+    """merge an iterable of partial states into the first one and return it"""
+    states = iter(states)
+    first = next(states)
+    for s in states:
+        first.merge(s)
+    return first
+
+
+def streaming_multi_groupby(chunks, by=None, level=None, func='sum', nafill="-", max_combos=None):
+    """
+    multi_groupby over an iterator of dataframes that together make up the full frame
+
+    see multi_groupby for the parameters
+    """
+    state = MultiGroupbyState(by=by, level=level, func=func, nafill=nafill, max_combos=max_combos)
+    for chunk in chunks:
+        state.update(chunk)
+    return state.result()
+
+
+def streaming_analyze_distributions(chunks, compare_level, dist_level, output_global_dist=False):
+    """
+    analyze_distributions over an iterator of series that together make up the full series
+
+    see analyze_distributions for the parameters
+    """
+    state = DistributionState(compare_level, dist_level, output_global_dist=output_global_dist)
+    for chunk in chunks:
+        state.update(chunk)
+    return state.result()
@@ -3,7 +3,9 @@ try:
 except ModuleNotFoundError:
     from io import StringIO
 import matplotlib.pyplot as plt
+import pandas as pd
 from jinja2 import Template
+from ..pdutils import render_fmt
 
 def fig_to_svg(fig, bbox_inches="tight", pad_inches=0.0):
     imgdat = StringIO.StringIO()
@@ -12,6 +14,10 @@ def fig_to_svg(fig, bbox_inches="tight", pad_inches=0.0):
     svg_dat = imgdat.buf
     return  imgdat.buf
 
+def df_to_html(df):
+    """ returns the html table of the dataframe, with any deferred formats applied """
+    return render_fmt(df).to_html()
+
 def str_identity(s):
     """ returns the same string that is input """
     return s
@@ -20,13 +26,15 @@ class Content(object):
     
     def __init__(self, obj, html_id="", html_class=""):  
         """
-        obj -- str or matplotlib Figure for now -- object that will be placed as content
+        obj -- str, pandas DataFrame or matplotlib Figure for now -- object that will be placed as content
+                deferred formats on a DataFrame (see pdutils.defer_fmt_retail) are applied when it is rendered
         id -- str -- html id of the div that wraps the content space separated
         classes -- str -- html classes of the div that wraps the content space separated
         """
         self.orig = obj
         self.parsers = {
             plt.Figure: fig_to_svg,
+            pd.DataFrame: df_to_html,
             str: str_identity
         }
         self.html_class=html_class
@@ -47,6 +55,8 @@ class Content(object):
 
         if isinstance(obj, (plt.Figure,)):
             self.html_string = fig_to_svg(obj)
+        elif isinstance(obj, pd.DataFrame):
+            self.html_string = df_to_html(obj)
         elif isinstance(obj, basestring):
             self.html_string = obj
         else:
@@ -1 +1,7 @@
-from .skutils import *
\ No newline at end of file
+from .skutils import *
+from .search import PrefixGridSearch
+from .ensemble import PackedEnsemble, pack_ensemble
+from .profiling import ProfiledStep, profile_pipeline
+from .streaming import partial_fit_pipeline, iter_transform, stream_transform, prefetch, CSVSink, LDJSONSink
+from .persistence import save_pipeline, load_pipeline
+from .serving import MicroBatcher, ScoringServer, ScoringClient
@@ -0,0 +1,115 @@
+"""
+Save fitted pipelines with their large numpy arrays in separate .npy files
+
+save_pipeline pickles the pipeline, but every numpy array of at least min_bytes is written to its own
+.npy file and only a reference to it goes into the pickle. load_pipeline memory-maps those files
+read-only, so loading is fast and all the scoring processes on a host share one physical copy of
+the arrays through the page cache.
+
+    >>> save_pipeline(link_pipes(("prep", prep), ("model", model)), "models/v3")
+    >>> name, pipe = load_pipeline("models/v3")
+
+Arrays held inside compiled objects are copied out of the map when they are unpickled
+(sklearn's tree nodes, for example); pack tree ensembles with pack_ensemble to share them too.
+Estimators that write into their fitted arrays need load_pipeline(..., mmap_mode="c") or None.
+"""
+
+import os
+import pickle
+import shutil
+import uuid
+import numpy as np
+
+_ARRAY_DIR_PREFIX = "arrays-"
+# written into every array directory save_pipeline creates, only directories holding it are ever deleted
+_MARKER_FILE = "written_by_save_pipeline"
+_PICKLE_FILE = "pipeline.p"
+
+
+def _array_dirs(directory):
+    """the array directories written by save_pipeline in <directory>"""
+    return [name for name in os.listdir(directory)
+            if name.startswith(_ARRAY_DIR_PREFIX) and os.path.isfile(os.path.join(directory, name, _MARKER_FILE))]
+
+
+class _ArrayPickler(pickle.Pickler):
+    def __init__(self, f, directory, array_dir, min_bytes):
+        pickle.Pickler.__init__(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.directory = directory
+        self.array_dir = array_dir
+        self.min_bytes = min_bytes
+        # id -> file name, so an array referenced by several steps is written once
+        self.written = {}
+        self.keep_alive = []
+
+    def persistent_id(self, obj):
+        if not isinstance(obj, np.ndarray) or obj.dtype.hasobject or obj.nbytes < self.min_bytes:
+            return None
+        key = id(obj)
+        if key not in self.written:
+            name = "%s/%05d.npy" % (self.array_dir, len(self.written))
+            np.save(os.path.join(self.directory, name), obj, allow_pickle=False)
+            self.written[key] = name
+            self.keep_alive.append(obj)
+        return ("npy", self.written[key])
+
+
+class _ArrayUnpickler(pickle.Unpickler):
+    def __init__(self, f, directory, mmap_mode):
+        pickle.Unpickler.__init__(self, f)
+        self.directory = directory
+        self.mmap_mode = mmap_mode
+
+    def persistent_load(self, pid):
+        kind, name = pid
+        if kind != "npy":
+            raise pickle.UnpicklingError("Unknown persistent id %s" % (pid,))
+        return np.load(os.path.join(self.directory, name), mmap_mode=self.mmap_mode, allow_pickle=False)
+
+
+def save_pipeline(pipe, directory, min_bytes=2**16, overwrite=False):
+    """
+    Save a fitted pipeline (or any picklable object) to <directory>
+
+    Inputs
+    ------
+    pipe: a Pipeline, the ("name", Pipeline) tuple returned by link_pipes, or any picklable object
+    directory: string, created if needed
+    min_bytes: int, numpy arrays at least this large are written to their own .npy file
+    overwrite: bool, replace an existing saved pipeline in <directory>
+        the old files are unlinked rather than rewritten, so processes that still map them are not affected
+
+    Each save writes its arrays to a new arrays-* directory and then moves the pickle into place, so a reader
+    finds either the old or the new pipeline. The array directories of earlier or unfinished saves are
+    deleted afterwards; they are recognized by a marker file, other files in <directory> are left alone.
+
+    Outputs
+    -------
+    the number of arrays written to separate files
+    """
+    if os.path.exists(os.path.join(directory, _PICKLE_FILE)) and not overwrite:
+        raise IOError("%s already holds a saved pipeline, use overwrite=True to replace it" % directory)
+    array_dir = _ARRAY_DIR_PREFIX + uuid.uuid4().hex[:12]
+    os.makedirs(os.path.join(directory, array_dir))
+    open(os.path.join(directory, array_dir, _MARKER_FILE), "w").close()
+    tmp = os.path.join(directory, _PICKLE_FILE + ".tmp")
+    with open(tmp, "wb") as f:
+        pickler = _ArrayPickler(f, directory, array_dir, min_bytes)
+        pickler.dump(pipe)
+    # the pickle appears last, so a reader never finds it without its arrays
+    os.replace(tmp, os.path.join(directory, _PICKLE_FILE))
+    for old in _array_dirs(directory):
+        if old != array_dir:
+            shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+    return len(pickler.written)
+
+
+def load_pipeline(directory, mmap_mode="r"):
+    """
+    Load a pipeline saved with save_pipeline
+
+    mmap_mode: "r" (default) maps the large arrays read-only, "c" maps them copy-on-write,
+        None reads them into memory
+    """
+    with open(os.path.join(directory, _PICKLE_FILE), "rb") as f:
+        return _ArrayUnpickler(f, directory, mmap_mode).load()
@@ -0,0 +1,265 @@
+"""
+Time and measure the memory of every step of link_pipes / union_pipes pipelines
+
+profile_pipeline wraps each step of a (possibly nested) Pipeline or FeatureUnion in a ProfiledStep,
+which records the wall time, the input and output shapes and the peak traced memory of every
+fit, transform, fit_transform, fit_resample and predict call. The report is a tree that follows
+the "->"/"||" names of the pipeline, so the step that dominates a fit is easy to find.
+
+    >>> name, profiled = profile_pipeline(link_pipes(("prep", prep), ("model", model)))
+    >>> profiled.fit(X, y).predict(X)
+    >>> print(profiled.format_report())
+
+Times and peaks are inclusive: a pipeline's numbers include the numbers of its steps.
+Memory is measured with tracemalloc, which slows down allocation heavy steps, and branches that
+run in threads at the same time are not measured separately; use trace_memory=False for timings only.
+"""
+
+import threading
+import time
+import tracemalloc
+import pandas as pd
+from sklearn.base import BaseEstimator
+from sklearn.pipeline import Pipeline as SKPipeline, FeatureUnion
+from sklearn.utils.metaestimators import available_if
+
+# per thread stack of [traced memory at the start of the call, highest peak seen by the calls below it]
+_local = threading.local()
+
+
+def _estimator_has(attr):
+    return lambda self: hasattr(self.estimator, attr)
+
+
+def _shape(X):
+    if isinstance(X, tuple):
+        # fit_resample returns (X, y)
+        X = X[0]
+    shape = getattr(X, "shape", None)
+    if shape is not None:
+        return tuple(shape)
+    try:
+        return (len(X),)
+    except TypeError:
+        return None
+
+
+class _Measure(object):
+    """context manager that measures the time and peak traced memory of one call"""
+
+    def __init__(self, trace_memory):
+        self.trace_memory = trace_memory
+        self.owner = False
+
+    def __enter__(self):
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.owner = True
+            stack = getattr(_local, "stack", None)
+            if stack is None:
+                stack = _local.stack = []
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                # reset_peak below would lose the caller's peak so far, carry it on the stack
+                stack[-1][1] = max(stack[-1][1], peak)
+            stack.append([current, 0])
+            tracemalloc.reset_peak()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.time() - self.start
+        self.peak_bytes = None
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            start, carried = _local.stack.pop()
+            peak = max(peak, carried)
+            self.peak_bytes = peak - start
+            if _local.stack:
+                _local.stack[-1][1] = max(_local.stack[-1][1], peak)
+            if self.owner:
+                tracemalloc.stop()
+        return False
+
+
+class ProfiledStep(BaseEstimator):
+    """
+    Wraps an estimator and records every call to it in calls_, a list of dicts with
+    method, seconds, peak_bytes, input_shape and output_shape
+
+    Parameters
+    ----------
+    estimator: the wrapped estimator, transformer, sampler, Pipeline or FeatureUnion
+    name: the step's name in the report
+    trace_memory: bool, measure the peak memory of each call with tracemalloc
+    """
+
+    def __init__(self, estimator, name=None, trace_memory=True):
+        self.estimator = estimator
+        self.name = name
+        self.trace_memory = trace_memory
+
+    def __getattr__(self, attr):
+        # fitted attributes such as classes_ are read from the wrapped estimator
+        if attr.endswith("_") and not attr.startswith("__") and "estimator" in self.__dict__:
+            return getattr(self.estimator, attr)
+        raise AttributeError(attr)
+
+    def __sklearn_is_fitted__(self):
+        return bool(getattr(self, "calls_", None))
+
+    def _call(self, method, X, *args, **kwargs):
+        with _Measure(self.trace_memory) as measure:
+            out = getattr(self.estimator, method)(X, *args, **kwargs)
+        record = {
+            "method": method,
+            "seconds": measure.seconds,
+            "peak_bytes": measure.peak_bytes,
+            "input_shape": _shape(X),
+            "output_shape": None if out is self.estimator else _shape(out),
+        }
+        self.__dict__.setdefault("calls_", []).append(record)
+        return out
+
+    def fit(self, X, y=None, **fit_params):
+        self._call("fit", X, y, **fit_params)
+        return self
+
+    @available_if(_estimator_has("fit_transform"))
+    def fit_transform(self, X, y=None, **fit_params):
+        return self._call("fit_transform", X, y, **fit_params)
+
+    @available_if(_estimator_has("fit_resample"))
+    def fit_resample(self, X, y, **fit_params):
+        return self._call("fit_resample", X, y, **fit_params)
+
+    @available_if(_estimator_has("fit_predict"))
+    def fit_predict(self, X, y=None, **fit_params):
+        return self._call("fit_predict", X, y, **fit_params)
+
+    @available_if(_estimator_has("transform"))
+    def transform(self, X, **kwargs):
+        return self._call("transform", X, **kwargs)
+
+    @available_if(_estimator_has("predict"))
+    def predict(self, X, **kwargs):
+        return self._call("predict", X, **kwargs)
+
+    @available_if(_estimator_has("predict_proba"))
+    def predict_proba(self, X, **kwargs):
+        return self._call("predict_proba", X, **kwargs)
+
+    @available_if(_estimator_has("decision_function"))
+    def decision_function(self, X, **kwargs):
+        return self._call("decision_function", X, **kwargs)
+
+    @available_if(_estimator_has("score"))
+    def score(self, X, y=None, **kwargs):
+        return self._call("score", X, y, **kwargs)
+
+    @available_if(_estimator_has("get_feature_names_out"))
+    def get_feature_names_out(self, input_features=None):
+        return self.estimator.get_feature_names_out(input_features)
+
+    def report(self):
+        """
+        DataFrame with one row per (step, method) in pipeline order
+
+        columns: step (indented by depth), depth, method, calls, seconds, peak_mb, input_shape, output_shape
+            seconds is the total over the calls, peak_mb the highest peak and the shapes are from the last call
+        """
+        rows = []
+        for depth, name, step in _walk(self, 0):
+            calls = step.__dict__.get("calls_", [])
+            by_method = {}
+            for call in calls:
+                by_method.setdefault(call["method"], []).append(call)
+            if not by_method:
+                rows.append({"step": "  " * depth + name, "depth": depth, "method": None, "calls": 0})
+            for method, method_calls in by_method.items():
+                peaks = [c["peak_bytes"] for c in method_calls if c["peak_bytes"] is not None]
+                rows.append({
+                    "step": "  " * depth + name,
+                    "depth": depth,
+                    "method": method,
+                    "calls": len(method_calls),
+                    "seconds": sum(c["seconds"] for c in method_calls),
+                    "peak_mb": max(peaks) / 2.**20 if peaks else None,
+                    "input_shape": method_calls[-1]["input_shape"],
+                    "output_shape": method_calls[-1]["output_shape"],
+                })
+        columns = ["step", "depth", "method", "calls", "seconds", "peak_mb", "input_shape", "output_shape"]
+        return pd.DataFrame(rows, columns=columns)
+
+    def format_report(self):
+        """the report as an indented text tree, one line per (step, method)"""
+        lines = []
+        for _, row in self.report().iterrows():
+            if not row["calls"]:
+                lines.append("%s  (not called)" % row["step"])
+                continue
+            peak = "" if pd.isnull(row["peak_mb"]) else "  peak %.1fMB" % row["peak_mb"]
+            lines.append("%-40s %-14s %4dx %9.4fs%s  %s -> %s" % (
+                row["step"], row["method"], row["calls"], row["seconds"], peak,
+                row["input_shape"], row["output_shape"]))
+        return "\n".join(lines)
+
+
+def _children(est):
+    if isinstance(est, SKPipeline):
+        return est.steps
+    if isinstance(est, FeatureUnion):
+        return est.transformer_list
+    return []
+
+
+def _walk(step, depth):
+    """yields (depth, name, ProfiledStep) for step and every ProfiledStep below it"""
+    yield depth, step.name, step
+    for name, child in _children(step.estimator):
+        if isinstance(child, ProfiledStep):
+            for item in _walk(child, depth + 1):
+                yield item
+
+
+def _instrument(est, name, trace_memory):
+    if est is None or isinstance(est, str):
+        # "passthrough" and "drop"
+        return est
+    if isinstance(est, SKPipeline):
+        est = _shallow_copy(est)
+        est.steps = [(n, _instrument(s, n, trace_memory)) for n, s in est.steps]
+        # cached steps would be cloned and never called, so the copy does not use memory
+        est.memory = None
+    elif isinstance(est, FeatureUnion):
+        est = _shallow_copy(est)
+        est.transformer_list = [(n, _instrument(s, n, trace_memory)) for n, s in est.transformer_list]
+    return ProfiledStep(est, name=name, trace_memory=trace_memory)
+
+
+def _shallow_copy(est):
+    new = est.__class__.__new__(est.__class__)
+    new.__dict__.update(est.__dict__)
+    return new
+
+
+def profile_pipeline(pipe, trace_memory=True):
+    """
+    Instrument every step of a pipeline for profiling
+
+    Inputs
+    ------
+    pipe: a ("name", Pipeline/FeatureUnion) tuple from link_pipes or union_pipes, or an estimator
+    trace_memory: bool, also record the peak memory of every call (slower)
+
+    Outputs
+    -------
+    ("name", ProfiledStep) if pipe is a tuple, otherwise the ProfiledStep
+    The pipelines and unions are copied, the leaf estimators are shared with pipe and are fit in place.
+    Call .report() or .format_report() on the ProfiledStep after fitting or predicting.
+    """
+    if isinstance(pipe, tuple):
+        name, est = pipe
+        return (name, _instrument(est, name, trace_memory))
+    return _instrument(pipe, type(pipe).__name__, trace_memory)
@@ -0,0 +1,230 @@
+"""
+Grid search over link_pipes pipelines that fits each distinct pipeline prefix once
+
+The steps of a (possibly nested) pipeline built with link_pipes form a sequence, and most grid
+candidates only differ in their later steps. The candidates are arranged in a tree on the
+parameters of each step: every distinct prefix is fit once per cv fold and its transformed
+output is shared by all the candidates below it. Once the candidates differ, the rest of their
+steps are fit and scored in a process pool, and the data they share is sent once to each task.
+The search time grows with the number of distinct prefixes instead of the number of candidates.
+"""
+
+import logging
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.base import clone, is_classifier
+from sklearn.metrics import check_scoring
+from sklearn.model_selection import ParameterGrid, check_cv
+from sklearn.pipeline import Pipeline as SKPipeline
+from imblearn.pipeline import Pipeline
+
+
+def _flatten_steps(est, prefix=""):
+    """list of (parameter prefix, estimator) for every leaf step of nested pipelines, in order"""
+    if isinstance(est, SKPipeline):
+        flat = []
+        for name, step in est.steps:
+            flat.extend(_flatten_steps(step, prefix + name + "__"))
+        return flat
+    return [(prefix[:-2], est)]
+
+
+def _take_rows(X, idx):
+    if X is None:
+        return None
+    if isinstance(X, (pd.DataFrame, pd.Series)):
+        return X.iloc[idx]
+    return X[idx]
+
+
+def _split_params(flat, params):
+    """for each flat step, the sorted tuple of (parameter, value) of <params> that belongs to it"""
+    per_step = [[] for _ in flat]
+    for key, value in params.items():
+        matches = [i for i, (p, _) in enumerate(flat) if key == p or key.startswith(p + "__")]
+        if not matches:
+            raise ValueError("Parameter %s does not belong to a step of the pipeline" % key)
+        i = max(matches, key=lambda j: len(flat[j][0]))
+        sub = "" if key == flat[i][0] else key[len(flat[i][0]) + 2:]
+        per_step[i].append((sub, value))
+    return [tuple(sorted(p, key=lambda kv: kv[0])) for p in per_step]
+
+
+def _params_key(step_params):
+    """
+    a hashable key that is equal for equal settings of a step: hashable values compare by type and value,
+    the others (lists, arrays, dicts) by identity, ParameterGrid gives every candidate the same object
+    """
+    key = []
+    for k, v in step_params:
+        try:
+            hash(v)
+            key.append((k, type(v), v))
+        except TypeError:
+            key.append((k, "id", id(v)))
+    return tuple(key)
+
+
+def _group(step_params, depth, ids):
+    """the candidates <ids> grouped by their setting of the step at <depth>, in order"""
+    groups = OrderedDict()
+    for i in ids:
+        groups.setdefault(_params_key(step_params[i][depth]), []).append(i)
+    return list(groups.values())
+
+
+def _build_step(base, step_params):
+    """a fresh copy of the step with the candidate's parameters, "" replaces the step itself"""
+    params = dict(step_params)
+    est = params.pop("", base)
+    if est is None or (isinstance(est, str) and est == "passthrough"):
+        return None
+    est = clone(est)
+    if params:
+        est.set_params(**params)
+    return est
+
+
+def _fit_step(step, X_train, y_train, X_test):
+    """the train and test data after a (non-final) step"""
+    if step is None:
+        return X_train, y_train, X_test
+    if hasattr(step, "fit_resample"):
+        # samplers only change the training data, like in an imblearn pipeline
+        X_train, y_train = step.fit_resample(X_train, y_train)
+        return X_train, y_train, X_test
+    return step.fit_transform(X_train, y_train), y_train, step.transform(X_test)
+
+
+def _fit_suffixes(flat, step_params, depth, ids, data, scoring, scores):
+    """
+    fit and score the steps from <depth> on for candidates <ids>, each distinct setting of a step is fit once
+
+    data: (X_train, y_train, X_test, y_test) as output by the steps before <depth>
+    the score of each candidate is set in the dict scores, returns the number of (non-final) step fits
+    """
+    X_train, y_train, X_test, y_test = data
+    if depth == len(flat) - 1:
+        for i in ids:
+            final = _build_step(flat[depth][1], step_params[i][depth])
+            final.fit(X_train, y_train)
+            scores[i] = check_scoring(final, scoring)(final, X_test, y_test)
+        return 0
+    n_fits = 0
+    for group_ids in _group(step_params, depth, ids):
+        step = _build_step(flat[depth][1], step_params[group_ids[0]][depth])
+        n_fits += step is not None
+        Xtr, ytr, Xte = _fit_step(step, X_train, y_train, X_test)
+        n_fits += _fit_suffixes(flat, step_params, depth + 1, group_ids, (Xtr, ytr, Xte, y_test), scoring, scores)
+    return n_fits
+
+
+def _fit_suffixes_task(flat, step_params, depth, ids, data, scoring):
+    """_fit_suffixes in a worker process, returns the scores and the number of step fits"""
+    scores = {}
+    n_fits = _fit_suffixes(flat, step_params, depth, ids, data, scoring, scores)
+    return scores, n_fits
+
+
+class PrefixGridSearch(object):
+    """
+    Grid search that shares the fitted prefixes of link_pipes pipelines between candidates
+
+    Parameters
+    ----------
+    estimator: a Pipeline, or the ("name", Pipeline) tuple returned by link_pipes
+    param_grid: dict or list of dicts, as in sklearn's GridSearchCV
+        parameter names follow the pipeline's nesting, e.g. "(scale->pca)__pca__n_components"
+    cv: int or cross-validation generator, as in GridSearchCV
+    scoring: scorer name or callable, defaults to the final estimator's score method
+    n_jobs: number of processes, None or 1 fits everything in this process. The steps shared by all
+        candidates are fit in this process, the rest of the steps of each candidate in the pool
+    refit: bool, refit the best candidate on all of the data as best_estimator_,
+        a flat Pipeline of its steps named by their parameter prefix with "__" replaced by "."
+        (imblearn does not allow nested pipelines as intermediate steps)
+
+    Attributes after fit
+    --------------------
+    cv_results_, best_params_, best_score_, best_index_, best_estimator_
+    n_prefix_fits_: the number of (non-final) step fits that were run
+    """
+
+    def __init__(self, estimator, param_grid, cv=3, scoring=None, n_jobs=None, refit=True):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.cv = cv
+        self.scoring = scoring
+        self.n_jobs = n_jobs
+        self.refit = refit
+
+    def _expand(self, depth, ids, data, executor, tasks):
+        """
+        fit the steps shared by all candidates <ids> here, and once they differ hand the rest of their steps
+        to the process pool: the candidates are split into at most n_jobs tasks, each is sent the data once
+        """
+        last = depth == len(self._flat) - 1
+        groups = [[i] for i in ids] if last else _group(self._step_params, depth, ids)
+        if len(groups) > 1 or last:
+            n_tasks = min(len(groups), self.n_jobs)
+            for t in range(n_tasks):
+                task_ids = [i for group in groups[t::n_tasks] for i in group]
+                step_params = dict((i, self._step_params[i]) for i in task_ids)
+                tasks.append(executor.submit(_fit_suffixes_task, self._flat, step_params, depth, task_ids, data,
+                                             self.scoring))
+            return
+        step = _build_step(self._flat[depth][1], self._step_params[ids[0]][depth])
+        self.n_prefix_fits_ += step is not None
+        X_train, y_train, X_test = _fit_step(step, *data[:3])
+        self._expand(depth + 1, ids, (X_train, y_train, X_test, data[3]), executor, tasks)
+
+    def fit(self, X, y=None):
+        pipe = self.estimator[1] if isinstance(self.estimator, tuple) else self.estimator
+        self._flat = _flatten_steps(pipe)
+        candidates = list(ParameterGrid(self.param_grid))
+        self._step_params = [_split_params(self._flat, c) for c in candidates]
+        self.n_prefix_fits_ = 0
+
+        cv = check_cv(self.cv, y, classifier=is_classifier(pipe))
+        splits = list(cv.split(X, y))
+        scores = np.empty((len(candidates), len(splits)))
+        ids = list(range(len(candidates)))
+        executor = ProcessPoolExecutor(self.n_jobs) if self.n_jobs not in (None, 1) else None
+        try:
+            for k, (train, test) in enumerate(splits):
+                data = (_take_rows(X, train), _take_rows(y, train), _take_rows(X, test), _take_rows(y, test))
+                if executor is None:
+                    results = [_fit_suffixes_task(self._flat, self._step_params, 0, ids, data, self.scoring)]
+                else:
+                    tasks = []
+                    self._expand(0, ids, data, executor, tasks)
+                    del data
+                    results = (task.result() for task in tasks)
+                for fold_scores, n_fits in results:
+                    self.n_prefix_fits_ += n_fits
+                    for i, score in fold_scores.items():
+                        scores[i, k] = score
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        logging.info("PrefixGridSearch fit %s prefixes for %s candidates x %s folds"
+                     % (self.n_prefix_fits_, len(candidates), len(splits)))
+
+        means = scores.mean(axis=1)
+        self.cv_results_ = {"params": candidates, "mean_test_score": means, "std_test_score": scores.std(axis=1)}
+        for k in range(len(splits)):
+            self.cv_results_["split%s_test_score" % k] = scores[:, k]
+        order = np.argsort(-means, kind="stable")
+        ranks = np.empty(len(candidates), dtype=int)
+        ranks[order] = np.arange(1, len(candidates) + 1)
+        self.cv_results_["rank_test_score"] = ranks
+        self.best_index_ = int(order[0])
+        self.best_params_ = candidates[self.best_index_]
+        self.best_score_ = means[self.best_index_]
+        if self.refit:
+            best = self._step_params[self.best_index_]
+            steps = [(p.replace("__", "."), _build_step(base, best[i])) for i, (p, base) in enumerate(self._flat)]
+            self.best_estimator_ = Pipeline([(name, step if step is not None else "passthrough") for name, step in steps])
+            self.best_estimator_.fit(X, y)
+        return self
@@ -0,0 +1,285 @@
+"""
+Score single rows against a fitted pipeline in micro-batches
+
+A MicroBatcher queues the rows submitted from any number of threads and runs one vectorized
+predict for up to max_batch_size rows, or for whatever has arrived max_delay seconds after the
+first row of the batch, then hands each caller its own result.
+ScoringServer puts a MicroBatcher behind a Unix socket that speaks JSON lines, and ScoringClient
+talks to it, so several local processes can share one loaded model.
+
+    >>> with MicroBatcher(pipe, max_batch_size=256, max_delay=0.005) as batcher:
+    ...     batcher.predict({"age": 31, "visits": 4})
+    >>> server = ScoringServer(batcher, "/tmp/model.sock").start()
+    >>> ScoringClient("/tmp/model.sock").predict_many(rows)
+
+Each request line is a json row (an object of column -> value, or a list of values) and each
+response line is {"result": ...} or {"error": "..."}, in the order of the requests.
+"""
+
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+import pandas as pd
+
+_STOP = object()
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class MicroBatcher(object):
+    """
+    Collects rows into batches for one vectorized call of a fitted pipeline
+
+    Parameters
+    ----------
+    pipe: a fitted Pipeline or the ("name", Pipeline) tuple returned by link_pipes
+    method: "predict", "predict_proba", "decision_function" or "transform"
+    max_batch_size: int, a batch is scored as soon as it has this many rows
+    max_delay: float, seconds a row waits for more rows before its batch is scored
+    columns: list (optional), column names for rows given as lists
+
+    Rows are dicts of column -> value (scored as a DataFrame) or sequences of values (scored as an
+    array, or as a DataFrame if columns is given). If a batch fails, its rows are scored one by one so
+    that a bad row only fails its own caller.
+    """
+
+    def __init__(self, pipe, method="predict", max_batch_size=256, max_delay=0.005, columns=None):
+        self.estimator = pipe[1] if isinstance(pipe, tuple) else pipe
+        self.method = method
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.columns = columns
+        self.n_batches = 0
+        self.n_rows = 0
+        self._func = getattr(self.estimator, method)
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="brutils-microbatcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, row):
+        """queue one row, returns a concurrent.futures.Future of its result, raises RuntimeError after close()"""
+        future = Future()
+        with self._lock:
+            # nothing would score a row queued after the stop marker
+            if self._closed:
+                raise RuntimeError("The MicroBatcher is closed")
+            self._queue.put((row, future))
+        return future
+
+    def predict(self, row, timeout=None):
+        """score one row, blocking until its batch has run"""
+        return self.submit(row).result(timeout)
+
+    def _batch_input(self, rows):
+        if isinstance(rows[0], dict):
+            return pd.DataFrame(rows)
+        if isinstance(rows[0], pd.Series):
+            return pd.DataFrame(rows)
+        if self.columns is not None:
+            return pd.DataFrame(rows, columns=self.columns)
+        return np.asarray(rows)
+
+    def _score(self, batch):
+        rows = [row for row, _ in batch]
+        try:
+            out = self._func(self._batch_input(rows))
+            if isinstance(out, (pd.DataFrame, pd.Series)):
+                out = out.values
+            results = [out[i] for i in range(len(rows))]
+        except Exception:
+            if len(batch) == 1:
+                raise
+            logging.debug("Batch of %s rows failed, scoring them one at a time" % len(batch))
+            for item in batch:
+                self._score_and_set([item])
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(_to_json(result))
+
+    def _score_and_set(self, batch):
+        try:
+            self._score(batch)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.time() + self.max_delay
+            stop = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.time()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self.n_batches += 1
+            self.n_rows += len(batch)
+            self._score_and_set(batch)
+            if stop:
+                return
+
+    def close(self):
+        """score the rows already queued and stop the batching thread, safe to call more than once"""
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(_STOP)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # requests are read and submitted while earlier ones are still being scored,
+        # so one client's pipelined rows are batched too; a writer thread answers them in order
+        futures = queue.Queue()
+        writer = threading.Thread(target=self._write, args=(futures,))
+        writer.start()
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    futures.put(self.server.batcher.submit(json.loads(line)))
+                except (ValueError, RuntimeError) as e:
+                    # bad json, or the batcher was closed: answer with the error
+                    future = Future()
+                    future.set_exception(e)
+                    futures.put(future)
+        finally:
+            futures.put(None)
+            writer.join()
+
+    def _write(self, futures):
+        while True:
+            future = futures.get()
+            if future is None:
+                return
+            try:
+                response = {"result": future.result()}
+            except Exception as e:
+                response = {"error": "%s: %s" % (type(e).__name__, e)}
+            try:
+                self.wfile.write((json.dumps(response) + "\n").encode())
+                self.wfile.flush()
+            except (IOError, OSError):
+                # the client went away, drain the remaining futures
+                pass
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ScoringServer(object):
+    """
+    Serves a MicroBatcher on a Unix socket at <path>, see the module docstring for the protocol
+
+    start() runs the server in a background thread, close() stops it and removes the socket file
+    """
+
+    def __init__(self, batcher, path):
+        self.batcher = batcher
+        self.path = path
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._server = _UnixServer(self.path, _Handler)
+        self._server.batcher = self.batcher
+        self._thread = threading.Thread(target=self._server.serve_forever, name="brutils-scoring-server")
+        self._thread.daemon = True
+        self._thread.start()
+        logging.info("Scoring server listening on %s" % self.path)
+        return self
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class ScoringClient(object):
+    """Client for a ScoringServer, keeps one connection open"""
+
+    def __init__(self, path, timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self._file = self.sock.makefile("rwb")
+
+    def _read(self):
+        line = self._file.readline()
+        if not line:
+            raise IOError("The scoring server closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response["result"]
+
+    def predict(self, row):
+        """score one row"""
+        return self.predict_many([row])[0]
+
+    def predict_many(self, rows):
+        """send all the rows before reading the results, so the server can batch them"""
+        for row in rows:
+            self._file.write((json.dumps(_to_json(row)) + "\n").encode())
+        self._file.flush()
+        return [self._read() for _ in rows]
+
+    def close(self):
+        self._file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
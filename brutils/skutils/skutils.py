@@ -1,5 +1,64 @@
+import bisect
+import functools
+import logging
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from joblib import Memory
 from imblearn.pipeline import Pipeline
+from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.pipeline import FeatureUnion
+from sklearn.tree import _tree
+from sklearn.utils.validation import check_is_fitted
+from .union import ParallelFeatureUnion
+
+
+def _column_positions(colnames):
+    """
+    Index the column names once
+
+    Outputs
+    -------
+    positions, sorted_names, sorted_positions
+
+    positions: dict of column name -> position
+    sorted_names: list of the string column names sorted, for prefix lookups
+    sorted_positions: list of the positions of sorted_names
+    """
+    positions = {}
+    for i, c in enumerate(colnames):
+        positions.setdefault(c, i)
+    pairs = sorted((c, i) for i, c in enumerate(colnames) if isinstance(c, str))
+    return positions, [c for c, _ in pairs], [i for _, i in pairs]
+
+
+def _resolve_columns(positions, sorted_names, sorted_positions, columns=None, startswith=None):
+    """the positions of <columns> followed by the columns that start with each string in <startswith>"""
+    indxer = [positions[c] for c in (columns or [])]
+    for s in (startswith or []):
+        # every name starting with s sits in one run of the sorted names
+        i = bisect.bisect_left(sorted_names, s)
+        matched = []
+        while i < len(sorted_names) and sorted_names[i].startswith(s):
+            matched.append(sorted_positions[i])
+            i += 1
+        indxer.extend(sorted(matched))
+    return indxer
+
+
+def _take_columns(X, indxer):
+    """subset the columns of a dense array, sparse matrix or dataframe, as a view when the columns are contiguous"""
+    indxer = np.asarray(indxer, dtype=np.intp)
+    contiguous = len(indxer) > 0 and np.array_equal(indxer, np.arange(indxer[0], indxer[0] + len(indxer)))
+    key = slice(indxer[0], indxer[-1] + 1) if contiguous else indxer
+    if isinstance(X, pd.DataFrame):
+        return X.iloc[:, key]
+    if sparse.issparse(X) and X.format not in ("csr", "csc"):
+        # coo and the other formats do not support indexing, csr and csc are indexed as they are
+        X = X.tocsr()
+    return X[:, key]
+
+
 def organize_colnames(X):
     """
     Organizes a keep_fxn so we can use it in a pipeline to subset columns
@@ -14,31 +73,107 @@ def organize_colnames(X):
 
     colnames: A numpy array of the column names of X
     keep_fxn: A Function that can be used to subset the numpy array underlying X using column names, not position
+
+    see ColumnSelector for a transformer that does the same thing
     """   
     
     colnames = X.columns
+    positions, sorted_names, sorted_positions = _column_positions(colnames)
     # make startswith a string list
-    def keep_fxn(X_t, columns=[], startswith=[]):
+    def keep_fxn(X_t, columns=None, startswith=None):
         """This can be used in a pipeline to subset columns"""
-        if columns:
-            cols = columns
-        else:
-            cols = []
-        cols.extend([x for s in startswith for x in colnames if x.startswith(s)])
-        indxer = [colnames.tolist().index(cname) for cname in cols]
-        return X_t[:, indxer]
+        indxer = _resolve_columns(positions, sorted_names, sorted_positions, columns=columns, startswith=startswith)
+        return _take_columns(X_t, indxer)
         
     return colnames, keep_fxn
 
 
+class ColumnSelector(BaseEstimator, TransformerMixin):
+    """
+    Selects columns by name in a pipeline
+
+    The name -> position lookup is built once in fit, so transform only slices the input.
+    Contiguous selections of dense arrays and dataframes are views, not copies.
+
+    Parameters
+    ----------
+    columns: list of column names to keep
+    startswith: list of strings, keep every column whose name starts with one of them
+    colnames: list of the column names of X, needed when fit is called with an array instead of a dataframe
+    """
+
+    def __init__(self, columns=None, startswith=None, colnames=None):
+        self.columns = columns
+        self.startswith = startswith
+        self.colnames = colnames
+
+    def fit(self, X, y=None):
+        colnames = X.columns if isinstance(X, pd.DataFrame) else self.colnames
+        if colnames is None:
+            raise ValueError("ColumnSelector needs a dataframe or the colnames parameter to look up column names")
+        positions, sorted_names, sorted_positions = _column_positions(colnames)
+        self.indices_ = np.asarray(_resolve_columns(positions, sorted_names, sorted_positions, columns=self.columns,
+                                                    startswith=self.startswith), dtype=np.intp)
+        self.n_features_in_ = len(colnames)
+        return self
+
+    def transform(self, X):
+        check_is_fitted(self, "indices_")
+        return _take_columns(X, self.indices_)
+
+
+class FitCache(object):
+    """
+    On-disk cache of fitted pipeline steps, pass it as the memory of link_pipes
+
+    The fitted transformer and its transformed output are stored keyed by the step's parameters
+    and a hash of its input data (through joblib.Memory), so refitting a pipeline whose early
+    steps did not change (e.g. when a grid search only varies the final estimator) loads them
+    from disk instead of fitting again.
+    After every cached call the directory is trimmed to bytes_limit, least recently used first.
+
+    Inputs
+    ------
+    location: string, directory of the cache
+    bytes_limit: int, maximum size of the cache directory
+    """
+
+    def __init__(self, location, bytes_limit=2**30, verbose=0):
+        self.location = location
+        self.bytes_limit = bytes_limit
+        self.memory = Memory(location=location, verbose=verbose)
+
+    def cache(self, func=None, **kwargs):
+        """same as joblib.Memory.cache, and keeps the cache under bytes_limit"""
+        if func is None:
+            return functools.partial(self.cache, **kwargs)
+        memorized = self.memory.cache(func, **kwargs)
+
+        @functools.wraps(func)
+        def cached(*args, **kw):
+            out = memorized(*args, **kw)
+            self.reduce_size()
+            return out
+        return cached
+
+    def reduce_size(self):
+        self.memory.reduce_size(bytes_limit=self.bytes_limit)
+
+    def clear(self):
+        logging.info("Clearing the fit cache at %s" % self.location)
+        self.memory.clear(warn=False)
+
+
 ## CREATE PIPELINE 
-def link_pipes(*args):
+def link_pipes(*args, memory=None):
     """Links pipelines of form ('name', Pipeline) together in hierarchical fashion,
     concatenates the names with "->" to create the name of the new pipeline
 
     Inputs
     ------
     *args, tuples of the form ("name", sklearn.pipeline.Pipeline)
+    memory: None, a directory, joblib.Memory or FitCache (optional),
+        caches the fitted steps (all but the last) of the new pipeline
 
     Outputs
     -------
@@ -46,16 +181,20 @@ def link_pipes(*args):
     Where the new pipeline is a pipeline linking the args together in order
     """
     final_name = "->".join([name for name, transform in args])
-    final_pipe = Pipeline(list(args))
+    final_pipe = Pipeline(list(args), memory=memory)
     return ("("+final_name+")", final_pipe)
 
-def union_pipes(*args):
+def union_pipes(*args, n_jobs=None, backend=None):
     """Unions pipelines of form ('name', Pipeline) together using FeatureUnion,
     concatenates the names with "||" to create the name of the new pipeline
 
     Inputs
     ------
     *args, tuples of the form ("name", sklearn.pipeline.Pipeline)
+    n_jobs: int (optional), number of branches run at once
+    backend: None, "thread" or "process" (optional)
+        None uses sklearn's FeatureUnion, "thread" or "process" uses ParallelFeatureUnion,
+        which streams the branch outputs into one preallocated matrix and times each branch
 
     Outputs
     -------
@@ -64,28 +203,145 @@ def union_pipes(*args):
     """
     final_name = "||".join([name for name, transform in args])
     final_name = "("+final_name+")"
-    final_union = FeatureUnion(list(args))
+    if backend is None:
+        final_union = FeatureUnion(list(args), n_jobs=n_jobs)
+    else:
+        final_union = ParallelFeatureUnion(list(args), n_jobs=n_jobs, backend=backend)
     return (final_name, final_union)
 
 
-def tree_to_code(tree, feature_names):
+def _python_literal(value):
+    return repr(value.item() if hasattr(value, "item") else value)
+
+
+def _leaf_source(tree, value):
+    """the source of what tree.predict returns for a row in the leaf with the node value <value>"""
+    classes = getattr(tree, "classes_", None)
+    if classes is None:
+        outputs = [_python_literal(v[0]) for v in value]
+    elif tree.n_outputs_ == 1:
+        outputs = [_python_literal(classes[np.argmax(value[0])])]
+    else:
+        outputs = [_python_literal(classes[k][np.argmax(value[k][:len(classes[k])])]) for k in range(len(value))]
+    return outputs[0] if len(outputs) == 1 else "[%s]" % ", ".join(outputs)
+
+
+def tree_to_source(tree, feature_names):
+    """
+    returns the python source of a single-row if/else function equivalent to the fitted decision tree
+
+    the function returns what tree.predict does: the class label for classifiers, the value for regressors
+    (a list with one entry per output for multi-output trees). sklearn compares float32 inputs, pass
+    np.float32 values to get the same result for values close to a threshold
+    """
     tree_ = tree.tree_
     feature_name = [
         feature_names[i] if i != _tree.TREE_UNDEFINED else "undefined!"
         for i in tree.tree_.feature
     ]
-    print("def tree({}):".format(", ".join(feature_names)))
+    lines = ["def tree({}):".format(", ".join(feature_names))]
 
     def recurse(node, depth):
         indent = "    " * depth
         if tree_.feature[node] != _tree.TREE_UNDEFINED:
             name = feature_name[node]
             threshold = tree_.threshold[node]
-            print("{}if {} <= {}:".format(indent, name, threshold))
+            lines.append("{}if {} <= {}:".format(indent, name, threshold))
             recurse(tree_.children_left[node], depth + 1)
-            print("{}else:  # if {} > {}".format(indent, name, threshold))
+            lines.append("{}else:  # if {} > {}".format(indent, name, threshold))
             recurse(tree_.children_right[node], depth + 1)
         else:            
-            print("{}return {}".format(indent, np.argmax(tree_.value[node])))
+            lines.append("{}return {}".format(indent, _leaf_source(tree, tree_.value[node])))
 
     recurse(0, 1)
+    return "\n".join(lines)
+
+
+def tree_to_code(tree, feature_names):
+    print(tree_to_source(tree, feature_names))
+
+
+class TreePredictor(object):
+    """
+    A fitted decision tree compiled into flat node arrays that scores a whole batch at once
+
+    Every row steps down the tree together with array operations, so there is no per-row python
+    branching. The outputs are the same as tree.predict (the input is cast to float32 like sklearn does).
+
+    Attributes
+    ----------
+    source: the python source of the equivalent single-row if/else function, for auditing
+    """
+
+    def __init__(self, tree, feature_names=None):
+        tree_ = tree.tree_
+        self.feature = np.asarray(tree_.feature, dtype=np.intp)
+        self.threshold = np.asarray(tree_.threshold, dtype=np.float64)
+        self.children_left = np.asarray(tree_.children_left, dtype=np.intp)
+        self.children_right = np.asarray(tree_.children_right, dtype=np.intp)
+        self.value = np.asarray(tree_.value)
+        self.missing_go_to_left = getattr(tree_, "missing_go_to_left", None)
+        self.n_outputs = tree_.n_outputs
+        self.classes_ = getattr(tree, "classes_", None)
+        if feature_names is None:
+            feature_names = ["x%s" % i for i in range(tree_.n_features)]
+        self.source = tree_to_source(tree, list(feature_names))
+
+    def apply(self, X):
+        """the index of the leaf each row of X ends up in"""
+        X = np.asarray(X, dtype=np.float32)
+        node = np.zeros(X.shape[0], dtype=np.intp)
+        active = np.arange(X.shape[0])
+        while active.size:
+            cur = node[active]
+            internal = self.children_left[cur] != _tree.TREE_LEAF
+            active, cur = active[internal], cur[internal]
+            if not active.size:
+                break
+            x = X[active, self.feature[cur]]
+            go_left = x <= self.threshold[cur]
+            if self.missing_go_to_left is not None:
+                missing = np.isnan(x)
+                go_left[missing] = self.missing_go_to_left[cur[missing]].astype(bool)
+            node[active] = np.where(go_left, self.children_left[cur], self.children_right[cur])
+        return node
+
+    def predict_proba(self, X):
+        if self.classes_ is None:
+            raise AttributeError("predict_proba is only available for classification trees")
+        value = self.value[self.apply(X)]
+        probas = []
+        for k in range(self.n_outputs):
+            n_classes = len(self.classes_) if self.n_outputs == 1 else len(self.classes_[k])
+            proba = value[:, k, :n_classes].astype(np.float64)
+            normalizer = proba.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            probas.append(proba / normalizer)
+        return probas[0] if self.n_outputs == 1 else probas
+
+    def predict(self, X):
+        value = self.value[self.apply(X)]
+        if self.classes_ is None:
+            return value[:, 0, 0] if self.n_outputs == 1 else value[:, :, 0]
+        if self.n_outputs == 1:
+            return self.classes_.take(np.argmax(value[:, 0], axis=1), axis=0)
+        return np.stack([self.classes_[k].take(np.argmax(value[:, k], axis=1), axis=0)
+                         for k in range(self.n_outputs)], axis=1)
+
+    __call__ = predict
+
+
+def compile_tree(tree, feature_names=None):
+    """
+    compile a fitted sklearn decision tree into a vectorized batch predictor
+
+    Inputs
+    ------
+    tree: a fitted DecisionTreeClassifier or DecisionTreeRegressor
+    feature_names: list of names used in the generated source (optional)
+
+    Outputs
+    -------
+    TreePredictor, call it on a 2d array to score every row, .source holds the if/else source
+    """
+    return TreePredictor(tree, feature_names=feature_names)
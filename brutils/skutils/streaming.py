@@ -0,0 +1,259 @@
+"""
+Send an iterator of dataframes through a link_pipes pipeline one batch at a time
+
+The batches usually come from pdutils.chunk_col_values or pdutils.df_from_ldjson(..., chunksize=n).
+The next batch is read in a background thread while the current one is processed, and the outputs
+are written to a sink batch by batch, so memory stays bounded by a few batches.
+
+    >>> batches = df_from_ldjson("train.ldjson", chunksize=50000)
+    >>> partial_fit_pipeline(pipe, batches, target="y", classes=[0, 1])
+    >>> stream_transform(pipe, df_from_ldjson("score.ldjson", chunksize=50000), CSVSink("scores.csv"),
+    ...                  method="predict_proba", keep_columns=["id"])
+"""
+
+import logging
+import queue
+import threading
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.pipeline import Pipeline as SKPipeline, FeatureUnion
+
+_DONE = object()
+
+
+def prefetch(iterable, depth=1):
+    """
+    iterate over <iterable> while a background thread reads up to <depth> items ahead
+
+    exceptions raised by the reader are raised again in the consuming thread
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        # give up once the consumer is gone instead of blocking on a full queue forever
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((_DONE, None))
+        except Exception as e:
+            put((_DONE, e))
+
+    reader = threading.Thread(target=read, name="brutils-prefetch")
+    reader.daemon = True
+    reader.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        # the consumer stopped early or failed, let the reader thread finish
+        stop.set()
+
+
+def _split_batch(batch, target):
+    if target is not None:
+        return batch.drop(columns=target), batch[target]
+    if isinstance(batch, tuple):
+        return batch
+    return batch, None
+
+
+def _hstack(outputs):
+    if any(sparse.issparse(Xt) for Xt in outputs):
+        return sparse.hstack(outputs).tocsr()
+    return np.hstack([np.asarray(Xt).reshape(len(Xt), -1) for Xt in outputs])
+
+
+def _partial_fit_step(est, X, y, final, fit_params):
+    """partial_fit one step (recursing into pipelines and unions), returns the step's output if not final"""
+    if est is None or (isinstance(est, str) and est == "passthrough"):
+        return X, y
+    if isinstance(est, SKPipeline):
+        steps = [s for _, s in est.steps]
+        for i, step in enumerate(steps):
+            X, y = _partial_fit_step(step, X, y, final and i == len(steps) - 1, fit_params)
+        return X, y
+    if isinstance(est, FeatureUnion):
+        weights = est.transformer_weights or {}
+        outputs = []
+        for name, trans in est.transformer_list:
+            if isinstance(trans, str) and trans == "drop":
+                continue
+            Xt, _ = _partial_fit_step(trans, X, y, False, fit_params)
+            outputs.append(Xt * weights[name] if name in weights else Xt)
+        return _hstack(outputs), y
+    if hasattr(est, "fit_resample"):
+        # samplers resample every training batch, like they do in an imblearn pipeline
+        return est.fit_resample(X, y)
+    if hasattr(est, "partial_fit"):
+        est.partial_fit(X, y, **(fit_params if final else {}))
+    if final:
+        return None, None
+    # steps without partial_fit must already be fitted (or be stateless)
+    return est.transform(X), y
+
+
+def _check_final_step(est, name):
+    """raise a TypeError if the step that would be fitted last has no partial_fit"""
+    while isinstance(est, SKPipeline):
+        name, est = est.steps[-1]
+    if est is None or (isinstance(est, str) and est == "passthrough") or isinstance(est, FeatureUnion):
+        return
+    if not hasattr(est, "partial_fit"):
+        raise TypeError("The final step %s (%s) has no partial_fit and can not be fitted on batches"
+                        % (name, type(est).__name__))
+
+
+def partial_fit_pipeline(pipe, batches, target=None, prefetch_depth=1, **fit_params):
+    """
+    Fit a pipeline incrementally on batches of data
+
+    Every step that has partial_fit is updated with each batch, before the batch is transformed for
+    the next step; steps without partial_fit are only used to transform and must be fitted beforehand.
+    Nested pipelines and FeatureUnions (from link_pipes / union_pipes) are walked step by step.
+
+    Inputs
+    ------
+    pipe: a Pipeline or the ("name", Pipeline) tuple returned by link_pipes
+    batches: iterable of DataFrames, (X, y) tuples, or X alone for unsupervised pipelines
+    target: string (optional), name of the column of each DataFrame batch that holds y
+    prefetch_depth: int, number of batches read ahead in a background thread, 0 reads in this thread
+    **fit_params: passed to the final step's partial_fit, e.g. classes=[0, 1] for classifiers
+
+    Outputs
+    -------
+    the fitted pipeline
+
+    Raises a TypeError if the final estimator has no partial_fit
+    """
+    name, est = pipe if isinstance(pipe, tuple) else ("pipe", pipe)
+    _check_final_step(est, name)
+    n_rows = 0
+    for i, batch in enumerate(prefetch(batches, prefetch_depth) if prefetch_depth else batches):
+        X, y = _split_batch(batch, target)
+        _partial_fit_step(est, X, y, True, fit_params)
+        n_rows += X.shape[0]
+        logging.debug("partial_fit batch %s, %s rows so far" % (i, n_rows))
+    return est
+
+
+def _output_frame(out, batch, method, classes, keep_columns):
+    index = batch.index if isinstance(batch, pd.DataFrame) else None
+    if isinstance(out, pd.Series):
+        frame = out.to_frame(method)
+    elif isinstance(out, pd.DataFrame):
+        frame = out
+    else:
+        if sparse.issparse(out):
+            # one batch at a time, so densifying stays bounded by the batch size
+            out = out.toarray()
+        out = np.asarray(out)
+        if out.ndim == 1:
+            frame = pd.DataFrame({method: out}, index=index)
+        else:
+            if method == "predict_proba" and classes is not None and len(classes) == out.shape[1]:
+                columns = ["proba_%s" % c for c in classes]
+            else:
+                columns = ["%s_%d" % (method, i) for i in range(out.shape[1])]
+            frame = pd.DataFrame(out, index=index, columns=columns)
+    if keep_columns:
+        frame = pd.concat([batch[keep_columns], frame], axis=1)
+    return frame
+
+
+def iter_transform(pipe, batches, method="transform", target=None, keep_columns=None, drop_keep_columns=False,
+                   prefetch_depth=1):
+    """
+    Yields the output of pipe.<method> for each batch as a DataFrame
+
+    Inputs
+    ------
+    pipe: a fitted Pipeline or the ("name", Pipeline) tuple returned by link_pipes
+    batches: iterable of DataFrames (or arrays)
+    method: "transform", "predict", "predict_proba", "decision_function", ...
+    target: string (optional), column of the batches to drop before calling method
+    keep_columns: list of columns of each batch (ids, keys) that are copied into the output
+    drop_keep_columns: bool, also leave keep_columns out of the input of method, for pipelines that were fit
+        without them; by default the batches go to method as they are
+    prefetch_depth: int, number of batches read ahead in a background thread
+
+    Outputs
+    -------
+    a generator of DataFrames indexed like the batches
+    """
+    est = pipe[1] if isinstance(pipe, tuple) else pipe
+    func = getattr(est, method)
+    classes = getattr(est, "classes_", None)
+    for batch in prefetch(batches, prefetch_depth) if prefetch_depth else batches:
+        X = batch.drop(columns=target) if target is not None else batch
+        if keep_columns and drop_keep_columns and isinstance(X, pd.DataFrame):
+            X = X.drop(columns=[c for c in keep_columns if c in X.columns])
+        yield _output_frame(func(X), batch, method, classes, keep_columns)
+
+
+class CSVSink(object):
+    """appends each DataFrame to a csv file, the header is written with the first one"""
+
+    def __init__(self, filename, index=False, **to_csv_kwargs):
+        self.filename = filename
+        self.index = index
+        self.to_csv_kwargs = to_csv_kwargs
+        self.started = False
+
+    def __call__(self, frame):
+        frame.to_csv(self.filename, mode="a" if self.started else "w", header=not self.started,
+                     index=self.index, **self.to_csv_kwargs)
+        self.started = True
+
+
+class LDJSONSink(object):
+    """appends each DataFrame to a line delimited json file, one record per line"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.started = False
+
+    def __call__(self, frame):
+        with open(self.filename, "a" if self.started else "w") as f:
+            if len(frame):
+                text = frame.to_json(orient="records", lines=True)
+                # pandas before 1.5 leaves out the last newline
+                f.write(text if text.endswith("\n") else text + "\n")
+        self.started = True
+
+
+def stream_transform(pipe, batches, sink, method="transform", target=None, keep_columns=None, drop_keep_columns=False,
+                     prefetch_depth=1):
+    """
+    Runs pipe.<method> on each batch and writes each output to <sink> before reading further
+
+    sink: CSVSink, LDJSONSink or any function that takes a DataFrame
+    the other parameters are the same as in iter_transform
+
+    Outputs
+    -------
+    the number of rows written
+    """
+    n_rows = 0
+    for frame in iter_transform(pipe, batches, method=method, target=target, keep_columns=keep_columns,
+                                drop_keep_columns=drop_keep_columns, prefetch_depth=prefetch_depth):
+        sink(frame)
+        n_rows += len(frame)
+    logging.info("Wrote %s rows of %s output" % (n_rows, method))
+    return n_rows
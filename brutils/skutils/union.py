@@ -0,0 +1,201 @@
+"""
+A FeatureUnion that runs its branches in a thread or process pool
+
+Once the output widths of the branches are known (after fit_transform or the first transform),
+transform and later fit_transform calls preallocate the output matrix and copy each branch's output
+into its block as soon as that branch finishes, so only one full copy of the features (plus the
+outputs of the branches still running) is held instead of two. The first fit_transform, before the
+widths are known, stacks the branch outputs and holds both.
+If any branch returns a sparse matrix the output is built as a sparse matrix instead.
+The time spent in each branch is kept in branch_times_.
+"""
+
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import numpy as np
+from scipy import sparse
+from sklearn.pipeline import FeatureUnion
+
+
+def _fit_transform_branch(trans, X, y, weight, fit_params):
+    start = time.time()
+    if trans == "passthrough":
+        Xt = X
+    elif hasattr(trans, "fit_transform"):
+        Xt = trans.fit_transform(X, y, **fit_params)
+    else:
+        Xt = trans.fit(X, y, **fit_params).transform(X)
+    if weight is not None:
+        Xt = Xt * weight
+    return trans, Xt, time.time() - start
+
+
+def _fit_branch(trans, X, y, fit_params):
+    start = time.time()
+    if trans != "passthrough":
+        trans.fit(X, y, **fit_params)
+    return trans, None, time.time() - start
+
+
+def _transform_branch(trans, X, weight):
+    start = time.time()
+    Xt = X if trans == "passthrough" else trans.transform(X)
+    if weight is not None:
+        Xt = Xt * weight
+    return trans, Xt, time.time() - start
+
+
+def _as_2d(Xt):
+    if sparse.issparse(Xt):
+        return Xt
+    Xt = np.asarray(Xt)
+    return Xt.reshape(-1, 1) if Xt.ndim == 1 else Xt
+
+
+class ParallelFeatureUnion(FeatureUnion):
+    """
+    FeatureUnion whose branches run concurrently and stream into a preallocated output
+
+    Parameters
+    ----------
+    transformer_list, transformer_weights, verbose: as in sklearn.pipeline.FeatureUnion
+    n_jobs: number of threads or processes, defaults to one per branch
+    backend: "thread" (default, numpy and most sklearn transformers release the GIL)
+        or "process" (the input is pickled to every branch)
+
+    fit and fit_transform pass their fit_params to the fit of every branch, like FeatureUnion.
+
+    Attributes
+    ----------
+    branch_times_: OrderedDict of branch name -> {"fit": seconds, "transform": seconds} for the last calls
+    branch_widths_: OrderedDict of branch name -> number of output columns
+    """
+
+    def __init__(self, transformer_list, n_jobs=None, transformer_weights=None, verbose=False, backend="thread"):
+        super(ParallelFeatureUnion, self).__init__(transformer_list, n_jobs=n_jobs,
+                                                   transformer_weights=transformer_weights, verbose=verbose)
+        self.backend = backend
+
+    def _branches(self):
+        weights = self.transformer_weights or {}
+        return [(i, name, trans, weights.get(name)) for i, (name, trans) in enumerate(self.transformer_list)
+                if trans is not None and not (isinstance(trans, str) and trans == "drop")]
+
+    def _executor(self, n_branches):
+        n_jobs = self.n_jobs if self.n_jobs not in (None, -1) else n_branches
+        if self.backend == "process":
+            return ProcessPoolExecutor(max(n_jobs, 1))
+        if self.backend == "thread":
+            return ThreadPoolExecutor(max(n_jobs, 1))
+        raise ValueError("backend must be 'thread' or 'process', got %s" % self.backend)
+
+    def _run(self, func, args_for, method):
+        """run func on every branch, yields (branch index, name, output) in completion order"""
+        branches = self._branches()
+        if not hasattr(self, "branch_times_"):
+            self.branch_times_ = OrderedDict((name, {}) for _, name, _, _ in branches)
+        with self._executor(len(branches)) as executor:
+            futures = {executor.submit(func, *args_for(trans, weight)): (i, name) for i, name, trans, weight in branches}
+            for fut in as_completed(futures):
+                # drop our reference to the future so a branch's output is freed once it has been copied
+                i, name = futures.pop(fut)
+                trans, Xt, seconds = fut.result()
+                self.transformer_list[i] = (name, trans)
+                self.branch_times_.setdefault(name, {})[method] = seconds
+                yield i, name, Xt
+
+    def _record_shapes(self, outputs):
+        self.branch_widths_ = OrderedDict((name, Xt.shape[1]) for name, Xt in outputs)
+        self.branch_sparse_ = any(sparse.issparse(Xt) for _, Xt in outputs)
+        self.output_dtype_ = np.result_type(*[Xt.dtype for _, Xt in outputs]) if outputs else np.float64
+
+    def _hstack_outputs(self, outputs):
+        if not outputs:
+            return np.zeros((0, 0))
+        if any(sparse.issparse(Xt) for _, Xt in outputs):
+            return sparse.hstack([Xt for _, Xt in outputs]).tocsr()
+        return np.hstack([Xt for _, Xt in outputs])
+
+    def fit(self, X, y=None, **fit_params):
+        self.transformer_list = list(self.transformer_list)
+        # the output widths are learned again on the next transform
+        self.__dict__.pop("branch_widths_", None)
+        for _ in self._run(_fit_branch, lambda trans, weight: (trans, X, y, fit_params), "fit"):
+            pass
+        return self
+
+    def _collect(self, results):
+        """hstack the outputs of every branch"""
+        done = {}
+        for i, name, Xt in results:
+            done[i] = (name, _as_2d(Xt))
+        outputs = [done[i] for i in sorted(done)]
+        self._record_shapes(outputs)
+        return self._hstack_outputs(outputs)
+
+    def _widths_match(self):
+        """True if the output widths of the current branches are known from an earlier call"""
+        widths = getattr(self, "branch_widths_", None)
+        return (widths is not None and not self.branch_sparse_
+                and list(widths) == [name for _, name, _, _ in self._branches()])
+
+    def _stream_into(self, results, strict):
+        """
+        copy each branch output into its block of a preallocated output as soon as the branch finishes
+
+        a branch whose width or sparsity differs from the earlier call raises a ValueError if strict,
+        otherwise (a refit with new parameters) the rest is collected and stacked with the blocks already copied.
+        A branch output of a wider dtype (e.g. float64 for an input that was float32) upcasts the output.
+        """
+        widths = self.branch_widths_
+        offsets = OrderedDict()
+        total = 0
+        for name, w in widths.items():
+            offsets[name] = total
+            total += w
+        out = None
+        dtype = self.output_dtype_
+        placed = {}
+        changed = {}
+        for i, name, Xt in results:
+            Xt = _as_2d(Xt)
+            if changed or sparse.issparse(Xt) or Xt.shape[1] != widths[name]:
+                if strict:
+                    raise ValueError("Branch %s changed its output shape or sparsity since it was fit" % name)
+                changed[i] = (name, Xt)
+                continue
+            if np.result_type(Xt.dtype, dtype) != dtype:
+                dtype = np.result_type(Xt.dtype, dtype)
+                if out is not None:
+                    # one copy of the blocks placed so far, the later ones are copied in at the wider dtype
+                    out = out.astype(dtype)
+            if out is None:
+                out = np.empty((Xt.shape[0], total), dtype=dtype)
+            out[:, offsets[name]:offsets[name] + widths[name]] = Xt
+            placed[i] = name
+            del Xt
+        if not changed:
+            if not strict:
+                self.output_dtype_ = dtype
+            return out if out is not None else np.zeros((0, 0))
+        # the copied blocks are views into out, so they are not copied again before the stack
+        for i, name in placed.items():
+            changed[i] = (name, out[:, offsets[name]:offsets[name] + widths[name]])
+        outputs = [changed[i] for i in sorted(changed)]
+        self._record_shapes(outputs)
+        return self._hstack_outputs(outputs)
+
+    def fit_transform(self, X, y=None, **fit_params):
+        self.transformer_list = list(self.transformer_list)
+        results = self._run(_fit_transform_branch, lambda trans, weight: (trans, X, y, weight, fit_params), "fit")
+        if self._widths_match():
+            # refitting (e.g. in a grid search): the widths of the last fit are used for the output
+            return self._stream_into(results, strict=False)
+        return self._collect(results)
+
+    def transform(self, X):
+        results = self._run(_transform_branch, lambda trans, weight: (trans, X, weight), "transform")
+        if self._widths_match():
+            return self._stream_into(results, strict=True)
+        return self._collect(results)
@@ -1,6 +1,8 @@
 from .. import oututils as out
 import unittest
 import os
+import shutil
+import tempfile
 
 class OutputTestCase(unittest.TestCase):
     """
@@ -20,5 +22,123 @@ class OutputTestCase(unittest.TestCase):
         self.assertEqual(out.get_prog_numbers("p_123421_script.py"), "123421")
 
 
+class OutputManagerTestCase(unittest.TestCase):
+    """
+    Tests for OutputManager
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manager = out.OutputManager(output_stem=self.directory, output_extension=".txt")
+        self.input = os.path.join(self.directory, "raw.txt")
+        with open(self.input, "w") as f:
+            f.write("1,2\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_skip_until_inputs_change(self):
+        self.assertFalse(self.manager.is_current("summary", inputs=[self.input]))
+        with self.manager.atomic_write("summary", inputs=[self.input]) as f:
+            f.write("3\n")
+        self.assertTrue(self.manager.is_current("summary", inputs=[self.input]))
+        self.assertEqual(self.manager.entry("summary")["producer"], "p_01_oututils_tests.py")
+        with open(self.input, "a") as f:
+            f.write("4,5\n")
+        self.assertFalse(self.manager.is_current("summary", inputs=[self.input]))
+
+    def test_failed_write_keeps_old_output(self):
+        with self.manager.atomic_write("summary") as f:
+            f.write("complete\n")
+        try:
+            with self.manager.atomic_write("summary") as f:
+                f.write("trunc")
+                raise RuntimeError("crash")
+        except RuntimeError:
+            pass
+        with open(self.manager.path("summary")) as f:
+            self.assertEqual(f.read(), "complete\n")
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ["manifest.json", "manifest.json.lock", "out_01_summary.txt", "raw.txt"])
+
+
+class ScriptRunnerTestCase(unittest.TestCase):
+    """
+    Tests for the p_NN_ script runner
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        scripts = {
+            "p_01_load.py": "open('out_01_raw.txt', 'w').write('1')\n",
+            "p_02_left.py": "open('out_02_left.txt', 'w').write(open('out_01_raw.txt').read())\n",
+            "p_03_right.py": "open('out_03_right.txt', 'w').write(open('out_01_raw.txt').read())\n",
+            "p_04_join.py": "open('out_02_left.txt'), open('out_03_right.txt')\nraise SystemExit(1)\n",
+            "p_05_report.py": "open('out_04_x.txt')\n",
+        }
+        for name, source in scripts.items():
+            with open(os.path.join(self.directory, name), "w") as f:
+                f.write(source)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_graph_from_out_references(self):
+        graph = out.build_graph(self.directory)
+        self.assertEqual(graph["p_04_join.py"], ["p_02_left.py", "p_03_right.py"])
+        self.assertEqual(graph["p_01_load.py"], [])
+
+    def test_references_need_a_word_boundary_and_match_by_number(self):
+        path = os.path.join(self.directory, "p_06_more.py")
+        with open(path, "w") as f:
+            f.write("layout_3_ = checkout_2_ = 1\nopen('out_1_raw.txt')\n")
+        self.assertEqual(out.runner.script_dependencies(path, "06", out.find_scripts(self.directory)), ["01"])
+
+    def test_second_run_skips_unchanged_scripts(self):
+        status = out.ScriptRunner(self.directory, n_jobs=2).run()
+        self.assertEqual(list(status.values()), ["ran", "ran", "ran", "failed", "blocked"])
+        status = out.ScriptRunner(self.directory, n_jobs=2).run()
+        self.assertEqual(list(status.values()), ["skipped", "skipped", "skipped", "failed", "blocked"])
+
+
+class AsyncWriterTestCase(unittest.TestCase):
+    """
+    Tests for AsyncWriter
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_block_compressed_gzip_reads_back(self):
+        import gzip, pickle
+        out.async_writer._GZIP_BLOCK = 1000
+        try:
+            obj = {"values": list(range(5000))}
+            path = os.path.join(self.directory, "out_01_values.p.gz")
+            with out.AsyncWriter(compress_threads=3) as writer:
+                writer.write(obj, path)
+                writer.write(obj, os.path.join(self.directory, "out_01_values.json"))
+            with gzip.open(path, "rb") as f:
+                self.assertEqual(pickle.load(f), obj)
+            self.assertEqual(len(writer.written), 2)
+        finally:
+            out.async_writer._GZIP_BLOCK = 2**22
+
+    def test_written_is_complete_after_flush(self):
+        writer = out.AsyncWriter(max_pending=4, n_jobs=4)
+        for i in range(20):
+            writer.write([i], os.path.join(self.directory, "out_%02d_values.json" % i))
+            if i % 5 == 4:
+                writer.flush()
+                self.assertEqual(len(writer.written), i + 1)
+        writer.close()
+
+    def test_flush_raises_failed_write(self):
+        writer = out.AsyncWriter()
+        writer.write(lambda x: x, os.path.join(self.directory, "bad.json"))
+        self.assertRaises(TypeError, writer.close)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
 if __name__=="__main__":
     unittest.main()
@@ -0,0 +1,234 @@
+from .. import pdutils as pdu
+import unittest
+import os
+import pickle
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+
+def make_sales():
+    idx = pd.MultiIndex.from_product([["a", "b", "c"], ["all", "x", "y"]], names=["brand", "store"])
+    return pd.DataFrame({"sales": np.arange(1., 10.), "units": np.arange(10., 19.), "visits": np.arange(5., 14.)}, index=idx)
+
+
+class PipelineTestCase(unittest.TestCase):
+    """
+    Tests for the lazy Pipeline
+    """
+    def test_nothing_runs_before_collect(self):
+        calls = []
+        def record(df):
+            calls.append(1)
+            return df
+        p = pdu.Pipeline(make_sales()).pipe(record)
+        self.assertEqual(calls, [])
+        p.collect()
+        self.assertEqual(calls, [1])
+
+    def test_select_pushed_before_columnwise_steps(self):
+        p = pdu.Pipeline(make_sales()).normalize(axis=0).index_to("store", "all").select(["sales"])
+        self.assertTrue(p.explain().startswith("select(sales)"))
+
+    def test_select_not_pushed_before_global_normalize(self):
+        p = pdu.Pipeline(make_sales()).normalize(axis=None).select(["sales"])
+        self.assertTrue(p.explain().startswith("normalize"))
+
+    def test_filter_only_pushed_past_steps_it_does_not_read(self):
+        p = (pdu.Pipeline(make_sales())
+             .map(np.log1p, columns=["units"])
+             .filter(lambda df: df["sales"] > 3, reads=["sales"]))
+        self.assertTrue(p.explain().startswith("filter"))
+        p = (pdu.Pipeline(make_sales())
+             .map(np.log1p, columns=["sales"])
+             .filter(lambda df: df["sales"] > 3, reads=["sales"]))
+        self.assertTrue(p.explain().startswith("map"))
+
+    def test_consecutive_maps_are_fused(self):
+        p = pdu.Pipeline(make_sales()).map(np.sqrt).map(np.log1p)
+        self.assertEqual(len(p.plan()), 1)
+
+    def test_optimized_matches_eager(self):
+        df = make_sales()
+        eager = pdu.index_to(pdu.normalize(df, axis=0), "store", "all")[["sales", "units"]]
+        eager = eager[eager["sales"] > 100]
+        lazy = (pdu.Pipeline(df)
+                .normalize(axis=0)
+                .index_to("store", "all")
+                .filter(lambda d: d["sales"] > 100, reads=["sales"])
+                .select(["sales", "units"])
+                .collect())
+        pd.testing.assert_frame_equal(lazy, eager)
+
+
+def make_transactions(n=200):
+    rng = np.random.RandomState(0)
+    return pd.DataFrame({"store": rng.choice(list("abc"), n), "brand": rng.choice(list("xyz"), n),
+                         "sales": rng.randint(0, 100, n), "units": rng.randint(0, 10, n).astype(float)})
+
+
+class StreamingTestCase(unittest.TestCase):
+    """
+    Tests for the chunked multi_groupby and analyze_distributions
+    """
+    def test_streaming_multi_groupby_matches_in_memory(self):
+        df = make_transactions()
+        chunks = [df.iloc[i:i+37] for i in range(0, len(df), 37)]
+        expected = pdu.multi_groupby(df, by=["store", "brand"])
+        result = pdu.streaming_multi_groupby(chunks, by=["store", "brand"])
+        pd.testing.assert_frame_equal(result.sort_index(), expected.sort_index())
+
+    def test_pickled_mean_states_merge(self):
+        df = make_transactions()
+        states = [pdu.MultiGroupbyState(by=["store", "brand"], func="mean").update(df.iloc[i:i+50])
+                  for i in range(0, len(df), 50)]
+        merged = pdu.combine_states(pickle.loads(pickle.dumps(s)) for s in states)
+        expected = pdu.multi_groupby(df, by=["store", "brand"], func="mean")
+        pd.testing.assert_frame_equal(merged.result().sort_index(), expected.sort_index())
+
+    def test_streaming_analyze_distributions_matches_in_memory(self):
+        ser = make_transactions().set_index(["store", "brand"])["sales"]
+        chunks = [ser.iloc[i:i+50] for i in range(0, len(ser), 50)]
+        expected = pdu.analyze_distributions(ser, "store", "brand", output_global_dist=True)
+        result = pdu.streaming_analyze_distributions(chunks, "store", "brand", output_global_dist=True)
+        pd.testing.assert_frame_equal(result, expected)
+
+
+def sum_sales_units(group):
+    return group[["sales", "units"]].sum()
+
+
+def reads_shared_memory(group):
+    return not group["sales"].values.flags.writeable
+
+
+class ParallelTestCase(unittest.TestCase):
+    """
+    Tests for parallel_groupby_apply
+    """
+    def test_matches_groupby_apply(self):
+        df = make_transactions()
+        expected = df.groupby(["store", "brand"]).apply(sum_sales_units)
+        result = pdu.parallel_groupby_apply(df, ["store", "brand"], sum_sales_units, n_jobs=2)
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_workers_get_shared_views(self):
+        result = pdu.parallel_groupby_apply(make_transactions(), "store", reads_shared_memory, n_jobs=2)
+        self.assertTrue(result.all())
+        self.assertEqual(list(result.index), ["a", "b", "c"])
+
+
+class CacheTestCase(unittest.TestCase):
+    """
+    Tests for the content-hash memoization
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_hit_on_equal_content(self):
+        cache = pdu.ContentCache(directory=self.directory)
+        cached = pdu.memoize(cache)(pdu.multi_groupby)
+        first = cached(make_transactions(), by=["store", "brand"])
+        second = cached(make_transactions(), by=["store", "brand"])
+        pd.testing.assert_frame_equal(first, second)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_miss_on_changed_content_or_parameters(self):
+        cache = pdu.ContentCache()
+        cached = pdu.memoize(cache)(pdu.multi_groupby)
+        df = make_transactions()
+        cached(df, by=["store", "brand"])
+        cached(df, by=["store", "brand"], func="mean")
+        df.loc[0, "sales"] += 1
+        cached(df, by=["store", "brand"])
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
+
+    def test_lambdas_and_closures_do_not_share_results(self):
+        cache = pdu.ContentCache()
+
+        def scaler(factor):
+            def scale(x):
+                return x * factor
+            return scale
+
+        cached = [pdu.memoize(cache)(f) for f in (lambda x: x + 1, lambda x: x + 2, scaler(2), scaler(3))]
+        self.assertEqual([f(10) for f in cached], [11, 12, 20, 30])
+        self.assertEqual(cache.hits, 0)
+
+    def test_equivalent_calls_share_a_key(self):
+        cache = pdu.ContentCache()
+        cached = pdu.memoize(cache)(pdu.normalize)
+        df = make_sales()
+        cached(df, 0)
+        cached(df, axis=0)
+        cached(df, 0, strict=True)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_disk_tier_survives_memory_eviction(self):
+        cache = pdu.ContentCache(maxsize=1, directory=self.directory)
+        cached = pdu.memoize(cache)(pdu.normalize)
+        df = make_sales()
+        cached(df, axis=0)
+        cached(df, axis=1)
+        cached(df, axis=0)
+        self.assertEqual(cache.disk_hits, 1)
+
+    def test_disk_tier_is_size_bounded(self):
+        cache = pdu.ContentCache(directory=self.directory, max_disk_bytes=1)
+        cached = pdu.memoize(cache)(pdu.normalize)
+        cached(make_sales(), axis=0)
+        cached(make_sales(), axis=1)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class DeferredFormatTestCase(unittest.TestCase):
+    """
+    Tests for formats that are applied at render time
+    """
+    def test_deferred_keeps_numeric_data(self):
+        df = pdu.defer_fmt_retail(make_sales().reset_index(drop=True))
+        self.assertTrue(all(np.issubdtype(t, np.number) for t in df.dtypes))
+        self.assertEqual(df.sort_values("sales", ascending=False).attrs["fmt"]["sales"], pdu.DOLLAR)
+
+    def test_render_matches_eager_format(self):
+        df = make_sales()
+        rendered = pdu.render_fmt(pdu.defer_fmt_retail(df))
+        for c in df.columns:
+            pd.testing.assert_series_equal(rendered[c], pdu.fmt_series_retail(df[c]))
+
+    def test_render_only_formats_shown_rows(self):
+        df = pdu.defer_fmt_retail(make_sales())
+        self.assertEqual(len(pdu.render_fmt(df, max_rows=4)), 4)
+
+    def test_render_selected_column(self):
+        df = make_sales()
+        column = pdu.defer_fmt_retail(df)["sales"]
+        self.assertTrue(pdu.has_deferred_fmt(column))
+        pd.testing.assert_series_equal(pdu.render_fmt(column), pdu.fmt_series_retail(df["sales"]))
+
+
+class LDJSONTestCase(unittest.TestCase):
+    """
+    Tests for df_from_ldjson
+    """
+    def test_chunks_match_whole_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "sales.ldjson")
+            df = make_sales().reset_index()
+            df.to_json(filename, orient="records", lines=True)
+            with open(filename, "a") as f:
+                f.write("\n\n")
+            chunks = list(pdu.df_from_ldjson(filename, chunksize=4))
+            self.assertEqual([len(c) for c in chunks], [4, 4, 1])
+            pd.testing.assert_frame_equal(pd.concat(chunks), pdu.df_from_ldjson(filename))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__=="__main__":
+    unittest.main()
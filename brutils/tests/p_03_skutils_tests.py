@@ -0,0 +1,388 @@
+from .. import skutils as sku
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.decomposition import PCA
+from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier, GradientBoostingRegressor
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.model_selection import GridSearchCV
+from sklearn.pipeline import FeatureUnion
+from sklearn.preprocessing import FunctionTransformer, OneHotEncoder
+from sklearn.tree import DecisionTreeClassifier, DecisionTreeRegressor
+from sklearn.preprocessing import StandardScaler
+
+FIT_CALLS = []
+
+
+class CountingPCA(PCA):
+    def fit_transform(self, X, y=None):
+        FIT_CALLS.append(1)
+        return super(CountingPCA, self).fit_transform(X, y)
+
+
+def shift_columns(X, offsets):
+    return X + offsets[:X.shape[1]] + offsets[1000] * X[:, :1]
+
+
+def make_classification(n=300, p=8):
+    rng = np.random.RandomState(0)
+    X = rng.rand(n, p)
+    return X, (X[:, 0] + X[:, 1] > 1).astype(int)
+
+
+def make_features():
+    cols = ["age", "x_1", "x_2", "x_3", "y_1", "y_2"]
+    return pd.DataFrame(np.arange(24.).reshape(4, 6), columns=cols)
+
+
+class ColumnSelectorTestCase(unittest.TestCase):
+    """
+    Tests for ColumnSelector and organize_colnames
+    """
+    def test_selects_by_name_and_prefix(self):
+        X = make_features()
+        sel = sku.ColumnSelector(columns=["age"], startswith=["y_"]).fit(X)
+        np.testing.assert_array_equal(sel.transform(X.values), X[["age", "y_1", "y_2"]].values)
+
+    def test_contiguous_selection_is_a_view(self):
+        X = make_features()
+        out = sku.ColumnSelector(startswith=["x_"]).fit(X).transform(X.values)
+        self.assertTrue(np.shares_memory(out, X.values))
+
+    def test_sparse_input(self):
+        X = make_features()
+        sel = sku.ColumnSelector(columns=["y_2", "age"], colnames=list(X.columns)).fit(X.values)
+        out = sel.transform(sparse.csr_matrix(X.values))
+        np.testing.assert_array_equal(out.toarray(), X[["y_2", "age"]].values)
+        self.assertEqual(out.format, "csr")
+
+    def test_keep_fxn_does_not_grow_between_calls(self):
+        X = make_features()
+        colnames, keep_fxn = sku.organize_colnames(X)
+        first = keep_fxn(X.values, startswith=["x_"])
+        second = keep_fxn(X.values, startswith=["x_"])
+        self.assertEqual(first.shape, second.shape)
+
+
+class FitCacheTestCase(unittest.TestCase):
+    """
+    Tests for caching fitted steps of link_pipes pipelines
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        del FIT_CALLS[:]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_grid_over_final_step_fits_preprocessing_once_per_fold(self):
+        X, y = make_classification()
+        cache = sku.FitCache(self.directory)
+        name, pipe = sku.link_pipes(("scale", StandardScaler()), ("pca", CountingPCA(3)),
+                                    ("lr", LogisticRegression()), memory=cache)
+        GridSearchCV(pipe, {"lr__C": [.1, 1., 10.]}, cv=3).fit(X, y)
+        # one fit per fold plus the refit, instead of one per candidate and fold
+        self.assertEqual(len(FIT_CALLS), 4)
+
+
+class PrefixGridSearchTestCase(unittest.TestCase):
+    """
+    Tests for the prefix-sharing grid search
+    """
+    def test_prefixes_fit_once_and_scores_match_grid_search(self):
+        X, y = make_classification()
+        name, pipe = sku.link_pipes(sku.link_pipes(("scale", StandardScaler()), ("pca", PCA())),
+                                    ("lr", LogisticRegression()))
+        search = sku.PrefixGridSearch((name, pipe), {"(scale->pca)__pca__n_components": [2, 4, 6],
+                                                      "lr__C": [.1, 1., 10.]}, cv=3, n_jobs=2).fit(X, y)
+        # the scaler once per fold and each pca setting once per fold
+        self.assertEqual(search.n_prefix_fits_, 3 + 3 * 3)
+
+        _, flat = sku.link_pipes(("scale", StandardScaler()), ("pca", PCA()), ("lr", LogisticRegression()))
+        grid = GridSearchCV(flat, {"pca__n_components": [2, 4, 6], "lr__C": [.1, 1., 10.]}, cv=3).fit(X, y)
+        expected = {(p["pca__n_components"], p["lr__C"]): m
+                    for p, m in zip(grid.cv_results_["params"], grid.cv_results_["mean_test_score"])}
+        for p, m in zip(search.cv_results_["params"], search.cv_results_["mean_test_score"]):
+            self.assertAlmostEqual(m, expected[(p["(scale->pca)__pca__n_components"], p["lr__C"])])
+        self.assertEqual(search.best_estimator_.predict(X).shape, y.shape)
+
+
+    def test_settings_with_the_same_repr_are_fit_apart(self):
+        X, y = make_classification()
+        # the reprs of the two arrays are summarized to the same text
+        small, large = np.zeros(2000), np.zeros(2000)
+        large[1000] = 100.
+        self.assertEqual(repr(small), repr(large))
+        name, pipe = sku.link_pipes(("shift", FunctionTransformer(shift_columns)), ("lr", LogisticRegression()))
+        search = sku.PrefixGridSearch((name, pipe), {"shift__kw_args": [{"offsets": small}, {"offsets": large}],
+                                                      "lr__C": [.1, 1.]}, cv=3).fit(X, y)
+        self.assertEqual(search.n_prefix_fits_, 2 * 3)
+        self.assertNotEqual(search.cv_results_["mean_test_score"][0], search.cv_results_["mean_test_score"][1])
+
+
+class ParallelFeatureUnionTestCase(unittest.TestCase):
+    """
+    Tests for union_pipes with a parallel backend
+    """
+    def test_matches_feature_union(self):
+        X, y = make_classification()
+        name, union = sku.union_pipes(("scale", StandardScaler()), ("pca", PCA(3)), backend="thread")
+        expected = FeatureUnion([("scale", StandardScaler()), ("pca", PCA(3))]).fit(X)
+        np.testing.assert_allclose(union.fit_transform(X), expected.transform(X))
+        np.testing.assert_allclose(union.transform(X), expected.transform(X))
+        self.assertEqual(name, "(scale||pca)")
+        self.assertEqual(set(union.branch_times_), {"scale", "pca"})
+
+    def test_refit_streams_and_handles_changed_widths(self):
+        X, y = make_classification()
+        union = sku.ParallelFeatureUnion([("scale", StandardScaler()), ("pca", PCA(3))])
+        first = union.fit_transform(X)
+        np.testing.assert_allclose(union.fit_transform(X), first)
+        union.set_params(pca__n_components=5)
+        expected = FeatureUnion([("scale", StandardScaler()), ("pca", PCA(5))]).fit_transform(X)
+        np.testing.assert_allclose(union.fit_transform(X), expected)
+        self.assertEqual(list(union.branch_widths_.values()), [8, 5])
+
+    def test_fit_params_go_to_every_branch(self):
+        X, y = make_classification()
+        weights = np.arange(len(X)) % 3 + 1.
+        branches = [("scale", StandardScaler()), ("center", StandardScaler(with_std=False))]
+        expected = FeatureUnion(branches).fit_transform(X, sample_weight=weights)
+        union = sku.ParallelFeatureUnion([(name, StandardScaler(**trans.get_params())) for name, trans in branches])
+        np.testing.assert_allclose(union.fit_transform(X, sample_weight=weights), expected)
+        np.testing.assert_allclose(union.fit(X, sample_weight=weights).transform(X), expected)
+
+    def test_transform_upcasts_a_wider_dtype(self):
+        X, y = make_classification()
+        union = sku.ParallelFeatureUnion([("identity", FunctionTransformer()), ("scale", StandardScaler())])
+        self.assertEqual(union.fit_transform(X.astype(np.float32)).dtype, np.float32)
+        Xt = union.transform(X)
+        self.assertEqual(Xt.dtype, np.float64)
+        np.testing.assert_array_equal(Xt[:, :X.shape[1]], X)
+
+    def test_sparse_branch_gives_sparse_output(self):
+        X = np.round(make_classification()[0][:, :2], 1)
+        union = sku.ParallelFeatureUnion([("scale", StandardScaler()), ("onehot", OneHotEncoder())])
+        self.assertTrue(sparse.issparse(union.fit_transform(X)))
+        self.assertTrue(sparse.issparse(union.transform(X)))
+
+
+class CompileTreeTestCase(unittest.TestCase):
+    """
+    Tests for compiling trees into batch predictors
+    """
+    def test_classifier_matches_predict(self):
+        X, y = make_classification()
+        tree = DecisionTreeClassifier(max_depth=6).fit(X, y)
+        predictor = sku.compile_tree(tree)
+        np.testing.assert_array_equal(predictor(X), tree.predict(X))
+        np.testing.assert_array_equal(predictor.predict_proba(X), tree.predict_proba(X))
+        self.assertTrue(predictor.source.startswith("def tree(x0, x1"))
+
+    def test_regressor_matches_predict(self):
+        X, y = make_classification()
+        tree = DecisionTreeRegressor().fit(X, X.sum(axis=1))
+        np.testing.assert_array_equal(sku.compile_tree(tree)(X[::-1]), tree.predict(X[::-1]))
+
+    def test_source_matches_predict(self):
+        X, y = make_classification()
+        X = X.astype(np.float32)
+        labels = np.array(["no", "yes"])[y]
+        for tree in (DecisionTreeClassifier(max_depth=4).fit(X, labels), DecisionTreeRegressor(max_depth=4).fit(X, X[:, 0])):
+            namespace = {}
+            exec(sku.compile_tree(tree).source, namespace)
+            scored = [namespace["tree"](*row) for row in X]
+            np.testing.assert_array_equal(np.array(scored), tree.predict(X))
+
+
+class PackedEnsembleTestCase(unittest.TestCase):
+    """
+    Tests for the packed tree ensemble engine
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_forest_matches_sklearn(self):
+        X, y = make_classification()
+        forest = RandomForestClassifier(n_estimators=20, random_state=0).fit(X, y)
+        packed = sku.pack_ensemble(forest)
+        np.testing.assert_array_equal(packed.predict(X, n_jobs=2, block_size=64), forest.predict(X))
+        np.testing.assert_array_equal(packed.predict_proba(X), forest.predict_proba(X))
+
+    def test_gradient_boosting_matches_sklearn(self):
+        X, y = make_classification()
+        clf = GradientBoostingClassifier(n_estimators=30).fit(X, y)
+        np.testing.assert_array_equal(sku.pack_ensemble(clf).predict_proba(X), clf.predict_proba(X))
+        reg = GradientBoostingRegressor(n_estimators=30).fit(X, X.sum(axis=1))
+        np.testing.assert_array_equal(sku.pack_ensemble(reg).predict(X), reg.predict(X))
+
+    def test_saved_model_loads_memory_mapped(self):
+        X, y = make_classification()
+        forest = RandomForestClassifier(n_estimators=5, random_state=0).fit(X, y)
+        sku.pack_ensemble(forest).save(self.directory)
+        loaded = sku.PackedEnsemble.load(self.directory)
+        self.assertIsInstance(loaded.nodes, np.memmap)
+        np.testing.assert_array_equal(loaded.predict(X), forest.predict(X))
+
+
+class ProfilePipelineTestCase(unittest.TestCase):
+    """
+    Tests for profile_pipeline
+    """
+    def test_report_follows_pipeline_tree(self):
+        X, y = make_classification()
+        prep = sku.union_pipes(("scale", StandardScaler()), ("pca", PCA(n_components=2)))
+        name, profiled = sku.profile_pipeline(sku.link_pipes(prep, ("lr", LogisticRegression())))
+        profiled.fit(X, y)
+        np.testing.assert_array_equal(profiled.predict(X), profiled.estimator.predict(X))
+        report = profiled.report()
+        self.assertEqual(list(report["step"].str.strip().unique()), [name, "(scale||pca)", "scale", "pca", "lr"])
+        pca = report[(report["step"].str.strip() == "pca") & (report["method"] == "fit_transform")].iloc[0]
+        self.assertEqual(pca["input_shape"], (300, 8))
+        self.assertEqual(pca["output_shape"], (300, 2))
+        self.assertTrue(pca["peak_mb"] > 0)
+
+
+class StreamingTestCase(unittest.TestCase):
+    """
+    Tests for partial_fit_pipeline and stream_transform
+    """
+    def test_fit_and_score_in_batches(self):
+        X, y = make_classification()
+        df = pd.DataFrame(X, columns=["x%d" % i for i in range(X.shape[1])])
+        df["y"] = y
+        batches = [df.iloc[i:i + 100] for i in range(0, len(df), 100)]
+        pipe = sku.link_pipes(("scale", StandardScaler()), ("clf", SGDClassifier(random_state=0)))
+        sku.partial_fit_pipeline(pipe, iter(batches), target="y", classes=[0, 1])
+        np.testing.assert_allclose(pipe[1].steps[0][1].mean_, X.mean(axis=0))
+
+        written = []
+        n = sku.stream_transform(pipe, iter(batches), written.append, method="predict", target="y")
+        self.assertEqual(n, len(df))
+        out = pd.concat(written)
+        np.testing.assert_array_equal(out["predict"].values, pipe[1].predict(X))
+        self.assertTrue(out.index.equals(df.index))
+
+    def test_keep_columns_are_copied_to_the_ldjson_sink(self):
+        X, y = make_classification()
+        df = pd.DataFrame(X, columns=["x%d" % i for i in range(X.shape[1])])
+        pipe = sku.link_pipes(("scale", StandardScaler()), ("clf", LogisticRegression()))
+        pipe[1].fit(df, y)
+        df["id"] = np.arange(len(df)) + 1000
+        batches = [df.iloc[i:i + 100] for i in range(0, len(df), 100)]
+        # by default the batches go to the model as they are, id included
+        with self.assertRaises(ValueError):
+            list(sku.iter_transform(pipe, iter(batches), method="predict", keep_columns=["id"], prefetch_depth=0))
+        path = os.path.join(tempfile.mkdtemp(), "scores.ldjson")
+        try:
+            sku.stream_transform(pipe, iter(batches), sku.LDJSONSink(path), method="predict", keep_columns=["id"],
+                                 drop_keep_columns=True)
+            out = pd.read_json(path, lines=True)
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+        self.assertEqual(list(out.columns), ["id", "predict"])
+        np.testing.assert_array_equal(out["id"].values, df["id"].values)
+        np.testing.assert_array_equal(out["predict"].values, pipe[1].predict(df.drop(columns="id")))
+
+    def test_final_step_without_partial_fit_raises(self):
+        X, y = make_classification()
+        pipe = sku.link_pipes(("scale", StandardScaler()), ("clf", LogisticRegression()))
+        with self.assertRaisesRegex(TypeError, "clf"):
+            sku.partial_fit_pipeline(pipe, [(X, y)], prefetch_depth=0)
+
+
+class PersistenceTestCase(unittest.TestCase):
+    """
+    Tests for save_pipeline and load_pipeline
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_large_arrays_load_memory_mapped(self):
+        X, y = make_classification(n=300, p=40)
+        pipe = sku.link_pipes(("pca", PCA(n_components=30)), ("lr", LogisticRegression()))
+        pipe[1].fit(X, y)
+        path = self.directory + "/model"
+        self.assertTrue(sku.save_pipeline(pipe, path, min_bytes=1024) > 0)
+        name, loaded = sku.load_pipeline(path)
+        self.assertEqual(name, pipe[0])
+        self.assertIsInstance(loaded.steps[0][1].components_, np.memmap)
+        np.testing.assert_array_equal(loaded.predict(X), pipe[1].predict(X))
+        self.assertRaises(IOError, sku.save_pipeline, pipe, path)
+
+    def test_overwrite_removes_only_the_old_arrays(self):
+        X, y = make_classification(n=300, p=40)
+        pipe = PCA(n_components=30).fit(X)
+        path = self.directory + "/model"
+        os.makedirs(os.path.join(path, "arrays"))
+        with open(os.path.join(path, "arrays", "00000.npy"), "wb") as f:
+            f.write(b"not from save_pipeline")
+        sku.save_pipeline(pipe, path, min_bytes=1024)
+        before = set(os.listdir(path))
+        # an unfinished save leaves its arrays without a pickle pointing to them
+        os.remove(os.path.join(path, "pipeline.p"))
+        sku.save_pipeline(pipe, path, min_bytes=1024)
+        sku.save_pipeline(pipe, path, min_bytes=1024, overwrite=True)
+        after = set(os.listdir(path))
+        self.assertEqual(len(after), 3)
+        self.assertFalse(before & after - {"arrays", "pipeline.p"})
+        self.assertEqual(os.listdir(os.path.join(path, "arrays")), ["00000.npy"])
+        np.testing.assert_array_equal(sku.load_pipeline(path).transform(X), pipe.transform(X))
+
+
+class ServingTestCase(unittest.TestCase):
+    """
+    Tests for MicroBatcher and the Unix socket scoring server
+    """
+    def setUp(self):
+        X, y = make_classification()
+        self.X = pd.DataFrame(X, columns=["x%d" % i for i in range(X.shape[1])])
+        self.pipe = sku.link_pipes(("scale", StandardScaler()), ("lr", LogisticRegression()))
+        self.pipe[1].fit(self.X, y)
+        self.rows = self.X.to_dict("records")
+        self.expected = list(self.pipe[1].predict(self.X))
+
+    def test_rows_are_batched(self):
+        with sku.MicroBatcher(self.pipe, max_batch_size=50, max_delay=0.5) as batcher:
+            futures = [batcher.submit(row) for row in self.rows]
+            self.assertEqual([f.result() for f in futures], self.expected)
+        self.assertEqual(batcher.n_batches, 6)
+
+    def test_bad_row_only_fails_its_caller(self):
+        with sku.MicroBatcher(self.pipe, max_delay=0.5) as batcher:
+            good, bad = batcher.submit(self.rows[0]), batcher.submit({"other": 1})
+            self.assertEqual(good.result(), self.expected[0])
+            self.assertIsNotNone(bad.exception())
+
+    def test_submit_after_close_raises(self):
+        batcher = sku.MicroBatcher(self.pipe)
+        self.assertEqual(batcher.predict(self.rows[0], timeout=10), self.expected[0])
+        batcher.close()
+        batcher.close()
+        self.assertRaises(RuntimeError, batcher.submit, self.rows[0])
+
+    def test_socket_round_trip(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = directory + "/model.sock"
+            with sku.MicroBatcher(self.pipe) as batcher, sku.ScoringServer(batcher, path):
+                with sku.ScoringClient(path, timeout=10) as client:
+                    self.assertEqual(client.predict_many(self.rows), self.expected)
+                    self.assertRaises(ValueError, client.predict, {"other": 1})
+                    self.assertEqual(client.predict(self.rows[1]), self.expected[1])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__=="__main__":
+    unittest.main()
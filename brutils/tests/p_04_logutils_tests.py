@@ -0,0 +1,346 @@
+from .. import logutils
+from ..logutils import br_logging
+import unittest
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+import os
+import shutil
+import tempfile
+import glob
+import sys
+import datetime
+import gzip
+
+SHA = "0123456789abcdef0123456789abcdef01234567"
+
+
+class GitMetadataTestCase(unittest.TestCase):
+    """
+    Tests for reading the git commit hash without GitPython
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.git_dir = os.path.join(self.directory, ".git")
+        os.makedirs(os.path.join(self.git_dir, "refs", "heads"))
+        with open(os.path.join(self.git_dir, "HEAD"), "w") as f:
+            f.write("ref: refs/heads/master\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_loose_ref(self):
+        with open(os.path.join(self.git_dir, "refs", "heads", "master"), "w") as f:
+            f.write(SHA + "\n")
+        self.assertEqual(br_logging.git_head_hash(self.directory), SHA)
+
+    def test_packed_ref(self):
+        with open(os.path.join(self.git_dir, "packed-refs"), "w") as f:
+            f.write("# pack-refs with: peeled fully-peeled sorted\n%s refs/heads/master\n" % SHA)
+        self.assertEqual(br_logging.git_head_hash(self.directory), SHA)
+
+    def test_repo_root_is_cached(self):
+        sub = os.path.join(self.directory, "a", "b")
+        os.makedirs(sub)
+        self.assertEqual(br_logging.find_repo_root(sub), self.directory)
+        shutil.rmtree(self.git_dir)
+        self.assertEqual(br_logging.find_repo_root(os.path.join(self.directory, "a")), self.directory)
+
+
+class _Collect(logging.Handler):
+    def __init__(self, delay=0):
+        logging.Handler.__init__(self)
+        self.delay = delay
+        self.messages = []
+
+    def emit(self, record):
+        time.sleep(self.delay)
+        self.messages.append(self.format(record))
+
+
+@logutils.logged_task
+def log_in_worker(i):
+    logging.info("item %s", i)
+    return i
+
+
+class RootLoggerTestCase(unittest.TestCase):
+    """
+    Base for tests that change the root logger's handlers, restores them afterwards
+    """
+    def setUp(self):
+        self.root = logging.getLogger('')
+        self.saved = self.root.handlers[:], self.root.level
+        for h in self.saved[0]:
+            self.root.removeHandler(h)
+        self.root.setLevel(logging.INFO)
+
+    def tearDown(self):
+        br_logging.stop_listener()
+        for h in self.root.handlers[:]:
+            self.root.removeHandler(h)
+        for h in self.saved[0]:
+            self.root.addHandler(h)
+        self.root.setLevel(self.saved[1])
+
+
+class NonBlockingTestCase(RootLoggerTestCase):
+    """
+    Tests for the queue based non_blocking logging mode
+    """
+    def test_records_are_written_when_stopped(self):
+        collect = _Collect(delay=0.001)
+        self.root.addHandler(collect)
+        br_logging._make_non_blocking(100, "block")
+        for i in range(50):
+            logging.info("row %s", i)
+        br_logging.stop_listener()
+        self.assertEqual(collect.messages, ["row %s" % i for i in range(50)])
+        self.assertEqual(self.root.handlers, [collect])
+
+    def test_drop_policy_counts_dropped_records(self):
+        collect = _Collect(delay=0.01)
+        self.root.addHandler(collect)
+        br_logging._make_non_blocking(2, "drop")
+        for i in range(20):
+            logging.info("row %s", i)
+        br_logging.stop_listener()
+        self.assertTrue(len(collect.messages) < 20)
+        self.assertIn("were dropped because the logging queue was full", collect.messages[-1])
+
+
+class LogAggregatorTestCase(RootLoggerTestCase):
+    """
+    Tests for forwarding worker process logs to the parent
+    """
+    def test_worker_records_reach_parent_handlers(self):
+        collect = _Collect()
+        self.root.addHandler(collect)
+        for transport in ("queue", "socket"):
+            with logutils.LogAggregator(transport=transport) as aggregator:
+                with ProcessPoolExecutor(2, **aggregator.pool_kwargs()) as executor:
+                    self.assertEqual(list(executor.map(log_in_worker, range(4))), list(range(4)))
+        self.assertEqual(len(collect.messages), 8)
+        self.assertEqual(sorted(m.split("] ")[1] for m in collect.messages), sorted(["item %s" % i for i in range(4)] * 2))
+        self.assertTrue(all(m.startswith("[pid ") and " task " in m for m in collect.messages))
+
+
+class SpanTestCase(unittest.TestCase):
+    """
+    Tests for timing spans
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "run.spans.jsonl")
+
+    def tearDown(self):
+        logutils.close_spans()
+        shutil.rmtree(self.directory)
+
+    def test_nested_spans_are_written(self):
+        @logutils.span("inner")
+        def inner():
+            return 1
+
+        inner()
+        logutils.configure_spans(self.path)
+        with logutils.span("outer", source="test") as s:
+            s.add_rows(5)
+            inner()
+        try:
+            with logutils.span("fails"):
+                raise ValueError("x")
+        except ValueError:
+            pass
+        logutils.close_spans()
+        records = dict((r["name"], r) for r in logutils.read_spans(self.path))
+        self.assertEqual(sorted(records), ["fails", "inner", "outer"])
+        self.assertEqual(records["inner"]["parent"], records["outer"]["id"])
+        self.assertEqual(records["outer"]["rows"], 5)
+        self.assertEqual(records["outer"]["tags"], {"source": "test"})
+        self.assertEqual(records["fails"]["status"], "error")
+
+    def test_sampling_skips_whole_trees(self):
+        logutils.configure_spans(self.path, sample_rate=0.0)
+        with logutils.span("outer"):
+            with logutils.span("inner"):
+                pass
+        logutils.close_spans()
+        self.assertEqual(list(logutils.read_spans(self.path)), [])
+
+
+class ResourceSamplerTestCase(unittest.TestCase):
+    """
+    Tests for the resource sampler
+    """
+    def test_samples_and_peak_summary(self):
+        logger = logging.getLogger("brutils.tests.resources")
+        logger.propagate = False
+        collect = _Collect()
+        logger.addHandler(collect)
+        logger.setLevel(logging.INFO)
+        sampler = logutils.ResourceSampler(interval=0.05, logger=logger).start()
+        time.sleep(0.2)
+        sampler.stop()
+        sampler.stop()
+        self.assertTrue(sampler.samples >= 3)
+        self.assertTrue(collect.messages[0].startswith("resources rss="))
+        self.assertTrue(collect.messages[-1].startswith("resource peaks over"))
+        self.assertEqual(sum(m.startswith("resource peaks") for m in collect.messages), 1)
+        self.assertTrue(sampler.peaks["rss_mb"] > 0)
+
+
+class AnalyzeLogTestCase(unittest.TestCase):
+    """
+    Tests for the log analyzer
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_log(self, name, start, lines, commit="abc123"):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write("Script full path: /jobs/p_01_script.py\n")
+            f.write("Script Git Commit hash: %s\n" % commit)
+            f.write("Script start time: %s\n\nSCRIPT LOG:\n" % start)
+            f.write("\n".join(lines) + "\n")
+        return path
+
+    def test_gaps_are_charged_to_the_earlier_file(self):
+        path = self.write_log("a.log", "2016-07-14 18:42:18.000000", [
+            "2016-07-14 18:42:18,500 - p_01_script.py - INFO - loading",
+            "2016-07-14 18:42:21,500 - p_02_support.py - ERROR - failed",
+            "Traceback (most recent call last):",
+            "ValueError: x",
+            "2016-07-14 18:42:22,000 - p_01_script.py - INFO - done",
+        ])
+        profile = logutils.analyze_log(path, top=1)
+        self.assertEqual(profile["commit"], "abc123")
+        self.assertEqual(profile["records"], 3)
+        self.assertEqual(profile["levels"], {"INFO": 2, "ERROR": 1})
+        self.assertAlmostEqual(profile["seconds"], 4.0)
+        self.assertAlmostEqual(profile["by_file"]["p_01_script.py"]["seconds"], 3.0)
+        self.assertAlmostEqual(profile["by_file"]["p_02_support.py"]["seconds"], 0.5)
+        self.assertEqual(len(profile["slowest"]), 1)
+        self.assertEqual(profile["slowest"][0]["message"], "loading")
+
+    def test_start_time_without_microseconds(self):
+        path = self.write_log("a.log", "2016-07-14 18:42:18", [
+            "2016-07-14 18:42:19,000 - p_01_script.py - INFO - done"])
+        self.assertEqual(logutils.read_header(path)["start"], datetime.datetime(2016, 7, 14, 18, 42, 18))
+        self.assertAlmostEqual(logutils.analyze_log(path)["seconds"], 1.0)
+
+    def test_compare_runs_orders_by_start_time(self):
+        later = self.write_log("b.log", "2016-07-15 10:00:00.000000", [
+            "2016-07-15 10:00:01,000 - p_01_script.py - INFO - done"], commit="def456")
+        earlier = self.write_log("a.log", "2016-07-14 10:00:00.000000", [
+            "2016-07-14 10:00:03,000 - p_01_script.py - INFO - done"])
+        runs = logutils.compare_runs([later, earlier])["/jobs/p_01_script.py"]
+        self.assertEqual([r["path"] for r in runs], [earlier, later])
+        self.assertIsNone(runs[0]["change"])
+        self.assertAlmostEqual(runs[1]["change"], -2.0)
+
+
+class BufferedRotatingFileHandlerTestCase(unittest.TestCase):
+    """
+    Tests for the buffered, rotating log file handler
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "run.log")
+        self.logger = logging.getLogger("brutils.tests.rotating")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        for h in self.logger.handlers[:]:
+            self.logger.removeHandler(h)
+            h.close()
+        shutil.rmtree(self.directory)
+
+    def add_handler(self, **kwargs):
+        handler = logutils.BufferedRotatingFileHandler(self.path, **kwargs)
+        handler.setFormatter(logging.Formatter("%(levelname)s - %(message)s"))
+        self.logger.addHandler(handler)
+        return handler
+
+    def read(self):
+        with open(self.path) as f:
+            return f.read().splitlines()
+
+    def test_buffers_until_full_or_error(self):
+        self.add_handler(buffer_records=3, flush_interval=None)
+        self.logger.info("a")
+        self.logger.info("b")
+        self.assertEqual(self.read(), [])
+        self.logger.error("c")
+        self.assertEqual(self.read(), ["INFO - a", "INFO - b", "ERROR - c"])
+        self.logger.info("d")
+        self.logger.info("e")
+        self.logger.info("f")
+        self.assertEqual(len(self.read()), 6)
+
+    def test_rotates_and_compresses_segments(self):
+        handler = self.add_handler(max_bytes=100, backup_count=2, buffer_records=50, flush_interval=None)
+        for i in range(60):
+            self.logger.info("message %02d" % i)
+        handler.close()
+        segments = sorted(f for f in os.listdir(self.directory) if f != "run.log")
+        self.assertEqual(segments, ["run.log.00010.gz", "run.log.00011.gz"])
+        with gzip.open(os.path.join(self.directory, segments[-1]), "rt") as f:
+            last_segment = f.read().splitlines()
+        self.assertTrue(all(len(line) + 1 <= 100 for line in last_segment))
+        self.assertEqual(self.read()[-1], "INFO - message 59")
+        self.assertTrue(os.path.getsize(self.path) <= 100)
+
+
+class SetupLoggingRotationTestCase(RootLoggerTestCase):
+    """
+    Tests for setup_logging with buffered, rotated log files
+    """
+    def setUp(self):
+        RootLoggerTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "run.log")
+        self.excepthook = sys.excepthook
+
+    def tearDown(self):
+        for h in self.root.handlers[:]:
+            h.close()
+        RootLoggerTestCase.tearDown(self)
+        sys.excepthook = self.excepthook
+        shutil.rmtree(self.directory)
+
+    def setup(self, **kwargs):
+        br_logging.setup_logging(filename=self.path, **kwargs)
+        for h in self.root.handlers[:]:
+            if type(h) is logging.StreamHandler:
+                self.root.removeHandler(h)
+
+    def test_every_kept_segment_has_the_header(self):
+        self.setup(buffer_records=100, max_bytes=2000, backup_count=3)
+        for i in range(200):
+            logging.info("row %s", i)
+        for h in self.root.handlers[:]:
+            h.close()
+        paths = sorted(glob.glob(self.path + "*"))
+        self.assertEqual(len(paths), 4)
+        for path in paths:
+            self.assertEqual(logutils.read_header(path)["script"], os.path.abspath(sys.argv[0]))
+        runs = list(logutils.compare_runs(paths).values())
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(len(runs[0]), 1)
+        self.assertEqual(runs[0][0]["segments"], 4)
+
+    def test_warns_when_root_logger_is_configured(self):
+        collect = _Collect()
+        self.root.addHandler(collect)
+        self.setup(buffer_records=100)
+        self.assertIn("buffer_records and max_bytes are ignored", collect.messages[0])
+
+
+if __name__=="__main__":
+    unittest.main()